@@ -0,0 +1,68 @@
+"""
+Benchmark the per-append cost of ConversationHistory at its token limit.
+
+For each history size, fills a history with that many messages, caps its
+token budget at the current count so every further append has to prune,
+and reports the mean cost of those appends. The cost should stay flat as
+the history grows. The second column repeats this with tool outputs sent
+through a BlockStore, so pruning also expands references to pruned blocks.
+
+Usage:
+    python benchmarks/bench_history.py [max_messages]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollamacode.conversation import ConversationHistory, estimate_tokens
+from ollamacode.blockstore import BlockStore
+
+SAMPLE_MESSAGES = [
+    ("user", "Please look at the build output and tell me what failed."),
+    ("assistant", "Let me check.\n```bash\nmake 2>&1 | tail -n 20\n```"),
+    ("user", "## Bash Command Result: `make`\n\n**Output:**\n```\n" + "cc -c src/file.c\n" * 20 + "```\n"),
+    ("assistant", "The important part is the linker error at the end; remember to add the library."),
+]
+
+
+def sample_message(index: int, blocks: BlockStore = None):
+    """Get the index-th message; with a BlockStore, tool outputs repeat and change every few turns"""
+    role, content = SAMPLE_MESSAGES[index % len(SAMPLE_MESSAGES)]
+    if blocks is not None and index % len(SAMPLE_MESSAGES) == 2:
+        command = f"make target{index % 40}"
+        output = "".join(f"cc -c src/file{line}.c -o build/{index // 400}/file{line}.o\n" for line in range(20))
+        content = f"## Bash Command Result: `{command}`\n\n" + blocks.render(f"bash:{command}", output)
+    return role, content
+
+
+def time_appends(size: int, appends: int, with_blocks: bool) -> float:
+    history = ConversationHistory(max_tokens=10 ** 9, system_prompt="You are a helpful assistant.")
+    blocks = None
+    if with_blocks:
+        blocks = BlockStore(estimate_tokens)
+        history.blockstore = blocks
+    for index in range(size):
+        history.add_message(*sample_message(index, blocks))
+    history.max_tokens = history.current_token_count
+
+    start = time.perf_counter()
+    for index in range(size, size + appends):
+        history.add_message(*sample_message(index, blocks))
+    return (time.perf_counter() - start) / appends * 1e6
+
+
+def bench(max_messages: int = 10000, appends: int = 200):
+    sizes = [size for size in (100, 1000, 2000, 5000, 10000, 20000) if size <= max_messages]
+    print(f"{'history size':>13}{'us/append':>12}{'with blocks':>13}")
+
+    for size in sizes:
+        plain = time_appends(size, appends, False)
+        with_blocks = time_appends(size, appends, True)
+        print(f"{size:>13}{plain:>12.1f}{with_blocks:>13.1f}")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
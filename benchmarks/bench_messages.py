@@ -0,0 +1,98 @@
+"""
+Benchmark the memory use and append time of conversation messages.
+
+Compares the slotted Message, which stores its timestamp as epoch seconds,
+with the previous implementation (a plain class holding a datetime), which
+is reproduced here as LegacyMessage. Both include the importance check.
+
+Usage:
+    python benchmarks/bench_messages.py [messages]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollamacode.conversation import ConversationHistory, Message, estimate_tokens
+
+SAMPLE_MESSAGES = [
+    ("user", "Please look at the build output and tell me what failed."),
+    ("assistant", "Let me check.\n```bash\nmake 2>&1 | tail -n 20\n```"),
+    ("user", "## Bash Command Result: `make`\n\n**Output:**\n```\n" + "cc -c src/file.c\n" * 200 + "```\n"),
+    ("assistant", "The linker error at the end is what matters; " * 40 + "remember to add the library."),
+]
+
+
+class LegacyMessage:
+    """The message class before slots"""
+
+    def __init__(self, role, content, timestamp=None):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp or datetime.now()
+        self.token_estimate = estimate_tokens(content)
+        self.importance = 1.0
+
+
+def legacy_adjust_importance(message):
+    content = message.content.lower()
+    if "```" in content:
+        message.importance = 1.5
+    if any(indicator in content for indicator in ["important", "remember", "note", "key"]):
+        message.importance = 1.7
+    if len(content) > 1000 and message.role == "assistant":
+        message.importance = 1.3
+    if (message.role == "assistant" and
+            ("executing tool" in content or "executing bash" in content)):
+        message.importance = 1.6
+
+
+def create_current(count):
+    history = ConversationHistory(max_tokens=10 ** 12)
+    messages = []
+    for index in range(count):
+        role, content = SAMPLE_MESSAGES[index % len(SAMPLE_MESSAGES)]
+        message = Message(role, content)
+        history._adjust_importance(message)
+        messages.append(message)
+    return messages
+
+
+def create_legacy(count):
+    messages = []
+    for index in range(count):
+        role, content = SAMPLE_MESSAGES[index % len(SAMPLE_MESSAGES)]
+        message = LegacyMessage(role, content)
+        legacy_adjust_importance(message)
+        messages.append(message)
+    return messages
+
+
+def measure(create, count):
+    """Get (bytes allocated per message, microseconds per message)"""
+    tracemalloc.start()
+    messages = create(count)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+
+    start = time.perf_counter()
+    create(count)
+    elapsed = time.perf_counter() - start
+    return allocated / count, elapsed / count * 1e6
+
+
+def bench(count: int = 100000):
+    print(f"{count} messages (contents shared between messages)")
+    print(f"{'implementation':<16}{'bytes/msg':>12}{'us/msg':>10}")
+    for name, create in (("legacy", create_legacy), ("current", create_current)):
+        per_message, per_append = measure(create, count)
+        print(f"{name:<16}{per_message:>12.0f}{per_append:>10.2f}")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,43 @@
+"""
+Benchmark the search cost of RetrievalIndex as the number of chunks grows.
+
+Fills an index with random unit vectors (no Ollama needed) and reports the
+mean time of a top-k search. With the default 256 dimensions a search over
+50k chunks should take a few milliseconds.
+
+Usage:
+    python benchmarks/bench_retrieval.py [dimensions]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollamacode.retrieval import RetrievalIndex
+
+
+def bench(dimensions: int = 256, searches: int = 50):
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8}{'ms/search':>12}")
+
+    for size in (1000, 10000, 50000, 100000):
+        index = RetrievalIndex(None, {"retrieval_cache_path": ":memory:"})
+        vectors = rng.standard_normal((size, dimensions)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index._add(vectors, [("user", "", 0.0)] * size)
+
+        queries = vectors[rng.integers(0, size, searches)]
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, index.top_k)
+        elapsed = time.perf_counter() - start
+        print(f"{size:>8}{elapsed / searches * 1000:>12.2f}")
+        index.close()
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 256)
@@ -0,0 +1,47 @@
+"""
+Benchmark per-command overhead of a persistent shell against spawning one.
+
+Runs a few trivial commands many times, once through run_process with a
+new /bin/sh per command (the default) and once through a ShellSession
+(persistent_shell), and reports the mean wall time per command.
+
+Usage:
+    python benchmarks/bench_shell.py [runs]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollamacode.process import run_process
+from ollamacode.shell import ShellSession
+
+COMMANDS = ["true", "echo hello", "ls", "cd /tmp && pwd"]
+
+
+def bench(runs: int = 200):
+    cwd = tempfile.mkdtemp()
+    session = ShellSession(cwd)
+    session.run("true")  # Start the shell outside the measurement
+
+    print(f"{'command':<16}{'spawn ms':>10}{'session ms':>12}")
+    for command in COMMANDS:
+        start = time.perf_counter()
+        for _ in range(runs):
+            run_process(command, shell=True, cwd=cwd, timeout=30)
+        spawn = (time.perf_counter() - start) / runs * 1000
+
+        start = time.perf_counter()
+        for _ in range(runs):
+            session.run(command, timeout=30)
+        persistent = (time.perf_counter() - start) / runs * 1000
+        print(f"{command:<16}{spawn:>10.2f}{persistent:>12.2f}")
+
+    session.close()
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
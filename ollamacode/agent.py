@@ -0,0 +1,266 @@
+"""
+Agent loop engine for OllamaCode.
+
+Runs a prompt as a sequence of steps: each step sends the conversation to
+the model, executes the bash commands and tools in the reply, and appends the
+results to the conversation for the next step. The loop stops when the model
+stops asking for commands, or when a step, token or wall-clock budget runs out.
+"""
+
+import time
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from .utils import Colors
+from .transport import OllamaAPIError
+from .streaming import PipelinedExecutor
+
+
+class AgentStep:
+    """Timing and accounting for one model request in an agent run"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.request_time = 0.0  # Seconds spent streaming the model's reply
+        self.tool_time = 0.0  # Seconds spent running commands and tools
+        self.tokens = 0
+        self.results = 0
+        self.stopped_early = False
+        self.prompt_eval_count: Optional[int] = None
+        self.prompt_eval_duration: Optional[float] = None
+        self.prefix_kept: Optional[bool] = None
+
+    @property
+    def duration(self) -> float:
+        return self.request_time + self.tool_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "request_time": round(self.request_time, 3),
+            "tool_time": round(self.tool_time, 3),
+            "tokens": self.tokens,
+            "results": self.results,
+            "stopped_early": self.stopped_early,
+            "prompt_eval_count": self.prompt_eval_count,
+            "prompt_eval_duration": self.prompt_eval_duration,
+            "prefix_kept": self.prefix_kept
+        }
+
+
+class AgentRun:
+    """Outcome of running one prompt through the agent loop"""
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.steps: List[AgentStep] = []
+        self.responses: List[str] = []
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def response(self) -> str:
+        """The model's replies from all steps"""
+        return "\n\n".join(self.responses)
+
+    @property
+    def tokens(self) -> int:
+        return sum(step.tokens for step in self.steps)
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.monotonic()
+
+
+class AgentLoop:
+    """Drives a prompt through model requests and tool follow-ups
+
+    Budgets come from the configuration:
+        agent_max_steps: Maximum model requests per prompt
+            (defaults to max_followup_depth + 1)
+        agent_max_tokens: Maximum generated tokens per prompt (0 = unlimited)
+        agent_max_seconds: Maximum wall-clock time per prompt (0 = unlimited)
+    """
+
+    def __init__(self, client, config: Dict[str, Any], logger: Optional[logging.Logger] = None):
+        self.client = client
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Cancel the current run; safe to call from another thread"""
+        self._cancel.set()
+
+    @property
+    def max_steps(self) -> int:
+        default = self.config.get("max_followup_depth", 2) + 1
+        return max(1, int(self.config.get("agent_max_steps", default)))
+
+    def _budget_exceeded(self, run: AgentRun) -> Optional[str]:
+        """Get the status for an exhausted budget, or None if the run may continue"""
+        if self._cancel.is_set():
+            return "cancelled"
+        max_seconds = float(self.config.get("agent_max_seconds", 0))
+        if max_seconds and run.elapsed >= max_seconds:
+            return "time_limit"
+        max_tokens = int(self.config.get("agent_max_tokens", 0))
+        if max_tokens and run.tokens >= max_tokens:
+            return "token_limit"
+        return None
+
+    def run(self, prompt: str, display: bool = True) -> AgentRun:
+        """Run a prompt until the model stops requesting commands or a budget runs out
+
+        Args:
+            prompt: The user's message
+            display: Whether to print replies and command output
+
+        Returns:
+            The finished AgentRun
+        """
+        self._cancel.clear()
+        run = AgentRun(prompt)
+
+        if not self.client.ensure_model_available():
+            run.finish("error", f"Model '{self.config['model']}' not found in Ollama")
+            return run
+
+        conversation = self.client.conversation
+        processor = self.client.processor
+        conversation.add_message("user", prompt)
+
+        try:
+            while True:
+                status = self._budget_exceeded(run)
+                if status:
+                    run.finish(status)
+                    break
+
+                step = AgentStep(len(run.steps))
+                run.steps.append(step)
+                is_last_step = step.index + 1 >= self.max_steps
+
+                # Always process the first reply; later ones only if enabled
+                # and there is a step left to share the results with
+                should_process = step.index == 0 or (
+                    self.config.get("process_followup_commands", False) and not is_last_step
+                )
+
+                reply, pipeline = self._request(run, should_process, display)
+                step.tokens = reply["tokens"]
+                step.stopped_early = reply["stopped_early"]
+                if reply["stats"]:
+                    step.prompt_eval_count = reply["stats"].prompt_eval_count
+                    step.prompt_eval_duration = reply["stats"].prompt_eval_duration
+                    step.prefix_kept = reply["stats"].prefix_kept
+
+                try:
+                    if reply["content"]:
+                        conversation.add_message("assistant", reply["content"])
+                        run.responses.append(reply["content"])
+
+                    if reply["interrupted"]:
+                        run.finish(self._budget_exceeded(run) or "cancelled")
+                        break
+
+                    if not should_process:
+                        run.finish("completed")
+                        break
+
+                    if step.index > 0:
+                        self.logger.info(f"Processing commands in followup response (step: {step.index})")
+                        if display:
+                            print(f"\n{Colors.YELLOW}Processing commands in followup response (step: {step.index})...{Colors.ENDC}")
+
+                    tool_start = time.monotonic()
+                    _, processed_results = processor.process_response(reply["content"], pipeline)
+                    step.tool_time = time.monotonic() - tool_start
+                    step.results = len(processed_results)
+                finally:
+                    if pipeline:
+                        pipeline.shutdown()
+
+                self.logger.info(f"Agent step {step.index}: {step.to_dict()}")
+
+                followup_prompt = processor.format_results_for_followup(processed_results)
+                if not followup_prompt:
+                    run.finish("completed")
+                    break
+
+                # Keep the results in the history so the next step (or the
+                # next prompt, if we stop here) can see them
+                conversation.add_message("user", followup_prompt)
+
+                if is_last_step:
+                    self.logger.warning(f"Maximum agent steps ({self.max_steps}) reached")
+                    run.finish("step_limit")
+                    break
+
+                if display:
+                    print(f"\n{Colors.YELLOW}Sharing command/tool results with the model...{Colors.ENDC}")
+
+        except KeyboardInterrupt:
+            run.finish("cancelled")
+        except (requests.RequestException, OllamaAPIError) as e:
+            error_msg = f"Error communicating with Ollama: {e}"
+            self.logger.error(error_msg)
+            if display:
+                print(f"{Colors.RED}{error_msg}{Colors.ENDC}")
+                print("Make sure Ollama is running and accessible.")
+            run.finish("error", str(e))
+
+        if display and run.status in ("cancelled", "step_limit", "token_limit", "time_limit"):
+            print(f"{Colors.YELLOW}Agent run stopped: {run.status.replace('_', ' ')}. "
+                  f"Please continue with a new prompt.{Colors.ENDC}")
+
+        self.logger.info(
+            f"Agent run finished: status={run.status}, steps={len(run.steps)}, "
+            f"tokens={run.tokens}, elapsed={run.elapsed:.2f}s"
+        )
+        return run
+
+    def _request(self, run: AgentRun, should_process: bool, display: bool):
+        """Stream one model reply, starting its commands early when pipelining is enabled
+
+        Returns:
+            Tuple of (reply, pipeline)
+        """
+        step = run.steps[-1]
+        pipeline = None
+        if should_process and self.config.get("pipeline_tool_execution", True):
+            pipeline = PipelinedExecutor(
+                self.client.processor,
+                detect_bash=self.config.get("enable_bash", True),
+                detect_tools=self.config.get("enable_tools", True),
+                logger=self.logger
+            )
+
+        request_start = time.monotonic()
+        try:
+            reply = self.client.stream_chat(
+                display=display,
+                pipeline=pipeline,
+                stop_at_tool_call=should_process and self.config.get("stop_at_tool_call", False),
+                should_stop=lambda: self._budget_exceeded(run) is not None,
+                profile="followup" if step.index > 0 else None
+            )
+        except BaseException:
+            if pipeline:
+                pipeline.shutdown()
+            raise
+        finally:
+            step.request_time = time.monotonic() - request_start
+
+        return reply, pipeline
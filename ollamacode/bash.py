@@ -3,14 +3,15 @@ Bash command execution functionality for OllamaCode with enhanced security.
 """
 
 import os
-import subprocess
-import time
 import logging
 from typing import Dict, Any, Optional
 from pathlib import Path
 
 from .utils import Colors
 from .security import SecurityManager
+from .process import run_process, command_limits, OutputCallback
+from .capture import spill_directory
+from .shell import ShellSession
 
 
 class BashExecutor:
@@ -24,6 +25,20 @@ class BashExecutor:
         
         # Initialize security manager
         self.security = SecurityManager(config, logger)
+        
+        # Timeout, output cap and resource limits for each command
+        self.limits = command_limits(config, "bash")
+        # Output beyond the cap is kept in full here for the output_read tool
+        self.spill_dir = spill_directory(self.working_dir) if config.get("output_spill", True) else None
+        
+        # Long-lived bash process that keeps cd, variables and virtualenvs
+        # between commands
+        self.session = None
+        if config.get("persistent_shell", False):
+            if ShellSession.available():
+                self.session = ShellSession(str(self.working_dir), limits=self.limits, logger=self.logger)
+            else:
+                self.logger.warning("persistent_shell needs bash; running each command in a new shell")
     
     def ensure_working_dir(self):
         """Ensure the working directory exists"""
@@ -31,8 +46,13 @@ class BashExecutor:
             self.working_dir.mkdir(parents=True)
             self.logger.info(f"Created working directory: {self.working_dir}")
     
-    def execute_command(self, command: str) -> Dict[str, Any]:
-        """Execute a bash command and return the result"""
+    def execute_command(self, command: str, on_output: Optional[OutputCallback] = None) -> Dict[str, Any]:
+        """Execute a bash command and return the result
+        
+        Args:
+            command: The command to run
+            on_output: Called with ("stdout" or "stderr", text) as output arrives
+        """
         # Check if command is safe to execute
         is_safe, reason = self.security.is_command_safe(command)
         if not is_safe:
@@ -45,54 +65,47 @@ class BashExecutor:
         try:
             self.logger.info(f"Executing command: {command}")
             
-            # Execute the command
-            process = subprocess.Popen(
-                command, 
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=str(self.working_dir)
-            )
-            
-            # Set a timeout for command execution
-            start_time = time.time()
-            max_execution_time = 30  # 30 seconds max
-            
-            stdout, stderr = "", ""
-            
-            # Non-blocking read with timeout
-            while process.poll() is None:
-                # Check if we've exceeded max execution time
-                if time.time() - start_time > max_execution_time:
-                    process.terminate()
-                    self.logger.warning(f"Command timed out after {max_execution_time} seconds: {command}")
-                    return {
-                        "status": "error",
-                        "error": f"Command execution timed out after {max_execution_time} seconds."
-                    }
-                
-                # Wait a bit to avoid busy-waiting
-                time.sleep(0.1)
-            
-            # Get outputs
-            stdout, stderr = process.communicate()
-            
-            # Limit output size to avoid context overflow
-            max_output_size = 10000
-            if len(stdout) > max_output_size:
-                stdout = stdout[:max_output_size] + f"\n... (output truncated, total size: {len(stdout)} bytes)"
+            # Output is drained as it arrives, so commands writing more than
+            # the pipe buffer don't stall until the timeout. Only its head and
+            # tail are kept in memory, to avoid context overflow
+            max_execution_time = float(self.limits["timeout"])
+            capture = {
+                "max_output": int(self.limits["max_output"]),
+                "spill_dir": self.spill_dir,
+                "label": "bash"
+            }
+            if self.session:
+                process = self.session.run(command, timeout=max_execution_time, on_output=on_output, **capture)
+            else:
+                process = run_process(
+                    command,
+                    shell=True,
+                    cwd=str(self.working_dir),
+                    timeout=max_execution_time,
+                    on_output=on_output,
+                    limits=self.limits,
+                    logger=self.logger,
+                    **capture
+                )
             
-            if len(stderr) > max_output_size:
-                stderr = stderr[:max_output_size] + f"\n... (error output truncated, total size: {len(stderr)} bytes)"
+            if process.timed_out:
+                self.logger.warning(f"Command timed out after {max_execution_time:g} seconds: {command}")
+                return {
+                    "status": "error",
+                    "error": f"Command execution timed out after {max_execution_time:g} seconds."
+                }
             
             result = {
                 "status": "success" if process.returncode == 0 else "error",
                 "command": command,
                 "return_code": process.returncode,
-                "stdout": stdout,
-                "stderr": stderr
+                "stdout": process.stdout,
+                "stderr": process.stderr
             }
+            if process.rusage:
+                result["rusage"] = process.rusage
+            if process.handles:
+                result["output_handles"] = process.handles
             
             if process.returncode != 0:
                 self.logger.warning(f"Command failed with return code {process.returncode}: {command}")
@@ -106,4 +119,9 @@ class BashExecutor:
             return {
                 "status": "error",
                 "error": f"Error executing command: {str(e)}"
-            }
\ No newline at end of file
+            }
+    
+    def close(self):
+        """Stop the persistent shell, if any"""
+        if self.session:
+            self.session.close()
@@ -0,0 +1,222 @@
+"""
+Content-addressed store of tool outputs shared with the model.
+
+Agents often read the same file or rerun the same command several times.
+Each large output is tagged with the hash of its content when it is first
+sent; while that message is still in the conversation, an identical output
+is sent as a short reference to it, and a changed output from the same
+source (file, command) as a unified diff against the previous version.
+The conversation history reports which blocks it still holds, so outputs
+are sent in full again once the earlier copy has been pruned. When the last
+copy of a block leaves the conversation, the history has the references and
+diffs to it that are still there expanded back to full content.
+"""
+
+import re
+import difflib
+import hashlib
+import logging
+from typing import Dict, Callable, List, Optional, Set, Tuple
+
+# Outputs shorter than this are always sent as they are
+MIN_BLOCK_CHARS = 256
+
+# A diff is only sent if it's at most this fraction of the full output
+MAX_DIFF_RATIO = 0.5
+
+# Marks a message as holding a block (full content or a diff)
+BLOCK_MARKER = re.compile(r"\[block:([0-9a-f]{12})")
+
+# A block sent in full, as rendered; its content ends at one of the closing fences
+FULL_BLOCK = re.compile(r"\[block:([0-9a-f]{12})\]\n```([\w+-]*)\n")
+
+# References and diffs to earlier blocks, as rendered
+REFERENCE = re.compile(r"\(unchanged, identical to block:([0-9a-f]{12}) above\)\n")
+DIFF = re.compile(r"\[block:([0-9a-f]{12}) changes to block:([0-9a-f]{12})\]\n```diff\n.*?\n```\n", re.DOTALL)
+
+# Replaces a reference to a block whose content isn't known any more
+MISSING_REFERENCE = "(identical to an earlier output that is no longer in the conversation)\n"
+MISSING_BASE = "[changes to an earlier output that is no longer in the conversation]\n"
+
+
+class BlockStore:
+    """Deduplicates tool outputs against the blocks still in the conversation
+
+    Attributes:
+        references: Outputs sent as a reference to an identical block
+        diffs: Outputs sent as a diff against an earlier version
+        tokens_saved: Context tokens saved this session
+    """
+
+    def __init__(self, token_counter: Callable[[str], int], logger: Optional[logging.Logger] = None):
+        self.token_counter = token_counter
+        self.logger = logger or logging.getLogger(__name__)
+        # hash -> (content, base hash of a diff, language)
+        self._blocks: Dict[str, Tuple[str, Optional[str], str]] = {}
+        self._refs: Dict[str, int] = {}  # hash -> messages holding the block
+        # Blocks whose last copy left the conversation, kept until the
+        # references to them have been expanded
+        self._released: Dict[str, Tuple[str, Optional[str], str]] = {}
+        self._latest: Dict[str, str] = {}  # source -> hash of its last output
+        self.references = 0
+        self.diffs = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def digest(content: str) -> str:
+        return hashlib.sha256(content.encode("utf-8", "surrogatepass")).hexdigest()[:12]
+
+    def available(self, block: str) -> bool:
+        """Check whether the model can still see a block (and the blocks a diff builds on)"""
+        while block:
+            if not self._refs.get(block) or block not in self._blocks:
+                return False
+            block = self._blocks[block][1]
+        return True
+
+    def render(self, source: str, content: str, language: str = "") -> str:
+        """Render a tool output as a fenced block, a reference or a diff
+
+        Args:
+            source: What produced the output, e.g. "file:/path" or "bash:ls -la"
+            content: The output
+            language: Language tag for the fenced block
+
+        Returns:
+            Text to include in the follow-up prompt
+        """
+        full = f"```{language}\n{content}\n```\n"
+        if len(content) < MIN_BLOCK_CHARS:
+            return full
+
+        block = self.digest(content)
+        full = f"[block:{block}]\n" + full
+        previous = self._latest.get(source)
+        self._latest[source] = block
+
+        if self.available(block):
+            text = f"(unchanged, identical to block:{block} above)\n"
+            self.references += 1
+            return self._saved(full, text)
+
+        if previous and self.available(previous):
+            diff = "\n".join(difflib.unified_diff(
+                self._blocks[previous][0].splitlines(), content.splitlines(),
+                f"block:{previous}", f"block:{block}", lineterm=""
+            ))
+            if len(diff) <= len(content) * MAX_DIFF_RATIO:
+                self._blocks[block] = (content, previous, language)
+                text = f"[block:{block} changes to block:{previous}]\n```diff\n{diff}\n```\n"
+                self.diffs += 1
+                return self._saved(full, text)
+
+        self._blocks[block] = (content, None, language)
+        return full
+
+    def _saved(self, full: str, text: str) -> str:
+        saved = self.token_counter(full) - self.token_counter(text)
+        self.tokens_saved += max(0, saved)
+        self.logger.debug(f"Deduplicated tool output: ~{saved} tokens saved")
+        return text
+
+    def retain(self, text: str):
+        """Count the blocks in a message added to the conversation
+
+        Blocks sent in full that the store doesn't know, e.g. in a resumed
+        session, are added to it.
+        """
+        if "[block:" not in text:
+            return
+        for block in BLOCK_MARKER.findall(text):
+            self._refs[block] = self._refs.get(block, 0) + 1
+        for match in FULL_BLOCK.finditer(text):
+            block = match.group(1)
+            if block in self._blocks:
+                continue
+            # The digest tells which closing fence ends the content
+            end = text.find("\n```\n", match.end() - 1)
+            while end >= 0:
+                content = text[match.end():end]
+                if self.digest(content) == block:
+                    self._blocks[block] = (content, None, match.group(2))
+                    break
+                end = text.find("\n```\n", end + 1)
+
+    def release(self, text: str) -> List[str]:
+        """Forget the blocks of a message removed from the conversation
+
+        Returns:
+            The blocks whose last copy left the conversation; references
+            to them should be expanded (see expand)
+        """
+        if "[block:" not in text:
+            return []
+        released = []
+        for block in BLOCK_MARKER.findall(text):
+            refs = self._refs.get(block, 0) - 1
+            if refs > 0:
+                self._refs[block] = refs
+            else:
+                self._refs.pop(block, None)
+                entry = self._blocks.pop(block, None)
+                if entry:
+                    self._released[block] = entry
+                    released.append(block)
+        return released
+
+    @staticmethod
+    def referenced_blocks(text: str) -> Set[str]:
+        """Get the blocks a message refers to without holding them (references and diff bases)"""
+        if "block:" not in text:
+            return set()
+        return set(REFERENCE.findall(text)) | {base for _, base in DIFF.findall(text)}
+
+    def expand(self, text: str) -> Optional[str]:
+        """Rewrite the references and diffs in a message to blocks the model can't see any more
+
+        A reference becomes the block's full content, and a diff the full
+        content of the new version. If the content isn't known (the session
+        was resumed without it), a note replaces the reference.
+
+        Returns:
+            The rewritten text, or None if nothing in it had to change
+        """
+        if "block:" not in text:
+            return None
+
+        def full(block: str) -> Optional[str]:
+            entry = self._blocks.get(block) or self._released.get(block)
+            if entry is None:
+                return None
+            content, _, language = entry
+            self._blocks[block] = (content, None, language)
+            return f"[block:{block}]\n```{language}\n{content}\n```\n"
+
+        def expand_diff(match):
+            block, base = match.groups()
+            if self.available(base):
+                return match.group(0)
+            if block not in self._blocks:
+                return MISSING_BASE + match.group(0)[match.group(0).index("\n") + 1:]
+            # Sent in full, the new version no longer builds on the missing one
+            return full(block)
+
+        def expand_reference(match):
+            block = match.group(1)
+            if self.available(block):
+                return match.group(0)
+            return full(block) or MISSING_REFERENCE
+
+        expanded = REFERENCE.sub(expand_reference, DIFF.sub(expand_diff, text))
+        return expanded if expanded != text else None
+
+    def discard_released(self):
+        """Forget released blocks once the references to them have been expanded"""
+        self._released.clear()
+
+    def reset(self):
+        """Forget every block, e.g. when the conversation is cleared"""
+        self._blocks.clear()
+        self._refs.clear()
+        self._latest.clear()
+        self._released.clear()
@@ -0,0 +1,305 @@
+"""
+Bounded capture of command output for OllamaCode.
+
+A command's output is kept in memory only up to a limit: the first and the
+last half of it. Once the output outgrows the limit, the whole stream is
+written to a spill file in the workspace instead, and the captured text
+names the file's handle so the model can page through it with the
+output_read tool. A sidecar index holds the byte offset of every
+LINE_INDEX_STEP-th line, so reading a page deep into a large spill file
+doesn't have to scan it from the start.
+"""
+
+import os
+import re
+import time
+import uuid
+import struct
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+# Spill files are kept here, relative to the working directory
+SPILL_DIR = os.path.join(".ollamacode", "output")
+
+# Spill files kept before the oldest are deleted
+MAX_SPILL_FILES = 20
+
+# Lines between byte offsets recorded in a spill file's index
+LINE_INDEX_STEP = 1000
+
+# Most lines and characters output_read returns at once
+MAX_READ_LINES = 2000
+MAX_READ_CHARS = 20000
+
+# Bytes read from a spill file at a time, and the longest line kept whole
+READ_BLOCK = 1024 * 1024
+MAX_LINE_BYTES = 4 * MAX_READ_CHARS
+
+OFFSET_FORMAT = "<Q"
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+HANDLE_PATTERN = re.compile(r"^[A-Za-z0-9_-]+\.log$")
+
+
+class OutputCapture:
+    """Keeps the head and tail of a stream, spilling all of it to a file when it's too long
+
+    Args:
+        limit: Characters kept in memory, half from the start and half from
+            the end; None keeps everything
+        spill_dir: Directory for the spill file; None only truncates
+        label: Prefix of the spill file's name, e.g. "bash-stdout"
+    """
+
+    def __init__(self, limit: Optional[int] = None, spill_dir: Optional[str] = None,
+                 label: str = "output", logger: Optional[logging.Logger] = None):
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.label = label
+        self.logger = logger or logging.getLogger(__name__)
+        self.head_limit = limit // 2 if limit is not None else None
+        self.tail_limit = limit - limit // 2 if limit is not None else None
+
+        self._head: List[str] = []
+        self._head_size = 0
+        self._tail: Deque[str] = deque()
+        self._tail_size = 0
+        self.total = 0
+        self.handle: Optional[str] = None
+        self.path: Optional[str] = None
+        self._file = None
+        self._bytes = 0
+        self._lines = 0
+        self._index: List[int] = []
+
+    @property
+    def truncated(self) -> bool:
+        return self.limit is not None and self.total > self.limit
+
+    def write(self, text: str):
+        """Add text from the stream"""
+        self.total += len(text)
+        if self._file:
+            self._spill(text)
+
+        if self.head_limit is None or self._head_size < self.head_limit:
+            room = len(text) if self.head_limit is None else self.head_limit - self._head_size
+            self._head.append(text[:room])
+            self._head_size += len(text[:room])
+            text = text[room:]
+            if not text:
+                return
+
+        self._tail.append(text)
+        self._tail_size += len(text)
+        if self._tail_size > self.tail_limit:
+            if self._file is None and self.spill_dir:
+                self._open_spill()
+            # Drop whole chunks that are no longer needed for the tail
+            while self._tail and self._tail_size - len(self._tail[0]) >= self.tail_limit:
+                self._tail_size -= len(self._tail.popleft())
+
+    def _open_spill(self):
+        """Start the spill file with everything captured so far"""
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            _prune_spill_files(self.spill_dir, MAX_SPILL_FILES - 1)
+            self.handle = f"{self.label}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.log"
+            self.path = os.path.join(self.spill_dir, self.handle)
+            self._file = open(self.path, "wb")
+        except OSError as e:
+            self.logger.warning(f"Could not create spill file in {self.spill_dir}: {e}")
+            self.spill_dir = None
+            self.handle = self.path = None
+            return
+        for text in self._head:
+            self._spill(text)
+        for text in self._tail:
+            self._spill(text)
+
+    def _spill(self, text: str):
+        data = text.encode("utf-8", "surrogateescape")
+        newlines = data.count(b"\n")
+        if (self._lines + newlines) // LINE_INDEX_STEP > self._lines // LINE_INDEX_STEP:
+            line = self._lines
+            position = data.find(b"\n")
+            while position >= 0:
+                line += 1
+                if line % LINE_INDEX_STEP == 0:
+                    self._index.append(self._bytes + position + 1)
+                position = data.find(b"\n", position + 1)
+        self._lines += newlines
+        self._bytes += len(data)
+        self._file.write(data)
+
+    def finish(self) -> str:
+        """Close the spill file and get the captured text
+
+        Returns:
+            The whole output, or its head and tail around a note on what
+            was left out and where to find it
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+            with open(self.path + ".idx", "wb") as index:
+                index.write(b"".join(struct.pack(OFFSET_FORMAT, offset) for offset in self._index))
+
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        if not self.truncated:
+            return head + tail
+
+        tail = tail[-self.tail_limit:] if self.tail_limit else ""
+        omitted = self.total - len(head) - len(tail)
+        if self.handle:
+            lines = self._lines + (0 if tail.endswith("\n") else 1)
+            note = (f"\n... [{omitted} characters omitted; the full output ({self.total} characters, "
+                    f"{lines} lines) is saved as {self.handle}, page through it with the output_read tool] ...\n")
+        else:
+            note = f"\n... [{omitted} characters omitted] ...\n"
+        return head + note + tail
+
+
+def spill_directory(working_dir) -> str:
+    """Get the directory spill files are kept in for a working directory"""
+    return os.path.join(str(working_dir), SPILL_DIR)
+
+
+def _prune_spill_files(directory: str, keep: int):
+    """Delete the oldest spill files so at most keep are left"""
+    spills = [os.path.join(directory, name) for name in os.listdir(directory) if HANDLE_PATTERN.match(name)]
+    if len(spills) <= keep:
+        return
+    spills.sort(key=os.path.getmtime)
+    for path in spills[:len(spills) - keep]:
+        for stale in (path, path + ".idx"):
+            try:
+                os.unlink(stale)
+            except OSError:
+                pass
+
+
+def read_output(working_dir, handle: str, offset: int = 0, length: int = 200,
+                grep: Optional[str] = None) -> Dict[str, Any]:
+    """Read lines from a spill file
+
+    Args:
+        working_dir: Working directory the spill file belongs to
+        handle: Name of the spill file
+        offset: Lines to skip from the start
+        length: Most lines to return (matching lines with grep)
+        grep: Regular expression; only matching lines are returned, with
+            their line numbers
+
+    Returns:
+        Tool result with the lines in "content"
+    """
+    if not HANDLE_PATTERN.match(handle):
+        return {"status": "error", "error": f"Invalid output handle: {handle}"}
+    path = os.path.join(spill_directory(working_dir), handle)
+    if not os.path.isfile(path):
+        return {"status": "error", "error": f"Output not found (it may have been cleaned up): {handle}"}
+
+    offset = max(0, int(offset))
+    length = max(1, min(int(length), MAX_READ_LINES))
+    pattern = screen = None
+    if grep:
+        try:
+            pattern = re.compile(grep)
+        except re.error:
+            grep = re.escape(grep)
+            pattern = re.compile(grep)
+        # Blocks without a match anywhere are skipped without splitting them
+        # into lines; patterns whose meaning changes between a line and a
+        # block (anchors to the whole text, lookarounds) check every line
+        if "(?" not in grep and "\\A" not in grep and "\\Z" not in grep:
+            screen = re.compile(grep, re.MULTILINE)
+
+    lines = []
+    chars = 0
+    line_number = offset
+    more = False
+    with open(path, "rb") as f:
+        skip = _seek_line(f, path, offset)
+        for batch in _line_batches(f):
+            if skip:
+                skipped = min(skip, len(batch))
+                batch = batch[skipped:]
+                skip -= skipped
+                if not batch:
+                    continue
+            if screen and not screen.search(b"\n".join(batch).decode("utf-8", "replace")):
+                line_number += len(batch)
+                continue
+            for line in batch:
+                line_number += 1
+                text = line.decode("utf-8", "replace")
+                if pattern and not pattern.search(text):
+                    continue
+                if len(lines) >= length or chars >= MAX_READ_CHARS:
+                    more = True
+                    line_number -= 1
+                    break
+                text = text[:MAX_READ_CHARS - chars]
+                lines.append(f"{line_number}: {text}" if pattern else text)
+                chars += len(text) + 1
+            if more:
+                break
+
+    result = {
+        "status": "success",
+        "handle": handle,
+        "content": "\n".join(lines),
+        "size": os.path.getsize(path),
+        "first_line": offset + 1,
+        "lines": len(lines),
+        "more": more
+    }
+    if more:
+        result["next_offset"] = line_number
+    if pattern:
+        result["grep"] = grep
+    return result
+
+
+def _seek_line(f, path: str, offset: int) -> int:
+    """Seek a spill file to the last indexed line at or before offset
+
+    Returns:
+        Lines still to skip from there
+    """
+    checkpoint = offset // LINE_INDEX_STEP
+    if not checkpoint:
+        return offset
+    try:
+        with open(path + ".idx", "rb") as index:
+            index.seek((checkpoint - 1) * OFFSET_SIZE)
+            data = index.read(OFFSET_SIZE)
+    except OSError:
+        return offset
+    if len(data) != OFFSET_SIZE:
+        return offset
+    f.seek(struct.unpack(OFFSET_FORMAT, data)[0])
+    return offset - checkpoint * LINE_INDEX_STEP
+
+
+def _line_batches(f, keep: int = MAX_LINE_BYTES) -> Iterator[List[bytes]]:
+    """Read a file in blocks, yielding the lines of each block
+
+    Lines are yielded without their newline, and cut to keep bytes so a
+    huge line can't use up memory.
+    """
+    pending = None
+    while True:
+        block = f.read(READ_BLOCK)
+        if not block:
+            if pending:
+                yield [pending]
+            return
+        pieces = block.split(b"\n")
+        if pending is not None:
+            pieces[0] = (pending + pieces[0])[:keep]
+        pending = pieces.pop()[:keep]
+        if pieces:
+            yield [piece if len(piece) <= keep else piece[:keep] for piece in pieces]
@@ -3,11 +3,11 @@ OllamaCode client for interacting with Ollama API.
 """
 
 import os
-import json
 import requests
-import sys
+import threading
 from pathlib import Path
-from typing import Dict, Any, List, Tuple, Optional
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Optional, Callable
 import logging
 
 from .conversation import ConversationHistory
@@ -15,6 +15,23 @@ from .response_processor import ResponseProcessor
 from .utils import Colors, save_code_to_file
 from .tools import ToolsFramework
 from .bash import BashExecutor
+from .transport import OllamaTransport
+from .streaming import FenceDetector, PipelinedExecutor
+from .inventory import ModelInventory
+from .agent import AgentLoop
+from .telemetry import TelemetryRecorder
+from .residency import ResidencyManager
+from .endpoints import Endpoint, EndpointPool
+from .hedging import StreamAttempt, StreamLauncher
+from .response_cache import ResponseCache, CachedStream
+from .telemetry import RequestStats
+from .tokens import TokenAccountant, MESSAGE_OVERHEAD
+from .gguf_tokenizer import GGUFTokenizer, load_tokenizer
+from .compaction import Compactor
+from .journal import SessionJournal
+from .blockstore import BlockStore
+from .retrieval import RetrievalIndex
+from .inference_options import InferenceOptions
 
 
 class OllamaClient:
@@ -25,205 +42,503 @@ class OllamaClient:
         self.config = config
         self.logger = logger or logging.getLogger(__name__)
         
+        # Token estimates calibrated per model from Ollama's prompt_eval_count
+        self.tokens = TokenAccountant(
+            self.config.get("token_ratios_file", "~/.config/ollamacode/token_ratios.json"),
+            logger=self.logger
+        )
+        
+        # Exact tokenizer read from the local GGUF blob (tokenizer_backend "gguf")
+        self.tokenizer: Optional[GGUFTokenizer] = None
+        self._pending_tokenizer: Optional[Tuple[str, GGUFTokenizer]] = None
+        self._load_tokenizer(self.config["model"])
+        
         # Initialize conversation history
         self.conversation = ConversationHistory(
             max_tokens=self.config.get("context_window", 16000),
-            system_prompt=self.config.get("system_prompt", "")
+            system_prompt=self.config.get("system_prompt", ""),
+            token_counter=self.estimate_tokens,
+            prune_policy=self.config.get("prune_policy", "importance"),
+            prune_target=float(self.config.get("prune_target", 0.75))
+        )
+        
+        # Messages of the previous request, to measure prompt prefix reuse
+        self._last_prompt: List[Dict[str, str]] = []
+        
+        # Shared HTTP transport with pooled keep-alive connections
+        self.transport = OllamaTransport(config, self.logger)
+        
+        # One or more Ollama servers, with least-loaded routing and failover
+        self.endpoints = EndpointPool(
+            EndpointPool.parse_urls(self.config["ollama_endpoint"]),
+            self.transport,
+            config,
+            self.logger
+        )
+        self.endpoints.start_health_checks()
+        
+        # Opens chat streams with failover and optional hedging
+        self.streams = StreamLauncher(self, config, self.logger)
+        
+        # Cached server health and model list, refreshed in the background
+        self.inventory = ModelInventory(
+            self._fetch_inventory,
+            ttl=float(self.config.get("model_cache_ttl", 60)),
+            logger=self.logger
         )
         
+        # Summarizes old turns in the background instead of pruning them
+        self.compactor = None
+        if self.config.get("compaction", False):
+            self.compactor = Compactor(self, config, self.logger)
+            self.conversation.compactor = self.compactor
+        
+        # Index of pruned turns that relevant ones are retrieved from
+        self.retriever = None
+        if self.config.get("retrieval", False):
+            self.retriever = RetrievalIndex(self, config, self.logger)
+            self.conversation.retriever = self.retriever
+        
+        # Ollama options (temperature, num_predict, bucketed num_ctx) per request
+        self.options = InferenceOptions(config, self.logger)
+        
+        # Keeps the active model loaded in Ollama
+        self.residency = ResidencyManager(self, config, self.logger)
+        
         # Initialize tools and bash executor
         self.tools = ToolsFramework(config)
         self.bash = BashExecutor(config)
         
+        # Repeated tool outputs are sent as references or diffs
+        self.blocks = None
+        if self.config.get("dedupe_tool_output", True):
+            self.blocks = BlockStore(self.estimate_tokens, self.logger)
+            self.conversation.blockstore = self.blocks
+        
         # Initialize response processor
-        self.processor = ResponseProcessor(config, self.bash, self.tools)
+        self.processor = ResponseProcessor(config, self.bash, self.tools, self.logger, blocks=self.blocks)
+        
+        # Agent loop that drives requests and tool follow-ups
+        self.agent = AgentLoop(self, config, self.logger)
         
         # Last response tracking
         self.last_response = ""
         
+        # Rolling per-request inference telemetry
+        self.telemetry = TelemetryRecorder(
+            window=int(self.config.get("telemetry_window", 100)),
+            logger=self.logger
+        )
+        
+        # On-disk cache of deterministic (temperature 0) replies
+        self.response_cache = None
+        if self.config.get("response_cache", True):
+            self.response_cache = ResponseCache(
+                self.config.get("response_cache_path", "~/.config/ollamacode/response_cache.db"),
+                max_bytes=int(self.config.get("response_cache_max_mb", 64)) * 1024 * 1024,
+                logger=self.logger
+            )
+        
+        # Append-only journal of the session, opened by start_session
+        self.journal = None
+        
         # Set up working directory
         self.ensure_working_dir()
     
+    def start_session(self, resume: Optional[str] = None) -> int:
+        """Open the session journal, optionally resuming an earlier session
+        
+        Args:
+            resume: Journal file to resume, or "latest" for the most recent one
+            
+        Returns:
+            The number of messages restored
+        """
+        if not self.config.get("session_journal", False) and not resume:
+            return 0
+        
+        journal_dir = self.config.get("journal_dir", "~/.config/ollamacode/sessions")
+        path = resume
+        if resume == "latest":
+            path = SessionJournal.latest(journal_dir)
+            if not path:
+                print(f"{Colors.YELLOW}No earlier session found in {journal_dir}{Colors.ENDC}")
+        if not path:
+            path = os.path.join(os.path.expanduser(journal_dir),
+                                f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl")
+        elif not os.path.exists(os.path.expanduser(path)):
+            raise FileNotFoundError(f"Session journal not found: {path}")
+        
+        # Journals can hold secrets from prompts and tool output, so old ones
+        # aren't kept around
+        pruned = SessionJournal.prune(journal_dir, keep=int(self.config.get("journal_keep", 20)),
+                                      max_age_days=float(self.config.get("journal_max_age_days", 30)),
+                                      exclude=path)
+        if pruned:
+            self.logger.info(f"Deleted {pruned} old session journals from {journal_dir}")
+        
+        self.journal = SessionJournal(path, fsync=self.config.get("journal_fsync", "interval"), logger=self.logger)
+        restored = self.conversation.resume(self.journal)
+        if restored:
+            print(f"{Colors.GREEN}Resumed {restored} messages from {path}{Colors.ENDC}")
+        self.logger.info(f"Session journal: {path} ({len(self.journal)} entries, {restored} messages restored)")
+        return restored
+    
     def ensure_working_dir(self):
         """Ensure the working directory exists"""
         working_dir = Path(self.config.get("working_directory", os.path.expanduser("~/ollamacode_workspace")))
         if not working_dir.exists():
             working_dir.mkdir(parents=True)
     
+    def api_url(self, path: str, endpoint: Optional[Endpoint] = None) -> str:
+        """Build a full Ollama API URL for the given path
+        
+        Uses the primary endpoint unless another one is given.
+        """
+        return (endpoint or self.endpoints.primary).api_url(path)
+    
+    def _fetch_inventory(self) -> Tuple[bool, Optional[List[str]]]:
+        """Query /api/tags on every endpoint for reachability and the model list
+        
+        The server counts as reachable if any endpoint is, and the model
+        list is the union of the models on all endpoints.
+        """
+        reachable = False
+        models = None
+        for endpoint in self.endpoints.endpoints:
+            try:
+                response = self.transport.get(endpoint.api_url("/api/tags"))
+                reachable = True
+                if response.status_code == 200:
+                    data = response.json()
+                    endpoint.models = {model['name'] for model in data.get('models', [])}
+                    models = sorted(set(models or []) | endpoint.models)
+                else:
+                    self.logger.error(f"Error fetching models from {endpoint.url}: HTTP {response.status_code}")
+            except requests.RequestException as e:
+                self.logger.error(f"Connection error: {e}")
+                self.endpoints.mark_failed(endpoint, str(e))
+        return reachable, models
+    
     def check_ollama_connection(self) -> bool:
-        """Check if Ollama server is reachable"""
-        try:
-            response = requests.get(f"{self.config['ollama_endpoint']}/api/tags")
-            return response.status_code == 200
-        except requests.RequestException as e:
-            self.logger.error(f"Connection error: {e}")
-            return False
+        """Check if Ollama server is reachable
+        
+        This always probes the server and refreshes the cached inventory.
+        """
+        return self.inventory.refresh()
     
     def get_available_models(self) -> List[str]:
-        """Get list of available models from Ollama"""
-        try:
-            response = requests.get(f"{self.config['ollama_endpoint']}/api/tags")
-            if response.status_code == 200:
-                data = response.json()
-                return [model['name'] for model in data.get('models', [])]
-            else:
-                self.logger.error(f"Error fetching models: HTTP {response.status_code}")
-                return []
-        except requests.RequestException as e:
-            self.logger.error(f"Connection error: {e}")
-            return []
+        """Get list of available models from Ollama (cached)"""
+        return self.inventory.get_models()
     
     def validate_model(self, model_name: str) -> bool:
-        """Check if the specified model is available in Ollama"""
-        available_models = self.get_available_models()
-        if not available_models:
-            # If we couldn't fetch models, assume it might work
-            return True
-        return model_name in available_models
+        """Check if the specified model is available in Ollama
+        
+        Uses the cached inventory. A negative answer is confirmed with a fresh
+        fetch, since the model may have been pulled since the last refresh.
+        """
+        available = self.inventory.has_model(model_name)
+        if available is False:
+            self.inventory.refresh()
+            available = self.inventory.has_model(model_name)
+        # If we couldn't fetch models, assume it might work
+        return available is not False
+    
+    def estimate_tokens(self, text: str) -> int:
+        """Count the tokens in a text for the active model
+        
+        Exact when the model's GGUF tokenizer is loaded, calibrated estimate otherwise.
+        """
+        if self.tokenizer:
+            return self.tokenizer.count(text)
+        return self.tokens.estimate(text, self.config["model"])
+    
+    def _load_tokenizer(self, model: str):
+        """Start loading a model's GGUF tokenizer in the background"""
+        self.tokenizer = None
+        if self.config.get("tokenizer_backend", "estimate") != "gguf":
+            return
+        
+        def _load():
+            tokenizer = load_tokenizer(model, self.config.get("ollama_models_dir") or None)
+            if tokenizer:
+                self._pending_tokenizer = (model, tokenizer)
+        
+        threading.Thread(target=_load, name="ollamacode-tokenizer", daemon=True).start()
+    
+    def _apply_tokenizer(self):
+        """Switch to a tokenizer that finished loading, re-counting the history"""
+        pending, self._pending_tokenizer = self._pending_tokenizer, None
+        if pending and pending[0] == self.config["model"]:
+            self.tokenizer = pending[1]
+            self.conversation.recalculate_tokens()
+            self.logger.info(f"Counting tokens with the GGUF tokenizer of {pending[0]}")
+    
+    def set_model(self, model_name: str):
+        """Switch the active model and start loading it"""
+        previous_model = self.config.get("model")
+        self.config["model"] = model_name
+        self._load_tokenizer(model_name)
+        self.conversation.recalculate_tokens()
+        self.inventory.invalidate()
+        self.residency.switch(previous_model, model_name)
+    
+    def request_options(self, model: str, profile: Optional[str] = None, extra_tokens: int = 0) -> Dict[str, Any]:
+        """Build the Ollama options for a request with the current conversation
+        
+        Args:
+            extra_tokens: Tokens sent on top of the conversation, e.g. retrieved turns
+        """
+        prompt_tokens = self.conversation.current_token_count + MESSAGE_OVERHEAD * len(self.conversation)
+        return self.options.build(model, prompt_tokens + extra_tokens, profile)
     
-    def format_messages(self, prompt: str) -> Dict[str, Any]:
-        """Format messages for the Ollama API"""
-        return {
+    def format_messages(self, prompt: str = "", profile: Optional[str] = None) -> Dict[str, Any]:
+        """Format messages for the Ollama API
+        
+        Args:
+            profile: Name of an option profile from option_profiles to apply
+        """
+        messages = self.conversation.get_messages_for_api()
+        retrieved_tokens = 0
+        if self.retriever is not None:
+            messages, retrieved_tokens = self.retriever.augment(messages)
+        data = {
             "model": self.config["model"],
-            "messages": self.conversation.get_messages_for_api(),
+            "messages": messages,
             "stream": True,
-            "temperature": self.config["temperature"],
-            "max_tokens": self.config["max_tokens"]
+            "options": self.request_options(self.config["model"], profile, retrieved_tokens)
         }
+        if self.residency.keep_alive:
+            data["keep_alive"] = self.residency.keep_alive
+        return data
+    
+    def ensure_model_available(self) -> bool:
+        """Check the configured model against the cached inventory, reporting if it's missing"""
+        if self.validate_model(self.config["model"]):
+            return True
+        
+        error_msg = f"Error: Model '{self.config['model']}' not found in Ollama"
+        print(f"{Colors.RED}{error_msg}{Colors.ENDC}")
+        self.logger.error(error_msg)
+        print(f"Available models: {', '.join(self.get_available_models())}")
+        print(f"You may need to pull it first with: ollama pull {self.config['model']}")
+        return False
     
-    def send_request(self, prompt: str, is_followup: bool = False, followup_depth: int = 0) -> str:
-        """Send a request to the Ollama API and return the response
+    def send_request(self, prompt: str) -> str:
+        """Send a prompt through the agent loop and return the full response
         
         Args:
             prompt: The message to send to the model
-            is_followup: Whether this is a followup request triggered by command execution
-            followup_depth: Tracks the recursion depth for follow-up messages
         """
-        # Check for maximum followup depth to prevent infinite recursion
-        max_followup_depth = self.config.get("max_followup_depth", 2)
-        if followup_depth > max_followup_depth:
-            self.logger.warning(f"Maximum followup depth ({max_followup_depth}) reached")
-            return "Follow-up limit reached. Please continue with a new prompt."
-        
-        if not self.check_ollama_connection():
-            error_msg = f"Error: Cannot connect to Ollama at {self.config['ollama_endpoint']}"
-            print(f"{Colors.RED}{error_msg}{Colors.ENDC}")
-            self.logger.error(error_msg)
-            print("Make sure Ollama is running and accessible.")
-            sys.exit(1)
-        
-        # Validate that the model exists
-        if not self.validate_model(self.config["model"]):
-            error_msg = f"Error: Model '{self.config['model']}' not found in Ollama"
-            print(f"{Colors.RED}{error_msg}{Colors.ENDC}")
-            self.logger.error(error_msg)
-            print(f"Available models: {', '.join(self.get_available_models())}")
-            print(f"You may need to pull it first with: ollama pull {self.config['model']}")
-            sys.exit(1)
-        
-        # Add user prompt to conversation history
-        if not is_followup:
-            self.conversation.add_message("user", prompt)
-        
-        # Format API request
-        data = self.format_messages(prompt)
+        run = self.agent.run(prompt)
+        self.last_response = run.response
+        return run.response
+    
+    def stream_chat(self, display: bool = True, pipeline: Optional[PipelinedExecutor] = None,
+                    stop_at_tool_call: bool = False,
+                    should_stop: Optional[Callable[[], bool]] = None,
+                    profile: Optional[str] = None) -> Dict[str, Any]:
+        """Send the current conversation to /api/chat and stream the reply
         
-        try:
-            # Use streaming API for real-time responses
-            response = requests.post(
-                f"{self.config['ollama_endpoint']}/api/chat",
-                json=data,
-                stream=True
-            )
+        The request goes to the endpoint picked by the endpoint pool. If it
+        fails before producing any tokens, it is retried on the next endpoint,
+        and with hedging enabled a slow first token sends it to a second one.
+        
+        Args:
+            display: Whether to print the reply as it streams
+            pipeline: Executor that starts bash/tool blocks while the reply streams
+            stop_at_tool_call: Stop generating after the first complete bash/tool block
+            should_stop: Polled between chunks; the stream is closed when it returns True
+            profile: Name of an option profile from option_profiles to apply
             
-            if response.status_code != 200:
-                print(f"{Colors.RED}Error: HTTP {response.status_code}{Colors.ENDC}")
-                try:
-                    error_data = response.json()
-                    print(f"Error message: {error_data.get('error', 'Unknown error')}")
-                except:
-                    print(f"Response: {response.text}")
-                sys.exit(1)
+        Returns:
+            Dict with the reply content and accounting for the request
             
-            # Process the streaming response
-            full_response = ""
+        Raises:
+            OllamaAPIError: If Ollama responds with an error status
+            requests.RequestException: If Ollama can't be reached
+        """
+        self._apply_tokenizer()
+        data = self.format_messages(profile=profile)
+        
+        cache_key = None
+        if self.response_cache and ResponseCache.applies(data):
+            cache_key = ResponseCache.key(data)
+        
+        if display:
+            print(f"\n{Colors.CYAN}OllamaCode:{Colors.ENDC} ", end="", flush=True)
+        
+        try:
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    self.logger.info(f"Replaying cached response {cache_key[:12]}")
+                    stats = RequestStats(data["model"], "cache")
+                    stats.cache = "hit"
+                    return self._consume_stream(CachedStream(cached, stats), display, pipeline,
+                                                stop_at_tool_call, should_stop)
             
-            # Only print prefix for main responses and first-level followups
-            if not is_followup or followup_depth <= 1:
-                print(f"\n{Colors.CYAN}OllamaCode:{Colors.ENDC} ", end="", flush=True)
+            attempt = self.streams.open(data, should_stop)
+            if attempt is None:
+                return {
+                    "content": "",
+                    "tokens": 0,
+                    "stopped_early": False,
+                    "interrupted": True,
+                    "stats": None
+                }
+            if cache_key:
+                attempt.stats.cache = "miss"
+            attempt.stats.num_ctx = data["options"].get("num_ctx")
+            self._record_prefix(attempt.stats, data["messages"])
+            try:
+                reply = self._consume_stream(attempt, display, pipeline, stop_at_tool_call,
+                                             should_stop, record=cache_key is not None)
+            finally:
+                attempt.close()
+            self.endpoints.mark_loaded(attempt.endpoint, data["model"])
             
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line)
-                        content = chunk.get("message", {}).get("content", "")
-                        if content:
-                            # Only print content for main responses and first-level followups
-                            if not is_followup or followup_depth <= 1:
-                                print(content, end="", flush=True)
-                            full_response += content
-                    except json.JSONDecodeError:
-                        continue
+            stats = reply["stats"]
+            # Calibration only matters while counts are estimated; when it
+            # moves a ratio far enough, the cached counts are re-estimated
+            if (stats.prompt_eval_count and not self.tokenizer
+                    and self.tokens.observe(data["messages"], data["model"], stats.prompt_eval_count)):
+                self.conversation.recalculate_tokens()
             
-            # Only add newline for main responses and first-level followups
-            if not is_followup or followup_depth <= 1:
+            # Only complete replies are cached. One cut off at a tool call
+            # isn't, or it would replay as the whole reply without
+            # stop_at_tool_call; a complete one replayed with it is cut off
+            # at the same point as a live reply
+            if cache_key and reply["chunks"] and not reply["interrupted"] and not reply["stopped_early"]:
+                self.response_cache.put(cache_key, data["model"], reply["chunks"])
+            return reply
+        finally:
+            if display:
                 print("\n")  # Add newline after response
-            
-            # Update conversation history (only for main conversation, not followups)
-            if not is_followup:
-                self.conversation.add_message("assistant", full_response)
-                
-            # Store the last response (only update for main responses, not deep followups)
-            if not is_followup or followup_depth <= 1:
-                self.last_response = full_response
-            
-            # Process commands and tools in the response
-            # Always process the first response, and followups if enabled and not too deep
-            should_process = (
-                not is_followup or  # Always process first response
-                (
-                    self.config.get("process_followup_commands", False) and  # Config enabled
-                    followup_depth < max_followup_depth  # Not too deep
-                )
+    
+    def _record_prefix(self, stats: RequestStats, messages: List[Dict[str, str]]):
+        """Record how much of the previous prompt a request starts with
+        
+        Ollama can only reuse its prompt cache for an unchanged prefix, so
+        this shows how pruning affects prompt evaluation from turn to turn.
+        """
+        previous = self._last_prompt
+        prefix = 0
+        while prefix < min(len(previous), len(messages)) and previous[prefix] == messages[prefix]:
+            prefix += 1
+        stats.prompt_messages = len(messages)
+        stats.prefix_messages = prefix
+        stats.prefix_kept = prefix == len(previous) if previous else None
+        self._last_prompt = messages
+    
+    def _consume_stream(self, attempt: StreamAttempt, display: bool,
+                        pipeline: Optional[PipelinedExecutor], stop_at_tool_call: bool,
+                        should_stop: Optional[Callable[[], bool]],
+                        record: bool = False) -> Dict[str, Any]:
+        """Read the reply from an opened chat stream
+        
+        With record set, the reply's "chunks" holds the raw chunks read,
+        once the stream has either finished or stopped at a tool call.
+        """
+        detector = None
+        if stop_at_tool_call and not pipeline:
+            detector = FenceDetector(
+                detect_bash=self.config.get("enable_bash", True),
+                detect_tools=self.config.get("enable_tools", True)
             )
-            
-            if should_process:
-                # Log when processing followup commands
-                if is_followup:
-                    self.logger.info(f"Processing commands in followup response (depth: {followup_depth})")
-                    print(f"\n{Colors.YELLOW}Processing commands in followup response (depth: {followup_depth})...{Colors.ENDC}")
+        
+        stats = attempt.stats
+        reply = {
+            "content": "",
+            "tokens": 0,
+            "stopped_early": False,
+            "interrupted": False,
+            "stats": stats,
+            "chunks": None
+        }
+        chunks = []
+        finished = False
+        
+        try:
+            for chunk in attempt.chunks():
+                if should_stop and should_stop():
+                    # Closing the stream makes Ollama stop generating
+                    reply["interrupted"] = True
+                    break
                 
-                # Process the response using the ResponseProcessor
-                response_text, processed_results = self.processor.process_response(full_response)
+                if record:
+                    chunks.append(chunk)
+                if chunk.get("done"):
+                    stats.on_done(chunk)
+                    finished = True
                 
-                # If we have results to share, send a followup prompt
-                if processed_results:
-                    print(f"\n{Colors.YELLOW}Sharing command/tool results with the model...{Colors.ENDC}")
-                    
-                    # Generate the followup prompt
-                    followup_prompt = self.processor.format_results_for_followup(processed_results)
-                    
-                    if followup_prompt:
-                        # Increment the depth for the next followup
-                        followup_response = self.send_request(
-                            followup_prompt, 
-                            is_followup=True,
-                            followup_depth=followup_depth + 1
-                        )
-                        
-                        # Update the response to include the followup
-                        # For main conversation or first-level followups only
-                        if not is_followup or followup_depth <= 1:
-                            full_response += "\n\n" + followup_response
-                            self.last_response = full_response
-            
-            return full_response
+                content = chunk.get("message", {}).get("content", "")
+                if not content:
+                    continue
+                stats.on_token()
+                reply["tokens"] += 1
+                
+                if pipeline:
+                    completed = pipeline.feed(content, first_only=stop_at_tool_call)
+                elif detector:
+                    completed = detector.feed(content)
+                else:
+                    completed = []
+                
+                # Drop anything generated after the first completed block
+                if stop_at_tool_call and completed:
+                    content = content[:completed[0][2] - len(reply["content"])]
+                    reply["stopped_early"] = True
+                
+                if display:
+                    print(content, end="", flush=True)
+                reply["content"] += content
+                
+                if reply["stopped_early"]:
+                    break
+        except requests.RequestException:
+            self.inventory.invalidate()
+            raise
         
-        except requests.RequestException as e:
-            error_msg = f"Error communicating with Ollama: {e}"
-            print(f"{Colors.RED}{error_msg}{Colors.ENDC}")
-            self.logger.error(error_msg)
-            sys.exit(1)
+        if record and (finished or reply["stopped_early"]):
+            reply["chunks"] = chunks
+        
+        stats.stopped_early = reply["stopped_early"]
+        stats.finish()
+        if reply["stopped_early"]:
+            self._report_early_stop(reply["tokens"])
+        self.telemetry.record(stats)
+        
+        return reply
+    
+    def _report_early_stop(self, tokens_generated: int):
+        """Report the tokens saved by stopping generation at a tool call
+        
+        Ollama sends no final chunk for a closed stream, so the saving is
+        estimated against the average eval_count of recent responses that
+        ran to completion.
+        """
+        message = f"Stopped generation at tool call after {tokens_generated} tokens"
+        average = self.telemetry.average("eval_count")
+        if average is not None:
+            saved = max(0, int(average) - tokens_generated)
+            message += f" (~{saved} tokens saved)"
+        print(f"{Colors.BLUE}{message}{Colors.ENDC}")
+        self.logger.info(message)
+    
+    def close(self):
+        """Stop background work and the persistent shell, save token ratios and release pooled HTTP connections"""
+        self.endpoints.stop()
+        self.transport.close()
+        self.bash.close()
+        self.tokens.flush()
+        if self.response_cache:
+            self.response_cache.close()
+        if self.retriever is not None:
+            self.retriever.close()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
     
     def clear_history(self):
         """Clear conversation history"""
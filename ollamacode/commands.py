@@ -6,6 +6,7 @@ from typing import Dict, Any, Callable, List, Optional
 import logging
 from .utils import Colors
 from .config import save_config
+from .telemetry import percentile
 
 
 class Command:
@@ -108,12 +109,96 @@ class ModelSwitchCommand(Command):
             print(f"You may need to pull it first with: ollama pull {new_model}")
             return True
         
-        config["model"] = new_model
+        client.set_model(new_model)
         save_config(config)
         print(f"{Colors.GREEN}Switched to model: {new_model}{Colors.ENDC}")
         return True
 
 
+class StatsCommand(Command):
+    def __init__(self):
+        super().__init__("stats", "Show inference latency statistics", ["/stats"])
+    
+    def execute(self, args: str, client, config: Dict[str, Any]) -> bool:
+        telemetry = client.telemetry
+        if not telemetry.requests and not telemetry.cache_hits:
+            print(f"{Colors.YELLOW}No requests recorded yet.{Colors.ENDC}")
+            return True
+        
+        print(f"\n{Colors.BOLD}{Colors.HEADER}Inference Statistics{Colors.ENDC} "
+              f"(last {len(telemetry.requests)} of {telemetry.total_requests} requests)")
+        if telemetry.requests:
+            print(f"\n  {'Metric':<22}{'p50':>14}{'p90':>14}{'p99':>14}")
+        for field, label, unit in telemetry.METRICS:
+            pcts = telemetry.percentiles(field)
+            if all(value is None for value in pcts.values()):
+                continue
+            cells = "".join(
+                f"{(f'{value:.1f} {unit}' if value is not None else '-'):>14}"
+                for value in pcts.values()
+            )
+            print(f"  {label:<22}{cells}")
+        
+        endpoints = client.endpoints.endpoints
+        if len(endpoints) > 1:
+            print(f"\n{Colors.BOLD}Endpoints:{Colors.ENDC}")
+            for endpoint in endpoints:
+                state = f"{Colors.GREEN}healthy{Colors.ENDC}" if endpoint.healthy else f"{Colors.RED}down{Colors.ENDC}"
+                ttft = telemetry.percentiles("ttft", (50, 90), endpoint.url)
+                wall = telemetry.percentiles("wall_time", (50, 90), endpoint.url)
+                
+                def fmt(pcts):
+                    return "/".join(f"{value:.0f}" if value is not None else "-" for value in pcts.values())
+                
+                print(f"  {endpoint.url} [{state}] requests={endpoint.requests} "
+                      f"failures={endpoint.failures} outstanding={endpoint.outstanding}")
+                print(f"    ttft p50/p90={fmt(ttft)} ms, total p50/p90={fmt(wall)} ms, "
+                      f"loaded={', '.join(sorted(endpoint.loaded_models)) or '-'}")
+                if not endpoint.healthy and endpoint.last_error:
+                    print(f"    last error: {endpoint.last_error}")
+            if client.streams.hedges:
+                print(f"  Hedged requests: {client.streams.hedges} "
+                      f"(won by the hedge: {client.streams.hedge_wins})")
+        
+        # Prompt evaluation for turns that reused the previous prompt as a
+        # prefix versus turns where pruning changed it
+        turns = [stats for stats in list(telemetry.requests) if stats.prefix_kept is not None]
+        if turns:
+            print(f"\n{Colors.BOLD}Prompt prefix:{Colors.ENDC} kept on "
+                  f"{sum(stats.prefix_kept for stats in turns)} of {len(turns)} turns "
+                  f"(prune policy: {client.conversation.prune_policy}, "
+                  f"{client.conversation.prune_count} prunes)")
+            for kept, label in ((True, "kept"), (False, "rebuilt")):
+                group = [stats for stats in turns if stats.prefix_kept == kept]
+                counts = [stats.prompt_eval_count for stats in group if stats.prompt_eval_count is not None]
+                durations = [stats.prompt_eval_duration for stats in group if stats.prompt_eval_duration is not None]
+                if counts and durations:
+                    print(f"  {label:<9} prompt eval p50: {percentile(counts, 50):.0f} tok, "
+                          f"{percentile(durations, 50):.1f} ms")
+        
+        if client.response_cache and (telemetry.cache_hits or telemetry.cache_misses):
+            cache = client.response_cache.stats()
+            print(f"\n{Colors.BOLD}Response cache:{Colors.ENDC} {telemetry.cache_hits} hits, "
+                  f"{telemetry.cache_misses} misses ({cache['entries']} entries, "
+                  f"{cache['bytes'] / 1024:.0f} KB)")
+        
+        blocks = client.blocks
+        if blocks and (blocks.references or blocks.diffs):
+            print(f"\n{Colors.BOLD}Tool output dedup:{Colors.ENDC} {blocks.references} references, "
+                  f"{blocks.diffs} diffs, ~{blocks.tokens_saved} context tokens saved")
+        
+        retriever = client.retriever
+        if retriever is not None and len(retriever):
+            search = f", last search {retriever.last_search_ms:.2f} ms" if retriever.last_search_ms is not None else ""
+            print(f"\n{Colors.BOLD}Retrieval:{Colors.ENDC} {len(retriever)} old chunks indexed, "
+                  f"{retriever.retrieved} retrieved{search}")
+        
+        if telemetry.last:
+            print(f"\n{Colors.BOLD}Last request:{Colors.ENDC} {telemetry.last.summary()}")
+        print()
+        return True
+
+
 class RunCodeCommand(Command):
     def __init__(self):
         super().__init__("run", "Extract and run the last code block", ["/run"])
@@ -242,6 +327,9 @@ class ToolsCommand(Command):
             
             print(f"  {Colors.YELLOW}python_run{Colors.ENDC}     - Execute a Python script")
             print(f"    params: " + '{"path": "path/to/script.py"}' + " or " + '{"code": "print(\'Hello\')"}')
+            
+            print(f"  {Colors.YELLOW}output_read{Colors.ENDC}    - Page through a truncated command output")
+            print(f"    params: " + '{"handle": "bash-stdout-....log", "offset": 0, "length": 200, "grep": "regex"}')
         
         if bash_enabled:
             print(f"\n{Colors.BOLD}Bash Commands:{Colors.ENDC}")
@@ -435,6 +523,7 @@ class CommandRegistry:
         self.register_command(ClearCommand())
         self.register_command(ModelsCommand())
         self.register_command(ModelSwitchCommand())
+        self.register_command(StatsCommand())
         self.register_command(RunCodeCommand())
         self.register_command(SaveResponseCommand())
         self.register_command(ConfigCommand())
@@ -0,0 +1,157 @@
+"""
+Summarization-based context compaction for OllamaCode.
+
+Once the conversation crosses a soft watermark, the oldest span of turns is
+summarized by the model (or a smaller compaction model) on a background
+thread. When the history later reaches its hard limit, the prepared summary
+replaces that span in one step, so the user's turn never waits for it.
+Pruning remains the fallback when no summary is ready.
+"""
+
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from .conversation import ConversationHistory, Message
+
+SUMMARY_PROMPT = (
+    "Summarize the following part of a conversation between a user and a coding "
+    "assistant. Keep every fact needed to continue the work: the user's goals and "
+    "requests, decisions made, file paths, commands run and their important results, "
+    "and open problems. Be concise and don't add commentary."
+)
+SUMMARY_HEADER = "Summary of the earlier conversation:\n\n"
+
+
+class Compactor:
+    """Prepares summaries of old turns in the background and swaps them in
+
+    Configuration:
+        compaction: Enable compaction
+        compaction_model: Model that writes the summaries (defaults to the active model)
+        compaction_soft_limit: Fraction of the token limit at which a summary is prepared
+        compaction_span: Fraction of the history's tokens to summarize at once
+        compaction_max_tokens: Maximum length of a summary
+    """
+
+    def __init__(self, client, config: Dict[str, Any], logger: Optional[logging.Logger] = None):
+        self.client = client
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._prepared = None  # (seqs, summary) once a summary is ready
+        # Bumped by reset, so a summary of a cleared conversation is dropped
+        self._generation = 0
+        self.compactions = 0
+
+    @property
+    def model(self) -> str:
+        return self.config.get("compaction_model") or self.config["model"]
+
+    def observe(self, history: ConversationHistory):
+        """Start preparing a summary once the history crosses the soft watermark"""
+        soft_limit = history.max_tokens * float(self.config.get("compaction_soft_limit", 0.7))
+        if history.current_token_count < soft_limit:
+            return
+        with self._lock:
+            if self._prepared or (self._worker and self._worker.is_alive()):
+                return
+
+            span_tokens = int(history.current_token_count * float(self.config.get("compaction_span", 0.5)))
+            span = history.oldest_span(span_tokens)
+            if len(span) < 2:
+                return
+            seqs = [seq for seq, _ in span]
+            transcript = [(msg.role, msg.content) for _, msg in span]
+            self._worker = threading.Thread(
+                target=self._summarize,
+                args=(seqs, transcript, self._generation),
+                name="ollamacode-compaction",
+                daemon=True
+            )
+            self._worker.start()
+
+    def apply(self, history: ConversationHistory) -> bool:
+        """Swap a prepared summary into the history
+
+        Returns:
+            True if the history was compacted
+        """
+        with self._lock:
+            prepared, self._prepared = self._prepared, None
+        if not prepared:
+            self.logger.info("History is over its limit and no summary is ready, pruning instead")
+            return False
+
+        seqs, summary = prepared
+        message = Message("user", SUMMARY_HEADER + summary, token_counter=history.token_counter)
+        message.importance = 2.0
+        before = history.current_token_count
+        if not history.replace_span(seqs, message):
+            # Part of the span was pruned while the summary was being written
+            self.logger.info("Discarding stale conversation summary")
+            return False
+
+        self.compactions += 1
+        self.logger.info(f"Compacted {len(seqs)} messages into a summary: "
+                         f"{before} -> {history.current_token_count} tokens")
+        return True
+
+    def reset(self):
+        """Drop the prepared summary and any summary still being written
+
+        Called when the history is cleared, loaded or resumed: sequence
+        numbers start over, so an old span could match new messages.
+        """
+        with self._lock:
+            self._prepared = None
+            self._generation += 1
+            # A worker still running finishes in the background, and its
+            # result is dropped; a new one may start right away
+            self._worker = None
+
+    def _summarize(self, seqs: List[int], transcript: List[tuple], generation: int):
+        text = "\n\n".join(f"[{role}]\n{content}" for role, content in transcript)
+        model = self.model
+        max_tokens = int(self.config.get("compaction_max_tokens", 1024))
+        data = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": text}
+            ],
+            "stream": False,
+            "options": {
+                "temperature": 0,
+                "num_predict": max_tokens,
+                # The model's current num_ctx (or larger), so summarizing with
+                # the active model doesn't reload it
+                "num_ctx": self.client.options.num_ctx(
+                    model, self.client.estimate_tokens(SUMMARY_PROMPT + text) + max_tokens
+                )
+            }
+        }
+
+        endpoints = self.client.endpoints
+        endpoint = endpoints.select(model)
+        try:
+            with endpoints.lease(endpoint):
+                response = self.client.transport.post(self.client.api_url("/api/chat", endpoint), json=data)
+            if response.status_code != 200:
+                self.logger.warning(f"Summarizing the conversation failed: HTTP {response.status_code}")
+                return
+            summary = response.json().get("message", {}).get("content", "").strip()
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning(f"Summarizing the conversation failed: {e}")
+            return
+
+        if summary:
+            with self._lock:
+                if generation != self._generation:
+                    self.logger.info("Discarding the summary of a conversation that was cleared")
+                    return
+                self._prepared = (seqs, summary)
+            self.logger.info(f"Prepared a summary of {len(seqs)} messages with {model}")
@@ -50,7 +50,7 @@ def load_config() -> Dict[str, Any]:
             print(f"{Colors.YELLOW}Warning: Could not load user config file: {e}{Colors.ENDC}")
     
     # Expand paths in config
-    for key in ["history_file", "working_directory"]:
+    for key in ["history_file", "working_directory", "response_cache_path", "token_ratios_file", "ollama_models_dir", "journal_dir", "retrieval_cache_path"]:
         if key in config and isinstance(config[key], str):
             config[key] = os.path.expanduser(config[key])
     
@@ -3,9 +3,14 @@ Conversation history management for OllamaCode.
 """
 
 import re
+import sys
 import json
+import math
+import time
+import heapq
+import itertools
 import logging
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Callable
 from datetime import datetime
 
 
@@ -18,16 +23,31 @@ def estimate_tokens(text: str) -> int:
     return len(text) // 4
 
 
+IMPORTANCE_INDICATORS = ("important", "remember", "note", "key")
+
+
 class Message:
-    """Represents a single message in the conversation"""
+    """Represents a single message in the conversation
+    
+    Uses __slots__ and stores the timestamp as epoch seconds, since long
+    sessions keep many thousands of these alive.
+    """
+    
+    __slots__ = ("role", "content", "created", "token_estimate", "importance")
     
-    def __init__(self, role: str, content: str, timestamp: Optional[datetime] = None):
-        self.role = role
+    def __init__(self, role: str, content: str, timestamp: Optional[datetime] = None,
+                 token_counter: Optional[Callable[[str], int]] = None):
+        self.role = sys.intern(role)
         self.content = content
-        self.timestamp = timestamp or datetime.now()
-        self.token_estimate = estimate_tokens(content)
+        self.created = timestamp.timestamp() if timestamp else time.time()
+        self.token_estimate = (token_counter or estimate_tokens)(content)
         self.importance = 1.0  # Default importance
     
+    @property
+    def timestamp(self) -> datetime:
+        """When the message was created"""
+        return datetime.fromtimestamp(self.created)
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert message to dictionary format for Ollama API"""
         return {
@@ -40,105 +60,379 @@ class Message:
 
 
 class ConversationHistory:
-    """Manages conversation history with smart pruning strategies"""
+    """Manages conversation history with smart pruning strategies
+    
+    Messages are stored by sequence number, and non-system messages are kept
+    in a min-heap of their pruning score. The score only depends on the
+    message itself (log importance plus a recency bonus growing with the
+    sequence number), so it never has to be recomputed when messages are
+    added, and pruning pops the lowest-scored messages in O(log n) each.
+    Removed messages are deleted from the heap lazily.
+    
+    With the "prefix" prune policy, messages are instead evicted oldest
+    first in one contiguous chunk right after the system prompt, down to
+    prune_target of the budget. The start of the prompt then stays
+    unchanged for many turns, so Ollama can keep reusing its prompt cache.
+    """
     
-    def __init__(self, max_tokens: int = 16000, system_prompt: Optional[str] = None, logger: Optional[logging.Logger] = None):
-        self.messages: List[Message] = []
+    PRUNE_POLICIES = ("importance", "prefix")
+    
+    def __init__(self, max_tokens: int = 16000, system_prompt: Optional[str] = None, logger: Optional[logging.Logger] = None,
+                 token_counter: Optional[Callable[[str], int]] = None, recency_weight: float = 0.01,
+                 prune_policy: str = "importance", prune_target: float = 0.75):
+        self._messages: Dict[int, Message] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._seq = itertools.count()
         self.max_tokens = max_tokens
         self.current_token_count = 0
         self.logger = logger or logging.getLogger(__name__)
+        self.token_counter = token_counter or estimate_tokens
+        # How much a message's score grows per newer message; with 0.01 a
+        # message of importance 1.7 outlives ~50 newer ordinary messages
+        self.recency_weight = recency_weight
+        if prune_policy not in self.PRUNE_POLICIES:
+            raise ValueError(f"Unknown prune policy '{prune_policy}'")
+        self.prune_policy = prune_policy
+        self.prune_target = prune_target
+        self.prune_count = 0
+        
+        # Optional compactor that replaces old turns with a summary before
+        # anything is pruned (see compaction.py)
+        self.compactor = None
+        
+        # Optional append-only journal every new message is written to
+        # (see journal.py)
+        self.journal = None
+        
+        # Optional store of deduplicated tool outputs, told which blocks the
+        # history still holds (see blockstore.py)
+        self.blockstore = None
+        # Block hash -> sequence numbers of the messages referring to it
+        self._block_refs: Dict[str, set] = {}
+        
+        # Optional index that pruned and compacted messages are archived in,
+        # so relevant ones can be retrieved later (see retrieval.py)
+        self.retriever = None
         
         # Add system prompt if provided
         if system_prompt:
             self.add_message("system", system_prompt)
     
+    @property
+    def messages(self) -> List[Message]:
+        """The messages in conversation order"""
+        return list(self._messages.values())
+    
+    def __len__(self) -> int:
+        return len(self._messages)
+    
     def add_message(self, role: str, content: str) -> Message:
         """Add a message to the conversation history"""
-        message = Message(role, content)
-        self.messages.append(message)
-        self.current_token_count += message.token_estimate
+        message = Message(role, content, token_counter=self.token_counter)
         
         # Analyze message content to adjust importance
         self._adjust_importance(message)
         
-        # Prune if needed
-        if self.current_token_count > self.max_tokens:
-            self._prune_history()
+        self._append(message)
+        if self.journal is not None and role != "system":
+            self.journal.append_message(message.role, message.content, message.created, message.importance)
+        
+        if self.compactor:
+            self.compactor.observe(self)
+        self._enforce_limit()
         
         return message
     
+    def _enforce_limit(self):
+        """Compact or prune the history if it's over the token limit"""
+        if self.current_token_count <= self.max_tokens:
+            return
+        if self.compactor and self.compactor.apply(self) and self.current_token_count <= self.max_tokens:
+            return
+        self._prune_history()
+    
+    def oldest_span(self, tokens: int) -> List[Tuple[int, Message]]:
+        """Get the oldest non-system messages holding about the given number of tokens
+        
+        The span ends before a user message, so it covers whole exchanges.
+        The newest message is never included.
+        
+        Returns:
+            List of (sequence number, message) in conversation order
+        """
+        candidates = [(seq, msg) for seq, msg in self._messages.items() if msg.role != "system"][:-1]
+        span = []
+        total = 0
+        for seq, msg in candidates:
+            if total >= tokens and msg.role == "user":
+                break
+            span.append((seq, msg))
+            total += msg.token_estimate
+        return span
+    
+    def replace_span(self, seqs: List[int], message: Message) -> bool:
+        """Replace a span of messages with a single message in the same place
+        
+        Returns:
+            False if any of the messages is no longer in the history
+        """
+        if not seqs or any(seq not in self._messages for seq in seqs):
+            return False
+        
+        removed = set(seqs)
+        released = []
+        if self.blockstore:
+            for seq in seqs:
+                self._index_references(seq, self._messages[seq].content, add=False)
+                released += self.blockstore.release(self._messages[seq].content)
+            self.blockstore.retain(message.content)
+        if self.retriever is not None:
+            for seq in seqs:
+                self.retriever.archive(self._messages[seq])
+        old_messages = self._messages
+        self._messages = {}
+        for seq, msg in old_messages.items():
+            if seq == seqs[0]:
+                # Takes a new sequence number, so stale heap entries for
+                # the replaced messages never match it
+                new_seq = next(self._seq)
+                self._messages[new_seq] = message
+                if self.blockstore:
+                    self._index_references(new_seq, message.content)
+                if message.role != "system" and self.prune_policy == "importance":
+                    score = math.log(max(message.importance, 1e-6)) + self.recency_weight * new_seq
+                    heapq.heappush(self._heap, (score, new_seq))
+            elif seq not in removed:
+                self._messages[seq] = msg
+        
+        self.current_token_count = sum(msg.token_estimate for msg in self._messages.values())
+        if released:
+            self._expand_block_references(released)
+        return True
+    
+    def _append(self, message: Message):
+        """Store a message and queue it for pruning unless it's a system message"""
+        seq = next(self._seq)
+        self._messages[seq] = message
+        self.current_token_count += message.token_estimate
+        if self.blockstore:
+            self.blockstore.retain(message.content)
+            self._index_references(seq, message.content)
+        if message.role != "system" and self.prune_policy == "importance":
+            score = math.log(max(message.importance, 1e-6)) + self.recency_weight * seq
+            heapq.heappush(self._heap, (score, seq))
+    
+    def _remove(self, seq: int) -> Message:
+        """Remove a message; its heap entry is discarded when popped"""
+        message = self._messages.pop(seq)
+        self.current_token_count -= message.token_estimate
+        if self.blockstore:
+            self._index_references(seq, message.content, add=False)
+            released = self.blockstore.release(message.content)
+            if released:
+                self._expand_block_references(released)
+        return message
+    
+    def _index_references(self, seq: int, content: str, add: bool = True):
+        """Add a message to (or remove it from) the index of the blocks it refers to"""
+        for block in self.blockstore.referenced_blocks(content):
+            if add:
+                self._block_refs.setdefault(block, set()).add(seq)
+                continue
+            seqs = self._block_refs.get(block)
+            if seqs:
+                seqs.discard(seq)
+                if not seqs:
+                    del self._block_refs[block]
+    
+    def _expand_block_references(self, blocks: Optional[List[str]] = None):
+        """Expand references to blocks whose last copy left the history
+        
+        Otherwise a message could point the model at an output that is no
+        longer in the conversation. Only the messages referring to the given
+        blocks (all referring messages if None) are looked at, in
+        conversation order, along with those referring to blocks released
+        by expanding them.
+        """
+        if blocks is None:
+            blocks = list(self._block_refs)
+        pending = sorted({seq for block in blocks for seq in self._block_refs.get(block, ())})
+        seen = set()
+        while pending:
+            seq = heapq.heappop(pending)
+            if seq in seen or seq not in self._messages:
+                continue
+            seen.add(seq)
+            msg = self._messages[seq]
+            content = self.blockstore.expand(msg.content)
+            if content is None:
+                continue
+            self.blockstore.retain(content)
+            released = self.blockstore.release(msg.content)
+            self._index_references(seq, msg.content, add=False)
+            self._index_references(seq, content)
+            msg.content = content
+            self.current_token_count -= msg.token_estimate
+            msg.token_estimate = self.token_counter(content)
+            self.current_token_count += msg.token_estimate
+            for block in released:
+                for dependent in self._block_refs.get(block, ()):
+                    heapq.heappush(pending, dependent)
+        self.blockstore.discard_released()
+    
+    def _evict(self, seq: int) -> Message:
+        """Prune a message, archiving it for retrieval"""
+        message = self._remove(seq)
+        if self.retriever is not None:
+            self.retriever.archive(message)
+        return message
+    
     def _adjust_importance(self, message: Message):
-        """Adjust message importance based on content analysis"""
+        """Adjust message importance based on content analysis
+        
+        The lowercased copy is only kept for the duration of the checks;
+        substring searches on it are much faster than a case-insensitive
+        regex scan of the original.
+        """
         content = message.content.lower()
+        is_assistant = message.role == "assistant"
         
         # Messages with code blocks are more important
         if "```" in content:
             message.importance = 1.5
         
         # Messages with specific important indicators
-        if any(indicator in content for indicator in ["important", "remember", "note", "key"]):
+        if any(indicator in content for indicator in IMPORTANCE_INDICATORS):
             message.importance = 1.7
         
         # Long responses often contain important context
-        if len(content) > 1000 and message.role == "assistant":
+        if is_assistant and len(content) > 1000:
             message.importance = 1.3
         
         # Messages with tool/bash results are important
-        if (message.role == "assistant" and 
-            ("executing tool" in content or "executing bash" in content)):
+        if is_assistant and ("executing tool" in content or "executing bash" in content):
             message.importance = 1.6
     
     def _prune_history(self):
         """Prune conversation history to fit within token limits
         
-        Uses a smart strategy that considers message importance and position
+        Removes the lowest-scored messages first: less important and older
+        messages go before important and recent ones
         """
-        if len(self.messages) <= 2:
+        if len(self._messages) <= 2:
             return  # Keep at least system prompt + one message
         
-        # Never remove system messages
-        prunable_messages = [msg for msg in self.messages if msg.role != "system"]
-        if not prunable_messages:
+        self.prune_count += 1
+        if self.prune_policy == "prefix":
+            self._prune_prefix()
             return
         
-        # Calculate position importance - newer messages are more important
-        for i, msg in enumerate(prunable_messages):
-            # Position factor: 0.5 for oldest, increasing to 1.0 for newest
-            position_factor = 0.5 + (0.5 * i / max(1, len(prunable_messages) - 1))
-            msg.combined_score = msg.importance * position_factor
-        
-        # Sort by combined score (ascending)
-        prunable_messages.sort(key=lambda msg: msg.combined_score)
-        
-        # Remove messages until we're under the token limit, starting with lowest score
         tokens_to_remove = self.current_token_count - self.max_tokens
         tokens_removed = 0
         
         self.logger.info(f"Pruning conversation history: need to remove {tokens_to_remove} tokens")
         
-        for msg in prunable_messages:
-            # Don't remove message if it would put us under the limit
-            if tokens_removed >= tokens_to_remove:
-                break
-                
-            # Find this message in the original list and remove it
-            if msg in self.messages:
-                self.messages.remove(msg)
-                tokens_removed += msg.token_estimate
-                self.current_token_count -= msg.token_estimate
-                self.logger.debug(f"Removed message: {msg}")
+        # Expanding references to a pruned block can add tokens back, so
+        # the limit is checked again after every message
+        while self.current_token_count > self.max_tokens and self._heap and len(self._messages) > 2:
+            _, seq = heapq.heappop(self._heap)
+            if seq not in self._messages:
+                continue  # Already removed
+            msg = self._evict(seq)
+            tokens_removed += msg.token_estimate
+            self.logger.debug(f"Removed message: {msg}")
         
         self.logger.info(f"Pruned {tokens_removed} tokens from conversation history")
     
+    def _prune_prefix(self):
+        """Evict the oldest messages after the system prompt in one contiguous chunk"""
+        target = int(self.max_tokens * self.prune_target)
+        self.logger.info(f"Pruning conversation history from {self.current_token_count} to {target} tokens")
+        
+        evictable = [seq for seq, msg in self._messages.items() if msg.role != "system"][:-1]
+        removed = 0
+        tokens_removed = 0
+        for seq in evictable:
+            # Stop at the target, but don't leave an assistant reply without
+            # the message it answered
+            if self.current_token_count <= target and self._messages[seq].role != "assistant":
+                break
+            msg = self._evict(seq)
+            removed += 1
+            tokens_removed += msg.token_estimate
+        
+        self.logger.info(f"Pruned {removed} messages ({tokens_removed} tokens) from the start of the conversation")
+    
+    def recalculate_tokens(self):
+        """Re-estimate every message, e.g. after the token counter was recalibrated"""
+        self.current_token_count = 0
+        for msg in self._messages.values():
+            msg.token_estimate = self.token_counter(msg.content)
+            self.current_token_count += msg.token_estimate
+        
+        self._enforce_limit()
+    
     def clear(self):
         """Clear conversation history, preserving system prompt"""
-        system_messages = [msg for msg in self.messages if msg.role == "system"]
-        self.messages = system_messages
-        self.current_token_count = sum(msg.token_estimate for msg in system_messages)
+        system_messages = [msg for msg in self._messages.values() if msg.role == "system"]
+        self._reset()
+        for msg in system_messages:
+            self._append(msg)
+        if self.journal is not None:
+            self.journal.append_clear()
+    
+    def _reset(self):
+        if self.blockstore:
+            self.blockstore.reset()
+        self._block_refs = {}
+        if self.compactor:
+            self.compactor.reset()
+        if self.retriever is not None:
+            self.retriever.reset()
+        self._messages = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self.current_token_count = 0
+    
+    def resume(self, journal):
+        """Fill the history from the tail of a session journal
+        
+        Only the newest messages that fit the token budget are read; the
+        system prompt comes from the current configuration. New messages
+        are appended to the same journal afterwards.
+        
+        Returns:
+            The number of messages restored
+        """
+        if self.compactor:
+            self.compactor.reset()
+        if self.retriever is not None:
+            self.retriever.reset()
+        budget = self.max_tokens - self.current_token_count
+        restored = 0
+        for record in journal.tail(budget, self.token_counter):
+            if record["role"] == "system":
+                continue
+            msg = Message(
+                role=record["role"],
+                content=record["content"],
+                timestamp=datetime.fromtimestamp(record["ts"]),
+                token_counter=self.token_counter
+            )
+            msg.importance = record.get("importance", 1.0)
+            self._append(msg)
+            restored += 1
+        
+        # Outputs referenced by restored messages may not have been restored
+        if self.blockstore:
+            self._expand_block_references()
+        self.journal = journal
+        self._enforce_limit()
+        return restored
     
     def get_messages_for_api(self) -> List[Dict[str, str]]:
         """Get messages in the format required by Ollama API"""
-        return [msg.to_dict() for msg in self.messages]
+        return [msg.to_dict() for msg in self._messages.values()]
     
     def save_to_file(self, file_path: str):
         """Save conversation history to a file"""
@@ -151,7 +445,7 @@ class ConversationHistory:
                     "timestamp": msg.timestamp.isoformat(),
                     "importance": msg.importance
                 }
-                for msg in self.messages
+                for msg in self._messages.values()
             ]
         }
         
@@ -163,15 +457,23 @@ class ConversationHistory:
         with open(file_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
-        self.messages = []
-        self.current_token_count = 0
+        self._reset()
         
         for msg_data in data.get("messages", []):
             msg = Message(
                 role=msg_data["role"],
                 content=msg_data["content"],
-                timestamp=datetime.fromisoformat(msg_data["timestamp"])
+                timestamp=datetime.fromisoformat(msg_data["timestamp"]),
+                token_counter=self.token_counter
             )
             msg.importance = msg_data.get("importance", 1.0)
-            self.messages.append(msg)
-            self.current_token_count += msg.token_estimate
\ No newline at end of file
+            self._append(msg)
+        if self.blockstore:
+            self._expand_block_references()
+        
+        # Record the loaded conversation so a resumed session starts from it
+        if self.journal is not None:
+            self.journal.append_clear()
+            for msg in self._messages.values():
+                if msg.role != "system":
+                    self.journal.append_message(msg.role, msg.content, msg.created, msg.importance)
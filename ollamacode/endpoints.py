@@ -0,0 +1,188 @@
+"""
+Multi-endpoint Ollama pool for OllamaCode.
+
+Routes each request to the healthy endpoint with the fewest outstanding
+requests, preferring endpoints that already have the model loaded, and
+keeps endpoint health and loaded models up to date in the background.
+"""
+
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Set, Union
+
+import requests
+
+
+class EndpointUnavailable(Exception):
+    """Raised when a request fails on an endpoint before producing any output
+
+    Such a request can safely be retried on another endpoint.
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__(str(error))
+        self.error = error
+
+
+class Endpoint:
+    """State of a single Ollama server"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.loaded_models: Set[str] = set()
+        self.models: Optional[Set[str]] = None  # None until fetched
+        self.requests = 0
+        self.failures = 0
+        self.last_checked = 0.0
+        self.last_error = ""
+
+    def api_url(self, path: str) -> str:
+        return f"{self.url}{path}"
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.url}, healthy={self.healthy}, outstanding={self.outstanding})"
+
+
+class EndpointPool:
+    """Pool of Ollama endpoints with least-loaded routing and health checks"""
+
+    def __init__(self, urls: List[str], transport, config: Dict[str, Any],
+                 logger: Optional[logging.Logger] = None):
+        if not urls:
+            raise ValueError("At least one Ollama endpoint is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.transport = transport
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def parse_urls(value: Union[str, List[str]]) -> List[str]:
+        """Get the endpoint URLs from an ollama_endpoint setting
+
+        Accepts a single URL, a comma-separated string of URLs or a list.
+        """
+        if isinstance(value, str):
+            value = value.split(",")
+        return [url.strip() for url in value if url and url.strip()]
+
+    @property
+    def primary(self) -> Endpoint:
+        """The first configured endpoint"""
+        return self.endpoints[0]
+
+    def get(self, url: str) -> Optional[Endpoint]:
+        """Get an endpoint by URL"""
+        url = url.rstrip("/")
+        return next((endpoint for endpoint in self.endpoints if endpoint.url == url), None)
+
+    def select(self, model: str, exclude: Optional[List[Endpoint]] = None) -> Optional[Endpoint]:
+        """Pick the endpoint for a request
+
+        Healthy endpoints are preferred. Among them, endpoints that have the
+        model loaded come first, then endpoints known to have the model, and
+        ties are broken by the number of outstanding requests.
+
+        Returns:
+            The selected endpoint, or None if every endpoint was excluded
+        """
+        exclude = exclude or []
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            if not candidates:
+                return None
+
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+            if healthy:
+                candidates = healthy
+
+            def rank(endpoint: Endpoint):
+                has_model = endpoint.models is None or model in endpoint.models
+                return (
+                    model not in endpoint.loaded_models,
+                    not has_model,
+                    endpoint.outstanding
+                )
+
+            return min(candidates, key=rank)
+
+    @contextmanager
+    def lease(self, endpoint: Endpoint):
+        """Count a request as outstanding on an endpoint while it runs"""
+        with self._lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        try:
+            yield endpoint
+        finally:
+            with self._lock:
+                endpoint.outstanding -= 1
+
+    def mark_failed(self, endpoint: Endpoint, error: str):
+        """Take an endpoint out of rotation until the next successful health check"""
+        with self._lock:
+            endpoint.healthy = False
+            endpoint.failures += 1
+            endpoint.last_error = error
+        self.logger.warning(f"Ollama endpoint {endpoint.url} failed: {error}")
+
+    def mark_loaded(self, endpoint: Endpoint, model: str):
+        """Record that an endpoint has served (and so loaded) a model"""
+        with self._lock:
+            endpoint.healthy = True
+            endpoint.loaded_models.add(model)
+
+    def check_health(self, endpoint: Endpoint) -> bool:
+        """Probe an endpoint and refresh its loaded models"""
+        try:
+            response = self.transport.get(endpoint.api_url("/api/ps"))
+            healthy = response.status_code == 200
+            loaded = None
+            if healthy:
+                loaded = {model.get("name", model.get("model")) for model in response.json().get("models", [])}
+            error = "" if healthy else f"HTTP {response.status_code}"
+        except (requests.RequestException, ValueError) as e:
+            healthy, loaded, error = False, None, str(e)
+
+        with self._lock:
+            if healthy and not endpoint.healthy:
+                self.logger.info(f"Ollama endpoint {endpoint.url} is healthy again")
+            endpoint.healthy = healthy
+            endpoint.last_checked = time.monotonic()
+            endpoint.last_error = error
+            if loaded is not None:
+                endpoint.loaded_models = loaded
+        return healthy
+
+    def check_all(self):
+        """Probe every endpoint"""
+        for endpoint in self.endpoints:
+            self.check_health(endpoint)
+
+    def start_health_checks(self):
+        """Start probing the endpoints periodically on a background thread"""
+        if len(self.endpoints) < 2 or self._health_thread:
+            return
+        interval = float(self.config.get("endpoint_health_interval", 15))
+        if interval <= 0:
+            return
+
+        def _loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.check_all()
+                except Exception as e:
+                    self.logger.error(f"Error checking endpoint health: {e}")
+
+        self._health_thread = threading.Thread(target=_loop, name="ollamacode-health", daemon=True)
+        self._health_thread.start()
+
+    def stop(self):
+        """Stop the background health checks"""
+        self._stop.set()
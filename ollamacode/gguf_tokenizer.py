@@ -0,0 +1,395 @@
+"""
+Exact offline token counting from the tokenizer embedded in GGUF models.
+
+Ollama stores each model as a GGUF blob under ~/.ollama/models (or
+$OLLAMA_MODELS). This module finds the blob of a model through its
+manifest, memory-maps it, reads only the tokenizer metadata and counts
+tokens with a byte-level BPE (tokenizer.ggml.model = "gpt2") or
+SentencePiece (tokenizer.ggml.model = "llama") implementation.
+
+Byte-level BPE splits text with the pre-tokenizer patterns of llama.cpp,
+which need the regex module for their Unicode classes. Models whose
+pre-tokenizer isn't known here, or any byte-level BPE model without the
+regex module, get no tokenizer, so their counts stay calibrated estimates.
+"""
+
+import os
+import re
+import json
+import mmap
+import heapq
+import struct
+import threading
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import regex
+except ImportError:
+    regex = None
+
+logger = logging.getLogger(__name__)
+
+GGUF_MAGIC = b"GGUF"
+MODEL_MEDIA_TYPE = "application/vnd.ollama.image.model"
+DEFAULT_REGISTRY = "registry.ollama.ai"
+
+# GGUF metadata value types: type id -> struct format of a scalar
+GGUF_SCALAR_TYPES = {
+    0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i",
+    6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d",
+}
+GGUF_TYPE_STRING = 8
+GGUF_TYPE_ARRAY = 9
+
+# Only these keys are decoded; other metadata is skipped
+TOKENIZER_KEYS = {
+    "tokenizer.ggml.model",
+    "tokenizer.ggml.pre",
+    "tokenizer.ggml.tokens",
+    "tokenizer.ggml.scores",
+    "tokenizer.ggml.merges",
+    "tokenizer.ggml.token_type",
+    "tokenizer.ggml.add_space_prefix",
+}
+
+# Pre-tokenizer patterns by tokenizer.ggml.pre, as in llama.cpp. Each
+# pattern splits the pieces left by the one before it, keeping the text
+# between matches as pieces of its own
+GPT2_PATTERN = r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+LLAMA3_PATTERN = (r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}|"""
+                  r""" ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""")
+QWEN2_PATTERN = (r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}|"""
+                 r""" ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""")
+TEKKEN_PATTERN = (r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+|"""
+                  r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*|"""
+                  r"""\p{N}| ?[^\s\p{L}\p{N}]+[\r\n/]*|\s*[\r\n]+|\s+(?!\S)|\s+""")
+CJK_PATTERN = "[\u4e00-\u9fa5\u0800-\u4e00\uac00-\ud7ff]+"
+
+PRE_TOKENIZER_PATTERNS = {
+    "gpt2": [GPT2_PATTERN],
+    "llama3": [LLAMA3_PATTERN],
+    "llama-v3": [LLAMA3_PATTERN],
+    "llama-bpe": [LLAMA3_PATTERN],
+    "falcon3": [LLAMA3_PATTERN],
+    "smaug-bpe": [LLAMA3_PATTERN],
+    "dbrx": [LLAMA3_PATTERN],
+    "qwen2": [QWEN2_PATTERN],
+    "deepseek-r1-qwen": [QWEN2_PATTERN],
+    "stablelm2": [QWEN2_PATTERN],
+    "tekken": [TEKKEN_PATTERN],
+    "starcoder": [r"\p{N}", GPT2_PATTERN],
+    "refact": [r"\p{N}", GPT2_PATTERN],
+    "command-r": [r"\p{N}", GPT2_PATTERN],
+    "smollm": [r"\p{N}", GPT2_PATTERN],
+    "codeshell": [r"\p{N}", GPT2_PATTERN],
+    "deepseek-coder": [r"[\r\n]", r"\s?\p{L}+", r"\s?\p{P}+", CJK_PATTERN, r"\p{N}"],
+    "deepseek-v3": [
+        r"\p{N}{1,3}",
+        "[\u4e00-\u9fa5\u3040-\u309f\u30a0-\u30ff]+",
+        (r"""[!"#$%&'()*+,\-./:;<=>?@\[\\\]^_`{|}~][A-Za-z]+|[^\r\n\p{L}\p{P}\p{S}]?[\p{L}\p{M}]+|"""
+         r""" ?[\p{P}\p{S}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""),
+    ],
+}
+
+
+def _compile_pre_tokenizer(name: Optional[str]) -> list:
+    """Compile the patterns of a pre-tokenizer
+
+    Raises:
+        ValueError: if the pre-tokenizer isn't known or the regex module is
+            missing; guessing either would make the counts inexact
+    """
+    if name not in PRE_TOKENIZER_PATTERNS:
+        raise ValueError(f"Unsupported pre-tokenizer '{name}'")
+    if regex is None:
+        raise ValueError("Byte-level BPE tokenizers need the regex module (pip install regex)")
+    return [regex.compile(pattern) for pattern in PRE_TOKENIZER_PATTERNS[name]]
+
+
+def _merge(symbols: List[str], priority) -> List[str]:
+    """Repeatedly merge the adjacent pair with the lowest priority, leftmost first
+
+    A heap of candidate pairs over a linked list of symbols keeps this
+    O(n log n) in the word length, so long words need no special casing.
+
+    Args:
+        symbols: Initial symbols of a word
+        priority: Called with (left, right); a sort key, or None if the pair
+            doesn't merge
+    """
+    following = list(range(1, len(symbols))) + [-1]
+    preceding = list(range(-1, len(symbols) - 1))
+    candidates: list = []
+
+    def push(left: int):
+        right = following[left]
+        if right >= 0:
+            key = priority(symbols[left], symbols[right])
+            if key is not None:
+                heapq.heappush(candidates, (key, left, symbols[left], symbols[right]))
+
+    for index in range(len(symbols) - 1):
+        push(index)
+    while candidates:
+        _, left, left_symbol, right_symbol = heapq.heappop(candidates)
+        right = following[left]
+        # Skip pairs that changed since they were pushed
+        if right < 0 or symbols[left] != left_symbol or symbols[right] != right_symbol:
+            continue
+        symbols[left] = left_symbol + right_symbol
+        symbols[right] = None
+        following[left] = following[right]
+        if following[left] >= 0:
+            preceding[following[left]] = left
+        if preceding[left] >= 0:
+            push(preceding[left])
+        push(left)
+    return [symbol for symbol in symbols if symbol is not None]
+
+
+def _bytes_to_unicode() -> Dict[int, str]:
+    """GPT-2's reversible mapping of bytes to printable characters"""
+    printable = (list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) +
+                 list(range(ord("®"), ord("ÿ") + 1)))
+    chars = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            chars.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, (chr(c) for c in chars)))
+
+
+BYTE_ENCODER = _bytes_to_unicode()
+
+
+def models_directory() -> str:
+    """Get the directory Ollama keeps its models in"""
+    return os.environ.get("OLLAMA_MODELS") or os.path.expanduser("~/.ollama/models")
+
+
+def find_model_blob(model: str, models_dir: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """Find the GGUF blob of a model through its Ollama manifest
+
+    Args:
+        model: Model name such as "llama3:8b" or "user/model:tag"
+        models_dir: Ollama's models directory (defaults to models_directory())
+
+    Returns:
+        Tuple of (blob path, digest), or None if the model isn't stored locally
+    """
+    models_dir = models_dir or models_directory()
+    name, _, tag = model.partition(":")
+    parts = name.split("/")
+    if len(parts) == 1:
+        parts = [DEFAULT_REGISTRY, "library"] + parts
+    elif len(parts) == 2:
+        parts = [DEFAULT_REGISTRY] + parts
+    manifest_path = os.path.join(models_dir, "manifests", *parts, tag or "latest")
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    for layer in manifest.get("layers", []):
+        if layer.get("mediaType") == MODEL_MEDIA_TYPE:
+            digest = layer["digest"]
+            path = os.path.join(models_dir, "blobs", digest.replace(":", "-"))
+            if os.path.exists(path):
+                return path, digest
+    return None
+
+
+class GGUFReader:
+    """Reads the metadata key/value section of a memory-mapped GGUF file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read_metadata(self, keys: Optional[set] = None) -> Dict[str, Any]:
+        """Decode the metadata values for the given keys (all keys if None)"""
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self._parse(data, keys)
+
+    def _parse(self, data, keys: Optional[set]) -> Dict[str, Any]:
+        if data[:4] != GGUF_MAGIC:
+            raise ValueError(f"{self.path} is not a GGUF file")
+        version = struct.unpack_from("<I", data, 4)[0]
+        # Version 1 used 32-bit counts and lengths
+        self._size_format = "<I" if version == 1 else "<Q"
+        self._size_length = struct.calcsize(self._size_format)
+        offset = 8 + self._size_length  # magic, version, tensor count
+        kv_count, offset = self._read_size(data, offset)
+
+        metadata = {}
+        for _ in range(kv_count):
+            key, offset = self._read_string(data, offset)
+            value_type = struct.unpack_from("<I", data, offset)[0]
+            offset += 4
+            wanted = keys is None or key in keys
+            value, offset = self._read_value(data, offset, value_type, decode=wanted)
+            if wanted:
+                metadata[key] = value
+                if keys is not None and len(metadata) == len(keys):
+                    break
+        return metadata
+
+    def _read_size(self, data, offset: int) -> Tuple[int, int]:
+        return struct.unpack_from(self._size_format, data, offset)[0], offset + self._size_length
+
+    def _read_string(self, data, offset: int, decode: bool = True):
+        length, offset = self._read_size(data, offset)
+        end = offset + length
+        if not decode:
+            return None, end
+        return data[offset:end].decode("utf-8", errors="replace"), end
+
+    def _read_value(self, data, offset: int, value_type: int, decode: bool = True):
+        if value_type in GGUF_SCALAR_TYPES:
+            fmt = GGUF_SCALAR_TYPES[value_type]
+            value = struct.unpack_from(fmt, data, offset)[0] if decode else None
+            return value, offset + struct.calcsize(fmt)
+        if value_type == GGUF_TYPE_STRING:
+            return self._read_string(data, offset, decode)
+        if value_type == GGUF_TYPE_ARRAY:
+            item_type = struct.unpack_from("<I", data, offset)[0]
+            count, offset = self._read_size(data, offset + 4)
+            if item_type in GGUF_SCALAR_TYPES:
+                fmt = GGUF_SCALAR_TYPES[item_type]
+                size = struct.calcsize(fmt) * count
+                if not decode:
+                    return None, offset + size
+                values = list(struct.unpack_from(f"<{count}{fmt[1]}", data, offset))
+                return values, offset + size
+            values = [] if decode else None
+            for _ in range(count):
+                value, offset = self._read_value(data, offset, item_type, decode)
+                if decode:
+                    values.append(value)
+            return values, offset
+        raise ValueError(f"Unknown GGUF value type {value_type} in {self.path}")
+
+
+class GGUFTokenizer:
+    """Counts tokens with the vocabulary embedded in a GGUF model"""
+
+    # Per-word results kept in the merge cache
+    CACHE_SIZE = 50000
+    # Longer words (minified code, base64) are rarely repeated, so they're
+    # counted without filling the cache
+    MAX_CACHED_WORD_LENGTH = 256
+
+    def __init__(self, metadata: Dict[str, Any]):
+        self.kind = metadata.get("tokenizer.ggml.model", "llama")
+        self.tokens: List[str] = metadata.get("tokenizer.ggml.tokens", [])
+        self.vocab = {token: index for index, token in enumerate(self.tokens)}
+        self.add_space_prefix = metadata.get("tokenizer.ggml.add_space_prefix", True)
+        self._cache: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        if self.kind == "gpt2":
+            self.ranks = {}
+            for rank, merge in enumerate(metadata.get("tokenizer.ggml.merges", [])):
+                left, _, right = merge.partition(" ")
+                self.ranks[(left, right)] = rank
+            self.pre_tokenizer = _compile_pre_tokenizer(metadata.get("tokenizer.ggml.pre"))
+        elif self.kind == "llama":
+            self.scores = metadata.get("tokenizer.ggml.scores") or [0.0] * len(self.tokens)
+        else:
+            raise ValueError(f"Unsupported tokenizer model '{self.kind}'")
+
+    def count(self, text: str) -> int:
+        """Count the tokens in a text"""
+        if not text:
+            return 0
+        if self.kind == "gpt2":
+            return sum(self._cached(word, self._bpe_count) for word in self._pre_tokenize(text))
+
+        text = text.replace(" ", "▁")
+        if self.add_space_prefix:
+            text = "▁" + text
+        # Pieces never merge across a word boundary marker, so each word
+        # (with its leading marker) is counted and cached on its own
+        words = re.findall("▁*[^▁]+|▁+", text)
+        return sum(self._cached(word, self._spm_count) for word in words)
+
+    def _pre_tokenize(self, text: str) -> List[str]:
+        """Split text into the words BPE merges within"""
+        words = [text]
+        for pattern in self.pre_tokenizer:
+            pieces = []
+            for word in words:
+                start = 0
+                for match in pattern.finditer(word):
+                    if match.start() > start:
+                        pieces.append(word[start:match.start()])
+                    if match.end() > match.start():
+                        pieces.append(match.group())
+                    start = match.end()
+                if start < len(word):
+                    pieces.append(word[start:])
+            words = pieces
+        return words
+
+    def _cached(self, word: str, counter) -> int:
+        if len(word) > self.MAX_CACHED_WORD_LENGTH:
+            return counter(word)
+        count = self._cache.get(word)
+        if count is None:
+            count = counter(word)
+            with self._lock:
+                if len(self._cache) >= self.CACHE_SIZE:
+                    self._cache.clear()
+                self._cache[word] = count
+        return count
+
+    def _bpe_count(self, word: str) -> int:
+        """Byte-level BPE: repeatedly apply the lowest-ranked merge"""
+        symbols = [BYTE_ENCODER[byte] for byte in word.encode("utf-8")]
+        return len(_merge(symbols, lambda left, right: self.ranks.get((left, right))))
+
+    def _spm_count(self, word: str) -> int:
+        """SentencePiece BPE: repeatedly merge the adjacent pair with the best score"""
+        def priority(left: str, right: str):
+            token_id = self.vocab.get(left + right)
+            return None if token_id is None else -self.scores[token_id]
+
+        symbols = _merge(list(word), priority)
+        # Characters missing from the vocabulary fall back to one token per byte
+        return sum(1 if symbol in self.vocab else len(symbol.encode("utf-8")) for symbol in symbols)
+
+
+_tokenizers: Dict[str, GGUFTokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def load_tokenizer(model: str, models_dir: Optional[str] = None) -> Optional[GGUFTokenizer]:
+    """Load the tokenizer of a locally stored model, cached per blob digest
+
+    Returns:
+        The tokenizer, or None if the model isn't available locally or its
+        tokenizer isn't supported
+    """
+    blob = find_model_blob(model, models_dir)
+    if blob is None:
+        logger.info(f"No local GGUF blob found for {model}")
+        return None
+    path, digest = blob
+
+    with _tokenizers_lock:
+        if digest in _tokenizers:
+            return _tokenizers[digest]
+        try:
+            metadata = GGUFReader(path).read_metadata(TOKENIZER_KEYS)
+            tokenizer = GGUFTokenizer(metadata)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Could not load the tokenizer of {model}: {e}")
+            return None
+        _tokenizers[digest] = tokenizer
+        logger.info(f"Loaded {tokenizer.kind} tokenizer of {model} ({len(tokenizer.tokens)} tokens)")
+        return tokenizer
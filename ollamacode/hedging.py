@@ -0,0 +1,240 @@
+"""
+Hedged chat requests for OllamaCode.
+
+Opens the /api/chat stream on the best endpoint and, when hedging is
+enabled, sends the same request to a second endpoint if the first hasn't
+produced a token within a percentile of recent time-to-first-token. The
+first stream to produce a token wins and the other one is closed, which
+makes Ollama stop generating it.
+"""
+
+import json
+import time
+import queue
+import socket
+import threading
+import logging
+from contextlib import ExitStack
+from typing import Dict, Any, Iterator, List, Optional, Callable
+
+import requests
+
+from .transport import OllamaAPIError
+from .endpoints import Endpoint, EndpointUnavailable
+from .telemetry import RequestStats, percentile
+
+
+class StreamAttempt:
+    """One /api/chat request to one endpoint
+
+    The attempt is opened on a background thread, which reads the stream up
+    to the first token. The winning attempt is then consumed with chunks().
+    """
+
+    def __init__(self, endpoint: Endpoint, stats: RequestStats, lease, hedge: bool = False):
+        self.endpoint = endpoint
+        self.stats = stats
+        self.hedge = hedge
+        self.response: Optional[requests.Response] = None
+        self._lines: Optional[Iterator[bytes]] = None
+        self._buffer: List[Dict[str, Any]] = []
+        self._cancelled = threading.Event()
+        self._lease = ExitStack()
+        self._lease.enter_context(lease)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def open(self, transport, data: Dict[str, Any]):
+        """Send the request and read the stream up to the first token
+
+        Raises:
+            EndpointUnavailable: If the request failed before any tokens arrived
+            OllamaAPIError: If Ollama rejected the request
+        """
+        try:
+            response = transport.post(self.endpoint.api_url("/api/chat"), json=data, stream=True)
+        except requests.RequestException as e:
+            raise EndpointUnavailable(e)
+
+        if response.status_code != 200:
+            try:
+                error_message = response.json().get('error', 'Unknown error')
+            except ValueError:
+                error_message = response.text
+            response.close()
+            error = OllamaAPIError(f"HTTP {response.status_code}: {error_message}")
+            # Server errors and missing models may be specific to this endpoint
+            if response.status_code >= 500 or response.status_code == 404:
+                raise EndpointUnavailable(error)
+            raise error
+
+        self.response = response
+        if self.cancelled:
+            response.close()
+            return
+
+        self._lines = response.iter_lines()
+        try:
+            for chunk in self._parse(self._lines):
+                self._buffer.append(chunk)
+                if chunk.get("done") or chunk.get("message", {}).get("content"):
+                    break
+        except requests.RequestException as e:
+            raise EndpointUnavailable(e)
+
+    @staticmethod
+    def _parse(lines: Iterator[bytes]) -> Iterator[Dict[str, Any]]:
+        for line in lines:
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+    def chunks(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the parsed chunks of the stream, starting with the buffered ones"""
+        while self._buffer:
+            yield self._buffer.pop(0)
+        if self._lines is not None:
+            yield from self._parse(self._lines)
+
+    def cancel(self):
+        """Abandon the attempt; safe to call from another thread"""
+        self._cancelled.set()
+        # Closing the response waits for the opening thread to finish its
+        # read, so shut the socket down first to interrupt the read
+        connection = getattr(self.response.raw, "connection", None) if self.response is not None else None
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.close()
+
+    def close(self):
+        """Close the stream and release the endpoint"""
+        if self.response is not None:
+            self.response.close()
+        self._lease.close()
+
+
+class StreamLauncher:
+    """Opens chat streams with failover and optional hedging
+
+    Hedging is configured with:
+        hedge_requests: Enable hedging (needs more than one endpoint)
+        hedge_percentile: Percentile of recent time-to-first-token to wait
+            before sending the request to a second endpoint
+        hedge_min_samples: Recent requests needed before hedging starts
+    """
+
+    def __init__(self, client, config: Dict[str, Any], logger: Optional[logging.Logger] = None):
+        self.client = client
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait for a first token before hedging, or None to never hedge"""
+        if not self.config.get("hedge_requests", False) or len(self.client.endpoints.endpoints) < 2:
+            return None
+        ttfts = self.client.telemetry.values("ttft")
+        if len(ttfts) < int(self.config.get("hedge_min_samples", 10)):
+            return None
+        return percentile(ttfts, float(self.config.get("hedge_percentile", 95))) / 1000
+
+    def open(self, data: Dict[str, Any],
+             should_stop: Optional[Callable[[], bool]] = None) -> Optional[StreamAttempt]:
+        """Open a chat stream on the best endpoint, failing over and hedging as needed
+
+        Returns:
+            The winning attempt (the caller must close it), or None if
+            should_stop asked to stop before any stream started
+
+        Raises:
+            OllamaAPIError: If Ollama rejected the request
+            requests.RequestException: If no endpoint could be reached
+        """
+        model = data["model"]
+        endpoints = self.client.endpoints
+        started_at = time.monotonic()
+        hedge_delay = self.hedge_delay()
+        results: queue.Queue = queue.Queue()
+        tried: List[Endpoint] = []
+        active: List[StreamAttempt] = []
+        last_error: Optional[Exception] = None
+
+        def launch(hedge: bool = False) -> bool:
+            endpoint = endpoints.select(model, exclude=tried)
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            attempt = StreamAttempt(endpoint, RequestStats(model, endpoint.url, started_at),
+                                    endpoints.lease(endpoint), hedge)
+            active.append(attempt)
+
+            def _run():
+                try:
+                    attempt.open(self.client.transport, data)
+                    results.put((attempt, None))
+                except Exception as e:
+                    results.put((attempt, e))
+
+            threading.Thread(target=_run, name="ollamacode-stream", daemon=True).start()
+            return True
+
+        winner = None
+        try:
+            launch()
+            hedged = False
+            while active:
+                if should_stop and should_stop():
+                    return None
+
+                timeout = 0.1
+                if hedge_delay is not None and not hedged:
+                    timeout = min(timeout, max(0.0, started_at + hedge_delay - time.monotonic()))
+                try:
+                    attempt, error = results.get(timeout=timeout)
+                except queue.Empty:
+                    if (hedge_delay is not None and not hedged and
+                            time.monotonic() - started_at >= hedge_delay):
+                        hedged = True
+                        if launch(hedge=True):
+                            self.hedges += 1
+                            self.logger.info(f"No first token after {hedge_delay * 1000:.0f}ms, "
+                                             f"hedging request to {tried[-1].url}")
+                    continue
+
+                active.remove(attempt)
+                if error is None:
+                    winner = attempt
+                    if attempt.hedge:
+                        self.hedge_wins += 1
+                    attempt.stats.hedged = hedged
+                    return attempt
+
+                attempt.close()
+                if isinstance(error, EndpointUnavailable):
+                    endpoints.mark_failed(attempt.endpoint, str(error))
+                    self.client.inventory.invalidate()
+                    last_error = error.error
+                    # Fail over right away if nothing else is in flight
+                    if not active:
+                        launch()
+                    continue
+                if isinstance(error, OllamaAPIError):
+                    self.client.inventory.invalidate()
+                raise error
+
+            # Every endpoint failed; report the last error
+            raise last_error
+        finally:
+            for attempt in active:
+                if attempt is not winner:
+                    attempt.cancel()
@@ -0,0 +1,92 @@
+"""
+Inference options for Ollama requests.
+
+Ollama only honours sampling and context settings inside the request's
+"options" object. The context size (num_ctx) is sized per request to the
+prompt plus the reserved output budget and rounded up to a few buckets,
+since every change of num_ctx makes Ollama reload the model. Within a
+session num_ctx only grows, so shorter requests keep the already loaded
+context instead of triggering a reload.
+"""
+
+import threading
+import logging
+from typing import Dict, Any, Optional
+
+# num_ctx sizes requests are rounded up to
+DEFAULT_NUM_CTX_BUCKETS = [4096, 8192, 16384, 32768, 65536, 131072]
+
+# Output budget reserved when num_predict is unlimited
+DEFAULT_OUTPUT_RESERVE = 2048
+
+# Headroom for token estimates that come in under the real count
+ESTIMATE_MARGIN = 1.1
+
+
+class InferenceOptions:
+    """Builds the options object of each request
+
+    Configuration:
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens to generate per reply (num_predict)
+        context_window: Largest num_ctx to request
+        num_ctx_buckets: Sizes num_ctx is rounded up to
+        ollama_options: Extra options sent with every request
+        option_profiles: Named option overrides, e.g. for short tool follow-ups
+    """
+
+    def __init__(self, config: Dict[str, Any], logger: Optional[logging.Logger] = None):
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._num_ctx: Dict[str, int] = {}
+
+    def profile(self, name: Optional[str]) -> Dict[str, Any]:
+        """Get the option overrides of a profile (empty if it isn't configured)"""
+        if not name:
+            return {}
+        return dict(self.config.get("option_profiles", {}).get(name, {}))
+
+    def build(self, model: str, prompt_tokens: int, profile: Optional[str] = None) -> Dict[str, Any]:
+        """Build the options for a request
+
+        Args:
+            model: The model the request goes to
+            prompt_tokens: Estimated tokens in the prompt
+            profile: Name of an option profile to apply
+
+        Returns:
+            The options object for the request
+        """
+        options = {
+            "temperature": self.config["temperature"],
+            "num_predict": self.config["max_tokens"],
+        }
+        options.update(self.config.get("ollama_options", {}))
+        options.update(self.profile(profile))
+
+        if "num_ctx" not in options:
+            num_predict = int(options["num_predict"])
+            reserve = num_predict if num_predict > 0 else DEFAULT_OUTPUT_RESERVE
+            options["num_ctx"] = self.num_ctx(model, int(prompt_tokens * ESTIMATE_MARGIN) + reserve)
+        return options
+
+    def num_ctx(self, model: str, needed: int) -> int:
+        """Get the context size for a request needing a number of tokens
+
+        The size is rounded up to a bucket and never drops below the one
+        already used for the model, so the loaded model isn't reloaded.
+        """
+        limit = int(self.config.get("context_window", DEFAULT_NUM_CTX_BUCKETS[-1]))
+        buckets = sorted(size for size in self.config.get("num_ctx_buckets", DEFAULT_NUM_CTX_BUCKETS)
+                         if size < limit) + [limit]
+        size = next((bucket for bucket in buckets if bucket >= needed), limit)
+
+        with self._lock:
+            current = self._num_ctx.get(model, 0)
+            if size <= current:
+                return current
+            self._num_ctx[model] = size
+        if current:
+            self.logger.info(f"Growing num_ctx for {model}: {current} -> {size} (needs {needed} tokens)")
+        return size
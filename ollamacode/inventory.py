@@ -0,0 +1,107 @@
+"""
+Cached endpoint health and model inventory for OllamaCode.
+"""
+
+import time
+import threading
+import logging
+from typing import Callable, List, Optional, Tuple
+
+
+class ModelInventory:
+    """Caches server reachability and the list of available models
+
+    The inventory is filled by a fetch callable that returns a tuple of
+    (reachable, models). Once populated, reads never block on the network:
+    stale entries are served while a background thread refreshes them.
+    """
+
+    def __init__(self, fetch: Callable[[], Tuple[bool, Optional[List[str]]]], ttl: float = 60.0,
+                 logger: Optional[logging.Logger] = None):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._reachable: Optional[bool] = None
+        self._models: Optional[List[str]] = None
+        self._fetched_at = 0.0
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    @property
+    def populated(self) -> bool:
+        """Whether the inventory has been fetched at least once"""
+        return self._reachable is not None
+
+    @property
+    def is_stale(self) -> bool:
+        """Whether the cached data is older than the TTL"""
+        return time.monotonic() - self._fetched_at > self.ttl
+
+    def refresh(self) -> bool:
+        """Fetch the inventory synchronously
+
+        Returns:
+            Whether the server was reachable
+        """
+        reachable, models = self._fetch()
+        with self._lock:
+            self._reachable = reachable
+            # Keep the last known model list if the server returned nothing usable
+            if models is not None:
+                self._models = models
+            self._fetched_at = time.monotonic()
+        self.logger.debug(f"Model inventory refreshed: reachable={reachable}, models={models}")
+        return reachable
+
+    def refresh_async(self):
+        """Refresh the inventory in a background thread if one isn't already running"""
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_quietly,
+                name="ollamacode-inventory",
+                daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.logger.error(f"Error refreshing model inventory: {e}")
+
+    def invalidate(self):
+        """Mark the cached data as stale and refresh it in the background"""
+        with self._lock:
+            self._fetched_at = 0.0
+        self.refresh_async()
+
+    def _ensure_fresh(self):
+        """Populate synchronously on first use, otherwise refresh stale data in the background"""
+        if not self.populated:
+            self.refresh()
+        elif self.is_stale:
+            self.refresh_async()
+
+    def is_reachable(self) -> bool:
+        """Get the cached reachability of the server"""
+        self._ensure_fresh()
+        return bool(self._reachable)
+
+    def get_models(self) -> List[str]:
+        """Get the cached list of available models"""
+        self._ensure_fresh()
+        return list(self._models or [])
+
+    def has_model(self, model_name: str) -> Optional[bool]:
+        """Check the cached model list for a model
+
+        Returns:
+            True or False if the model list is known, None if it isn't
+        """
+        self._ensure_fresh()
+        if not self._models:
+            return None
+        return model_name in self._models
@@ -0,0 +1,228 @@
+"""
+Append-only session journal for OllamaCode.
+
+Every message added to the conversation is appended to a JSONL file as one
+line, so saving costs O(1) per message no matter how long the session is.
+A sidecar index holds the byte offset of every entry, which lets a resumed
+session read just the tail it needs to fill the context window and fetch
+older entries on demand. A torn final line from a crash is dropped on open.
+
+Journals hold prompts and tool output, which can include secrets, so their
+directory is created readable by the owner only, the files are 0600, and
+old journals are deleted by prune().
+"""
+
+import os
+import json
+import time
+import glob
+import struct
+import logging
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+OFFSET_FORMAT = "<Q"
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+
+def _open_private(path: str, mode: str):
+    """Open a file for writing, creating it (or restricting it) to mode 0600"""
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if mode == "ab" else os.O_TRUNC)
+    fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o600)
+    if hasattr(os, "fchmod"):
+        os.fchmod(fd, 0o600)
+    return os.fdopen(fd, mode)
+
+
+class SessionJournal:
+    """JSONL journal of conversation messages with an offset index
+
+    Args:
+        path: Journal file; the index is kept next to it as <path>.idx
+        fsync: "always" to fsync after every entry, "interval" to fsync at
+            most every fsync_interval seconds, or "never" to leave it to the OS
+    """
+
+    FSYNC_POLICIES = ("always", "interval", "never")
+
+    def __init__(self, path: str, fsync: str = "interval", fsync_interval: float = 1.0,
+                 logger: Optional[logging.Logger] = None):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}'")
+        self.path = os.path.expanduser(path)
+        self.index_path = self.path + ".idx"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._last_fsync = time.monotonic()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._recover()
+        self._file = _open_private(self.path, "ab")
+        self._index = _open_private(self.index_path, "ab")
+        self._size = self._file.seek(0, os.SEEK_END)
+        self._count = self._index.seek(0, os.SEEK_END) // OFFSET_SIZE
+
+    @staticmethod
+    def latest(directory: str) -> Optional[str]:
+        """Get the most recently written journal in a directory"""
+        journals = glob.glob(os.path.join(os.path.expanduser(directory), "*.jsonl"))
+        return max(journals, key=os.path.getmtime) if journals else None
+
+    @staticmethod
+    def prune(directory: str, keep: int = 0, max_age_days: float = 0, exclude: Optional[str] = None) -> int:
+        """Delete old journals and their indexes from a directory
+
+        Args:
+            keep: Most journals left, newest first; 0 for no limit
+            max_age_days: Journals not written for longer are deleted; 0 for no limit
+            exclude: Journal that is never deleted (the one being resumed)
+
+        Returns:
+            The number of journals deleted
+        """
+        exclude = os.path.abspath(os.path.expanduser(exclude)) if exclude else None
+        journals = [path for path in glob.glob(os.path.join(os.path.expanduser(directory), "*.jsonl"))
+                    if os.path.abspath(path) != exclude]
+        journals.sort(key=os.path.getmtime, reverse=True)
+        cutoff = time.time() - max_age_days * 86400
+        stale = [path for position, path in enumerate(journals)
+                 if (keep and position >= keep) or (max_age_days and os.path.getmtime(path) < cutoff)]
+        for path in stale:
+            for name in (path, path + ".idx"):
+                try:
+                    os.unlink(name)
+                except OSError:
+                    pass
+        return len(stale)
+
+    def _recover(self):
+        """Drop a torn final line and make sure the index matches the journal"""
+        if not os.path.exists(self.path):
+            _open_private(self.path, "wb").close()
+            _open_private(self.index_path, "wb").close()
+            return
+
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            # Scan back to the last complete line
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                block = f.read(end - start)
+                if end == size and block.endswith(b"\n"):
+                    break
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != size:
+                self.logger.warning(f"Dropping {size - end} bytes of a torn entry from {self.path}")
+                f.truncate(end)
+            size = end
+
+        if not self._index_valid(size):
+            self._rebuild_index()
+
+    def _index_valid(self, size: int) -> bool:
+        if not os.path.exists(self.index_path):
+            return False
+        index_size = os.path.getsize(self.index_path)
+        if index_size % OFFSET_SIZE:
+            return False
+        if index_size == 0:
+            return size == 0
+        with open(self.index_path, "rb") as index:
+            index.seek(index_size - OFFSET_SIZE)
+            last_offset = struct.unpack(OFFSET_FORMAT, index.read(OFFSET_SIZE))[0]
+        if last_offset >= size:
+            return False
+        # The last indexed entry must be the last line of the journal
+        with open(self.path, "rb") as f:
+            f.seek(last_offset)
+            tail = f.read(size - last_offset)
+        return tail.count(b"\n") == 1
+
+    def _rebuild_index(self):
+        self.logger.info(f"Rebuilding the index of {self.path}")
+        with open(self.path, "rb") as f, _open_private(self.index_path, "wb") as index:
+            offset = 0
+            for line in f:
+                index.write(struct.pack(OFFSET_FORMAT, offset))
+                offset += len(line)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, record: Dict[str, Any]):
+        """Append an entry; costs the same regardless of the journal's length"""
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._file.flush()
+        # The index is written after the entry, so a crash in between only
+        # leaves an index that _recover rebuilds
+        self._index.write(struct.pack(OFFSET_FORMAT, self._size))
+        self._index.flush()
+        self._size += len(line)
+        self._count += 1
+
+        if self.fsync == "always" or (
+                self.fsync == "interval" and time.monotonic() - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            os.fsync(self._index.fileno())
+            self._last_fsync = time.monotonic()
+
+    def append_message(self, role: str, content: str, created: float, importance: float):
+        self.append({"type": "message", "role": role, "content": content,
+                     "ts": created, "importance": importance})
+
+    def append_clear(self):
+        """Record that the conversation was cleared; resuming starts after it"""
+        self.append({"type": "clear", "ts": time.time()})
+
+    def read(self, index: int) -> Dict[str, Any]:
+        """Read one entry by its position in the journal"""
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        with open(self.index_path, "rb") as idx:
+            idx.seek(index * OFFSET_SIZE)
+            offsets = idx.read(OFFSET_SIZE * 2)
+        start = struct.unpack_from(OFFSET_FORMAT, offsets)[0]
+        end = struct.unpack_from(OFFSET_FORMAT, offsets, OFFSET_SIZE)[0] if len(offsets) > OFFSET_SIZE else self._size
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(end - start))
+
+    def reverse_entries(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the entries from newest to oldest"""
+        for index in range(self._count - 1, -1, -1):
+            yield self.read(index)
+
+    def tail(self, max_tokens: int, token_counter: Callable[[str], int]) -> List[Dict[str, Any]]:
+        """Read the newest messages that fit in a token budget, oldest first
+
+        Stops at the last time the conversation was cleared.
+        """
+        records = []
+        tokens = 0
+        for record in self.reverse_entries():
+            if record.get("type") == "clear":
+                break
+            if record.get("type") != "message":
+                continue
+            tokens += token_counter(record["content"])
+            if tokens > max_tokens and records:
+                break
+            records.append(record)
+        records.reverse()
+        return records
+
+    def close(self):
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+            os.fsync(self._index.fileno())
+        self._file.close()
+        self._index.close()
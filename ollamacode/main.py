@@ -12,6 +12,7 @@ from typing import Dict, Any, List, Optional
 
 from .config import load_config, save_config
 from .client import OllamaClient
+from .endpoints import EndpointPool
 from .utils import Colors
 from .commands import CommandRegistry
 from .logging import setup_logging, ErrorHandler
@@ -23,7 +24,7 @@ def main():
     parser = argparse.ArgumentParser(description="OllamaCode - A Claude Code alternative using Ollama")
     parser.add_argument("prompt", nargs="*", help="The initial prompt (optional)")
     parser.add_argument("--model", "-m", help="Specify the Ollama model to use")
-    parser.add_argument("--endpoint", "-e", help="Specify the Ollama API endpoint")
+    parser.add_argument("--endpoint", "-e", help="Specify the Ollama API endpoint (comma-separated for several servers)")
     parser.add_argument("--temperature", "-t", type=float, help="Set the temperature (0.0-1.0)")
     parser.add_argument("--list-models", "-l", action="store_true", help="List available models and exit")
     parser.add_argument("--version", "-v", action="store_true", help="Show version and exit")
@@ -38,6 +39,9 @@ def main():
     parser.add_argument("--log-file", help="Log file path")
     parser.add_argument("--plugins-dir", help="Directory for tool plugins")
     parser.add_argument("--no-plugins", action="store_true", help="Disable loading of plugins")
+    parser.add_argument("--non-interactive", action="store_true", help="Run the prompt through the agent and exit")
+    parser.add_argument("--resume", nargs="?", const="latest", metavar="JOURNAL",
+                        help="Resume a session journal (the most recent one if no file is given)")
     
     args = parser.parse_args()
     
@@ -97,7 +101,7 @@ def main():
         # Check Ollama connection
         if not client.check_ollama_connection():
             error_message = error_handler.handle_error(
-                Exception(f"Cannot connect to Ollama at {config['ollama_endpoint']}"),
+                Exception(f"Cannot connect to Ollama at {', '.join(EndpointPool.parse_urls(config['ollama_endpoint']))}"),
                 context="connection check",
                 exit_on_error=True
             )
@@ -114,6 +118,21 @@ def main():
                 print(f"{Colors.YELLOW}No models found or couldn't retrieve model list.{Colors.ENDC}")
             return
         
+        # Journal this session, picking up an earlier one if requested
+        client.start_session(args.resume)
+        
+        # Run a single prompt without the interactive session
+        if args.non_interactive:
+            if not args.prompt:
+                print(f"{Colors.RED}Error: --non-interactive requires a prompt{Colors.ENDC}")
+                sys.exit(2)
+            run = client.agent.run(" ".join(args.prompt))
+            client.close()
+            sys.exit(1 if run.status == "error" else 0)
+        
+        # Load the model while the welcome banner prints
+        client.residency.warm_up(config["model"])
+        
         # Print welcome message
         print(f"\n{Colors.BOLD}{Colors.HEADER}🤖 OllamaCode{Colors.ENDC} - A Claude Code alternative using Ollama")
         print(f"Using model: {Colors.BOLD}{config['model']}{Colors.ENDC}")
@@ -161,6 +180,9 @@ def main():
             except Exception as e:
                 error_handler.handle_error(e, context="main loop")
                 continue
+        
+        # Release pooled connections to Ollama
+        client.close()
                 
     except Exception as e:
         error_handler.handle_error(e, context="initialization", exit_on_error=True)
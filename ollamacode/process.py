@@ -0,0 +1,373 @@
+"""
+Subprocess runner that streams output without deadlocking.
+
+stdout and stderr are drained as soon as data arrives, using a selector on
+the pipes, so a command that writes more than the pipe buffer never blocks
+on a full pipe. Process exit is an event in the same selector (a pidfd on
+Linux, a waiter thread elsewhere), so the runner returns as soon as the
+process exits and enforces the timeout without polling. On Windows, where
+pipes can't be selected, reader threads drain the pipes instead.
+
+Every process gets its own process group, so a timeout kills everything it
+started (background jobs, make -j workers) and not just the shell. Optional
+resource limits are set by a wrapper the command is exec'd from (prlimit,
+or a small Python script where prlimit is missing), which keeps them free
+of preexec_fn, unsafe in a process with threads. The process's CPU time and
+peak memory are collected with wait4. With max_output set, only the head
+and tail of each stream are kept in memory (see capture.py).
+"""
+
+import os
+import sys
+import time
+import codecs
+import queue
+import shutil
+import signal
+import selectors
+import subprocess
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from .capture import OutputCapture
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Bytes read from a pipe at a time
+READ_SIZE = 65536
+
+# Seconds a timed-out process gets to exit after SIGTERM before it's killed
+TERMINATE_GRACE = 1.0
+
+# Timeouts (seconds) and output caps (characters) per tool
+DEFAULT_COMMAND_LIMITS = {
+    "bash": {"timeout": 30, "max_output": 10000},
+    "python_run": {"timeout": 15, "max_output": 10000},
+}
+
+# Resource limits; 0 leaves a limit unset. cpu_seconds and memory_mb apply
+# to each process a command starts; processes caps every process of the user
+# (RLIMIT_NPROC), so it has to leave room for everything else they run
+DEFAULT_RESOURCE_LIMITS = {"cpu_seconds": 0, "memory_mb": 0, "processes": 0}
+
+# Resource limit settings: (key, prlimit option, resource name, scale)
+RLIMITS = (
+    ("cpu_seconds", "--cpu", "RLIMIT_CPU", 1),
+    ("memory_mb", "--as", "RLIMIT_AS", 1024 * 1024),
+    ("processes", "--nproc", "RLIMIT_NPROC", 1),
+)
+
+# Sets the limits given as NAME=VALUE arguments, then execs the command after "--"
+LIMIT_WRAPPER = (
+    "import os, sys, resource\n"
+    "split = sys.argv.index('--')\n"
+    "for setting in sys.argv[1:split]:\n"
+    "    name, value = setting.split('=')\n"
+    "    resource.setrlimit(getattr(resource, name), (int(value), int(value)))\n"
+    "os.execvp(sys.argv[split + 1], sys.argv[split + 1:])\n"
+)
+
+OutputCallback = Callable[[str, str], None]
+
+
+def command_limits(config: Dict[str, Any], tool: str) -> Dict[str, Any]:
+    """Get the timeout, output cap and resource limits for a tool
+
+    resource_limits applies to every tool; an entry for the tool in
+    command_limits overrides any of the values.
+    """
+    limits = dict(DEFAULT_COMMAND_LIMITS.get(tool, DEFAULT_COMMAND_LIMITS["bash"]))
+    limits.update(DEFAULT_RESOURCE_LIMITS)
+    limits.update(config.get("resource_limits", {}))
+    limits.update(config.get("command_limits", {}).get(tool, {}))
+    return limits
+
+
+class ProcessResult:
+    """Outcome of a finished (or timed-out) process"""
+
+    def __init__(self, returncode: Optional[int], stdout: str, stderr: str,
+                 timed_out: bool, duration: float, rusage: Optional[Dict[str, float]] = None,
+                 handles: Optional[Dict[str, str]] = None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.duration = duration
+        self.rusage = rusage
+        self.handles = handles or {}  # Stream name -> spill file handle
+
+    def __repr__(self) -> str:
+        return (f"ProcessResult(returncode={self.returncode}, timed_out={self.timed_out}, "
+                f"{len(self.stdout)}+{len(self.stderr)} chars, {self.duration:.2f}s)")
+
+
+def run_process(args: Union[str, List[str]], shell: bool = False, cwd: Optional[str] = None,
+                env: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                on_output: Optional[OutputCallback] = None, limits: Optional[Dict[str, Any]] = None,
+                max_output: Optional[int] = None, spill_dir: Optional[str] = None, label: str = "output",
+                logger: Optional[logging.Logger] = None) -> ProcessResult:
+    """Run a process, collecting (and optionally streaming) its output
+
+    Args:
+        args: Command line, or a string with shell=True
+        shell: Run the command through the shell
+        cwd: Working directory
+        env: Environment (defaults to the current one)
+        timeout: Seconds before the process group is terminated
+        on_output: Called with ("stdout" or "stderr", text) as output arrives
+        limits: cpu_seconds, memory_mb and processes limits for the process
+        max_output: Characters of each stream kept in memory (None keeps all)
+        spill_dir: Directory longer output is written to in full
+        label: Prefix of spill file names
+
+    Returns:
+        ProcessResult; returncode is None if the process had to be killed
+    """
+    logger = logger or logging.getLogger(__name__)
+    start = time.monotonic()
+    deadline = start + timeout if timeout else None
+    command = limited_command(args, shell, limits)
+    process = subprocess.Popen(
+        command,
+        # A wrapped command runs the shell itself
+        shell=shell and command is args,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **popen_isolation()
+    )
+
+    output = {name: OutputCapture(max_output, spill_dir, f"{label}-{name}", logger)
+              for name in ("stdout", "stderr")}
+    decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in output}
+
+    def emit(name: str, data: bytes, final: bool = False):
+        text = decoders[name].decode(data, final)
+        if text:
+            output[name].write(text)
+            if on_output:
+                on_output(name, text)
+
+    exit_status: Dict[str, Any] = {}
+    try:
+        if sys.platform == "win32":
+            exited = _drain_with_threads(process, deadline, emit)
+        else:
+            exited = _drain_with_selector(process, deadline, emit, exit_status)
+    except BaseException:
+        # Don't leave the process running on Ctrl+C or a failing callback
+        kill_process_group(process)
+        process.stdout.close()
+        process.stderr.close()
+        for capture in output.values():
+            capture.finish()
+        raise
+
+    timed_out = not exited
+    if timed_out:
+        logger.warning(f"Process timed out after {timeout} seconds: {args}")
+        kill_process_group(process)
+    for name in output:
+        emit(name, b"", final=True)
+    process.stdout.close()
+    process.stderr.close()
+
+    return ProcessResult(
+        returncode=None if timed_out else process.returncode,
+        stdout=output["stdout"].finish(),
+        stderr=output["stderr"].finish(),
+        timed_out=timed_out,
+        duration=time.monotonic() - start,
+        rusage=exit_status.get("rusage"),
+        handles={name: capture.handle for name, capture in output.items() if capture.handle}
+    )
+
+
+def popen_isolation() -> Dict[str, Any]:
+    """Popen arguments that put the process in its own process group"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def limited_command(args: Union[str, List[str]], shell: bool, limits: Optional[Dict[str, Any]]) -> Union[str, List[str]]:
+    """Wrap a command so it runs with its resource limits
+
+    The wrapper sets the limits on itself and execs the command, so it
+    keeps the wrapper's process id (and process group) and no limit can be
+    escaped by starting a child before it is set.
+
+    Returns:
+        The command to pass to Popen (with shell=False if it was wrapped)
+    """
+    settings = [(option, name, int(limits[key] * scale)) for key, option, name, scale in RLIMITS
+                if limits and limits.get(key)] if resource is not None else []
+    if not settings:
+        return args
+    if shell:
+        command = ["/bin/sh", "-c", args]
+    else:
+        command = [args] if isinstance(args, str) else list(args)
+
+    prlimit = shutil.which("prlimit")
+    if prlimit:
+        return [prlimit] + [f"{option}={value}" for option, _, value in settings] + ["--"] + command
+    return ([sys.executable, "-I", "-S", "-c", LIMIT_WRAPPER] +
+            [f"{name}={value}" for _, name, value in settings] + ["--"] + command)
+
+
+def kill_process_group(process: subprocess.Popen):
+    """Terminate a process and everything in its process group"""
+    if sys.platform == "win32":
+        process.terminate()
+        try:
+            process.wait(TERMINATE_GRACE)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        process.wait()
+        return
+    try:
+        process.wait(TERMINATE_GRACE)
+    except subprocess.TimeoutExpired:
+        pass
+    # Children that ignored SIGTERM may outlive the group leader
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    process.wait()
+
+
+def _reap(process: subprocess.Popen) -> Optional[Dict[str, float]]:
+    """Wait for a process with wait4, recording its exit code and resource usage"""
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        process.wait()  # Already reaped elsewhere
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return {
+        "user_time": round(usage.ru_utime, 3),
+        "sys_time": round(usage.ru_stime, 3),
+        "max_rss_kb": max_rss
+    }
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _drain_with_selector(process: subprocess.Popen, deadline: Optional[float], emit,
+                         exit_status: Dict[str, Any]) -> bool:
+    """Read both pipes until the process exits and they're drained
+
+    Returns:
+        False if the deadline passed first
+    """
+    selector = selectors.DefaultSelector()
+    streams = {process.stdout.fileno(): "stdout", process.stderr.fileno(): "stderr"}
+    for fd, name in streams.items():
+        selector.register(fd, selectors.EVENT_READ, name)
+
+    exit_fd, waiter = _exit_notifier(process, exit_status)
+    selector.register(exit_fd, selectors.EVENT_READ, None)
+    exited = False
+
+    try:
+        while streams or not exited:
+            # Once the process has exited, only read what is already buffered:
+            # a background child may keep the pipes open indefinitely
+            timeout = 0 if exited else _remaining(deadline)
+            events = selector.select(timeout)
+            if not events:
+                if exited:
+                    break
+                return False
+            for key, _ in events:
+                if key.data is None:
+                    selector.unregister(exit_fd)
+                    exited = True
+                    if waiter is None:
+                        exit_status["rusage"] = _reap(process)
+                    continue
+                data = os.read(key.fd, READ_SIZE)
+                if data:
+                    emit(key.data, data)
+                else:
+                    selector.unregister(key.fd)
+                    del streams[key.fd]
+        if waiter:
+            waiter.join()
+        return True
+    finally:
+        selector.close()
+        os.close(exit_fd)
+
+
+def _exit_notifier(process: subprocess.Popen, exit_status: Dict[str, Any]):
+    """Get a file descriptor that becomes readable when the process exits
+
+    Returns:
+        Tuple of (fd, waiter thread or None); without a waiter thread the
+        caller reaps the process once the fd is readable
+    """
+    if hasattr(os, "pidfd_open"):
+        try:
+            return os.pidfd_open(process.pid), None
+        except OSError:
+            pass  # Kernel without pidfd support
+
+    read_fd, write_fd = os.pipe()
+
+    def wait():
+        exit_status["rusage"] = _reap(process)
+        os.close(write_fd)
+
+    waiter = threading.Thread(target=wait, name="ollamacode-process-wait", daemon=True)
+    waiter.start()
+    return read_fd, waiter
+
+
+def _drain_with_threads(process: subprocess.Popen, deadline: Optional[float], emit) -> bool:
+    """Read both pipes on threads, for platforms where pipes can't be selected"""
+    chunks: "queue.Queue" = queue.Queue()
+
+    def reader(name, pipe):
+        for data in iter(lambda: pipe.read1(READ_SIZE), b""):
+            chunks.put((name, data))
+        chunks.put((name, None))
+
+    for name in ("stdout", "stderr"):
+        threading.Thread(target=reader, args=(name, getattr(process, name)),
+                         name=f"ollamacode-process-{name}", daemon=True).start()
+
+    open_streams = 2
+    while open_streams:
+        try:
+            name, data = chunks.get(timeout=_remaining(deadline))
+        except queue.Empty:
+            return False
+        if data is None:
+            open_streams -= 1
+        else:
+            emit(name, data)
+    try:
+        process.wait(_remaining(deadline))
+    except subprocess.TimeoutExpired:
+        return False
+    return True
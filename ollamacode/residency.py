@@ -0,0 +1,140 @@
+"""
+Model residency management for OllamaCode.
+
+Preloads the active model so the first prompt doesn't pay the model load
+time, and checks which models Ollama already has loaded (/api/ps) so that a
+warm-up never forces a reload of a model that is already resident. With
+several endpoints, the model is loaded on the endpoint requests for it
+would be routed to.
+"""
+
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+
+import requests
+
+
+class ResidencyManager:
+    """Keeps the active model loaded in Ollama"""
+
+    def __init__(self, client, config: Dict[str, Any], logger: Optional[logging.Logger] = None):
+        self.client = client
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self._warmup_thread: Optional[threading.Thread] = None
+
+    @property
+    def keep_alive(self) -> Optional[Any]:
+        """The keep_alive value sent with every request, if configured"""
+        return self.config.get("keep_alive") or None
+
+    def loaded_models(self, endpoint=None) -> Optional[List[str]]:
+        """Get the models currently loaded in Ollama
+
+        Args:
+            endpoint: Endpoint to query (defaults to the primary endpoint)
+
+        Returns:
+            List of model names, or None if /api/ps couldn't be queried
+        """
+        try:
+            response = self.client.transport.get(self.client.api_url("/api/ps", endpoint))
+            if response.status_code != 200:
+                self.logger.debug(f"Error fetching loaded models: HTTP {response.status_code}")
+                return None
+            return [model.get("name", model.get("model")) for model in response.json().get("models", [])]
+        except (requests.RequestException, ValueError) as e:
+            self.logger.debug(f"Error fetching loaded models: {e}")
+            return None
+
+    def is_resident(self, model: str, endpoint=None) -> bool:
+        """Check whether a model is currently loaded"""
+        loaded = self.loaded_models(endpoint)
+        return bool(loaded) and model in loaded
+
+    def warm_up(self, model: str, background: bool = True):
+        """Load a model with a zero-length generation unless it's already resident
+
+        Args:
+            model: The model to load
+            background: Run the warm-up on a background thread
+        """
+        if not self.config.get("warm_up_model", True):
+            return
+
+        if background:
+            self._warmup_thread = threading.Thread(
+                target=self._warm_up,
+                args=(model,),
+                name="ollamacode-warmup",
+                daemon=True
+            )
+            self._warmup_thread.start()
+        else:
+            self._warm_up(model)
+
+    def wait(self, timeout: Optional[float] = None):
+        """Wait for a background warm-up to finish"""
+        if self._warmup_thread:
+            self._warmup_thread.join(timeout)
+
+    def _warm_up(self, model: str):
+        endpoints = self.client.endpoints
+        endpoint = endpoints.select(model)
+
+        # A resident model is left alone: a warm-up with different settings
+        # could make Ollama reload the very model we are about to use
+        if self.is_resident(model, endpoint):
+            self.logger.info(f"Model {model} is already loaded on {endpoint.url}, skipping warm-up")
+            endpoints.mark_loaded(endpoint, model)
+            return
+
+        # Load with the options the first request will use, so it doesn't
+        # reload the model with a different num_ctx
+        payload = {"model": model, "prompt": "", "stream": False,
+                   "options": self.client.request_options(model)}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+
+        try:
+            self.logger.info(f"Warming up model {model} on {endpoint.url}")
+            response = self.client.transport.post(self.client.api_url("/api/generate", endpoint), json=payload)
+            if response.status_code == 200:
+                load_ms = response.json().get("load_duration", 0) / 1e6
+                endpoints.mark_loaded(endpoint, model)
+                self.logger.info(f"Model {model} loaded in {load_ms:.0f}ms")
+            else:
+                self.logger.warning(f"Warm-up of model {model} failed: HTTP {response.status_code}")
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning(f"Warm-up of model {model} failed: {e}")
+
+    def unload(self, model: str):
+        """Ask every endpoint to unload a model right away"""
+        for endpoint in self.client.endpoints.endpoints:
+            try:
+                self.client.transport.post(
+                    self.client.api_url("/api/generate", endpoint),
+                    json={"model": model, "keep_alive": 0, "stream": False}
+                )
+                endpoint.loaded_models.discard(model)
+                self.logger.info(f"Unloaded model {model} on {endpoint.url}")
+            except requests.RequestException as e:
+                self.logger.warning(f"Unloading model {model} on {endpoint.url} failed: {e}")
+
+    def switch(self, previous_model: Optional[str], new_model: str):
+        """Make a newly selected model resident, optionally freeing the previous one"""
+        unload_previous = (previous_model and previous_model != new_model and
+                           self.config.get("unload_previous_model", False))
+        warm_up = self.config.get("warm_up_model", True)
+
+        def _switch():
+            if unload_previous:
+                self.unload(previous_model)
+            if warm_up:
+                self._warm_up(new_model)
+
+        if not unload_previous and not warm_up:
+            return
+        self._warmup_thread = threading.Thread(target=_switch, name="ollamacode-warmup", daemon=True)
+        self._warmup_thread.start()
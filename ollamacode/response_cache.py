@@ -0,0 +1,148 @@
+"""
+Persistent response cache for deterministic chat requests.
+
+Temperature-0 requests with the same model, options and messages produce
+the same reply, so their streamed chunks are stored in SQLite and replayed
+instead of being regenerated. The store is bounded in size and evicts the
+least recently used entries first.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+from typing import Dict, Any, Iterator, List, Optional
+
+from .telemetry import RequestStats
+
+
+class CachedStream:
+    """Replays stored chunks in place of a live /api/chat stream"""
+
+    endpoint = None
+
+    def __init__(self, chunks: List[Dict[str, Any]], stats: RequestStats):
+        self._chunks = chunks
+        self.stats = stats
+
+    def chunks(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._chunks)
+
+    def close(self):
+        pass
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of chat replies stored in SQLite"""
+
+    # Request fields that affect the generated reply
+    KEY_FIELDS = ["model", "messages", "temperature", "max_tokens", "options", "format", "tools"]
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024,
+                 logger: Optional[logging.Logger] = None):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " chunks TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._db.commit()
+
+    @staticmethod
+    def applies(data: Dict[str, Any]) -> bool:
+        """Check whether a request is deterministic enough to cache"""
+        temperature = data.get("options", {}).get("temperature", data.get("temperature"))
+        return temperature is not None and float(temperature) == 0.0
+
+    @classmethod
+    def key(cls, data: Dict[str, Any]) -> str:
+        """Hash the fields of a request that determine its reply"""
+        relevant = {field: data[field] for field in cls.KEY_FIELDS if field in data}
+        if "options" in relevant:
+            # num_ctx is sized from the conversation and only ever grows, so
+            # it varies between otherwise identical requests
+            relevant["options"] = {k: v for k, v in relevant["options"].items() if k != "num_ctx"}
+        encoded = json.dumps(relevant, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Get the stored chunks for a request, marking the entry as recently used"""
+        with self._lock:
+            row = self._db.execute("SELECT chunks FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                (time.time(), key)
+            )
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, chunks: List[Dict[str, Any]]):
+        """Store the chunks of a reply and evict old entries over the size limit"""
+        # Only the parts of each chunk that are replayed are kept
+        stored = []
+        for chunk in chunks:
+            if chunk.get("done"):
+                stored.append({k: v for k, v in chunk.items() if k not in ("model", "created_at", "message")})
+            elif chunk.get("message", {}).get("content"):
+                stored.append({"message": {"role": "assistant", "content": chunk["message"]["content"]}})
+        encoded = json.dumps(stored, separators=(",", ":"))
+        now = time.time()
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, chunks, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, encoded, len(encoded), now, now)
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self.logger.info(f"Evicted {evicted} entries from the response cache")
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of entries and bytes stored"""
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"entries": entries, "bytes": size}
+
+    def clear(self):
+        """Remove every stored reply"""
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
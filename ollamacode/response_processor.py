@@ -5,47 +5,55 @@ Response processing for OllamaCode - extracted from client.py to reduce complexi
 import re
 import json
 import os
+import sys
 import logging
 from typing import Dict, Any, List, Tuple, Optional
 
-from .utils import Colors, extract_bash_commands, extract_tool_calls, extract_code_blocks, generate_filename
+from .utils import Colors, extract_code_blocks, generate_filename
 from .bash import BashExecutor
 from .tools import ToolsFramework
+from .blockstore import BlockStore
+from .scheduler import DependencyExecutor, LiveOutput, is_read_only_command, is_read_only_tool
+from .streaming import FenceDetector
 
 
 class ResponseProcessor:
     """Processes LLM responses including command execution and followup generation"""
     
-    def __init__(self, config: Dict[str, Any], bash: BashExecutor, tools: ToolsFramework, logger: Optional[logging.Logger] = None):
+    def __init__(self, config: Dict[str, Any], bash: BashExecutor, tools: ToolsFramework, logger: Optional[logging.Logger] = None,
+                 blocks: Optional[BlockStore] = None):
         self.config = config
         self.bash = bash
         self.tools = tools
         self.logger = logger or logging.getLogger(__name__)
         
+        # Sends repeated tool outputs as references or diffs
+        self.blocks = blocks
+        
+        # Read-only blocks run up to this many at a time
+        self.max_workers = max(1, int(config.get("max_parallel_tools", 4)))
+        
         # Result tracking
         self.last_bash_result = None
         self.last_tool_result = None
     
-    def process_response(self, response_text: str) -> Tuple[str, List[Dict[str, Any]]]:
+    def process_response(self, response_text: str, pipeline=None) -> Tuple[str, List[Dict[str, Any]]]:
         """Process a response including bash commands, tools, and code extraction
         
         Args:
             response_text: The raw response text from the LLM
+            pipeline: Optional PipelinedExecutor that already started running
+                blocks while the response was streaming
             
         Returns:
             Tuple of (processed_text, process_results)
         """
         processed_results = []
         
-        # Process bash commands
-        if self.config.get("enable_bash", True):
-            bash_results = self._process_bash_commands(response_text)
-            processed_results.extend(bash_results)
-        
-        # Process tool calls
-        if self.config.get("enable_tools", True):
-            tool_results = self._process_tool_calls(response_text)
-            processed_results.extend(tool_results)
+        # Process bash commands and tool calls
+        blocks = self._extract_blocks(response_text)
+        if blocks:
+            processed_results.extend(self._process_blocks(blocks, pipeline))
         
         # Process code blocks
         if self.config.get("auto_extract_code", False):
@@ -54,71 +62,158 @@ class ResponseProcessor:
         
         return response_text, processed_results
     
-    def _process_bash_commands(self, response_text: str) -> List[Dict[str, Any]]:
-        """Process bash commands in the response"""
-        results = []
-        bash_commands = extract_bash_commands(response_text)
+    def run_bash_command(self, command: str, on_output=None) -> Dict[str, Any]:
+        """Execute a single bash command, printing nothing unless on_output does"""
+        self.logger.info(f"Executing bash command: {command}")
+        return self.bash.execute_command(command, on_output=on_output)
+    
+    @staticmethod
+    def _print_output(stream: str, text: str):
+        """Print command output as it arrives"""
+        if stream == "stderr":
+            text = f"{Colors.RED}{text}{Colors.ENDC}"
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    
+    def run_tool_call(self, tool_call: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Execute a single tool call without printing its result
         
-        for command in bash_commands:
-            print(f"\n{Colors.YELLOW}Executing bash command:{Colors.ENDC} {command}")
-            self.logger.info(f"Executing bash command: {command}")
-            
-            result = self.bash.execute_command(command)
-            self.last_bash_result = result
-            
-            if result["status"] == "success":
-                print(f"{Colors.GREEN}Command executed successfully{Colors.ENDC}")
-                if result.get("stdout"):
-                    print(f"\n{Colors.CYAN}Output:{Colors.ENDC}\n{result['stdout']}")
-            else:
-                print(f"{Colors.RED}Command execution failed:{Colors.ENDC} {result.get('error', 'Unknown error')}")
-                if result.get("stderr"):
-                    print(f"\n{Colors.RED}Error output:{Colors.ENDC}\n{result['stderr']}")
-            
-            results.append({
-                "type": "bash",
-                "command": command,
-                "result": result
-            })
+        Returns:
+            Tuple of (params_used, result)
+        """
+        tool_name = tool_call["tool"]
+        params = dict(tool_call["params"])
+        self.logger.info(f"Executing tool: {tool_name} with params: {json.dumps(params)}")
         
-        return results
+        # Special handling for python_run tool with code parameter
+        if tool_name == "python_run" and "code" in params:
+            params["code"] = self._preprocess_python_code(params["code"])
+        
+        return params, self.tools.execute_tool(tool_name, params)
     
-    def _process_tool_calls(self, response_text: str) -> List[Dict[str, Any]]:
-        """Process tool calls in the response"""
-        results = []
-        tool_calls = extract_tool_calls(response_text)
+    def is_read_only(self, kind: str, payload: Any) -> bool:
+        """Check whether a bash command or tool call can run in parallel with other read-only blocks"""
+        if kind == "bash":
+            return is_read_only_command(payload)
+        return is_read_only_tool(payload["tool"])
+    
+    def _extract_blocks(self, response_text: str) -> List[Tuple[str, int, Any]]:
+        """Find the bash commands and tool calls in a response, in the order they appear
         
-        for tool_call in tool_calls:
-            tool_name = tool_call["tool"]
-            params = tool_call["params"]
-            
-            print(f"\n{Colors.YELLOW}Executing tool:{Colors.ENDC} {tool_name}")
-            print(f"Parameters: {json.dumps(params, indent=2)}")
-            self.logger.info(f"Executing tool: {tool_name} with params: {json.dumps(params)}")
-            
-            # Special handling for python_run tool with code parameter
-            if tool_name == "python_run" and "code" in params:
-                params["code"] = self._preprocess_python_code(params["code"])
-            
-            result = self.tools.execute_tool(tool_name, params)
-            self.last_tool_result = result
-            
-            if result["status"] == "success":
-                print(f"{Colors.GREEN}Tool executed successfully{Colors.ENDC}")
-                self._display_tool_result_preview(result)
-            else:
-                print(f"{Colors.RED}Tool execution failed:{Colors.ENDC} {result.get('error', 'Unknown error')}")
-                self.logger.error(f"Tool execution failed: {result.get('error', 'Unknown error')}")
-            
-            results.append({
-                "type": "tool",
-                "tool": tool_name,
-                "params": params,
-                "result": result
-            })
+        Returns:
+            List of (kind, index among blocks of that kind, payload)
+        """
+        detector = FenceDetector(self.config.get("enable_bash", True), self.config.get("enable_tools", True))
+        counts = {"bash": 0, "tool": 0}
+        blocks = []
+        for kind, payload, _ in detector.feed(response_text):
+            blocks.append((kind, counts[kind], payload))
+            counts[kind] += 1
+        return blocks
+    
+    def _run_block(self, kind: str, payload: Any, on_output=None) -> Any:
+        if kind == "bash":
+            return self.run_bash_command(payload, on_output=on_output)
+        return self.run_tool_call(payload)
+    
+    def _process_blocks(self, blocks: List[Tuple[str, int, Any]], pipeline=None) -> List[Dict[str, Any]]:
+        """Run bash commands and tool calls, keeping the results in response order
+        
+        Consecutive read-only blocks run in parallel. Any other block runs on
+        its own once everything before it has finished. Bash output is shown
+        live, one command at a time in response order.
+        """
+        results = []
+        executor = DependencyExecutor(self.max_workers, self.logger) if self.max_workers > 1 else None
+        started: Dict[int, Any] = {}
+        try:
+            for position, (kind, index, payload) in enumerate(blocks):
+                if kind == "bash":
+                    print(f"\n{Colors.YELLOW}Executing bash command:{Colors.ENDC} {payload}")
+                else:
+                    print(f"\n{Colors.YELLOW}Executing tool:{Colors.ENDC} {payload['tool']}")
+                    print(f"Parameters: {json.dumps(payload['params'], indent=2)}")
+                
+                outcome = pipeline.take(kind, index, payload, on_output=self._print_output) if pipeline else None
+                streamed = outcome is not None and kind == "bash"
+                if outcome is None:
+                    if executor and position not in started:
+                        # Start this block together with the read-only blocks right after it
+                        batch = []
+                        for ahead in range(position, len(blocks)):
+                            ahead_kind, ahead_index, ahead_payload = blocks[ahead]
+                            if (not self.is_read_only(ahead_kind, ahead_payload)
+                                    or (pipeline and pipeline.started(ahead_kind, ahead_index))):
+                                break
+                            batch.append(ahead)
+                        if len(batch) > 1:
+                            self.logger.info(f"Running {len(batch)} read-only blocks in parallel")
+                            for ahead in batch:
+                                ahead_kind, _, ahead_payload = blocks[ahead]
+                                live = LiveOutput() if ahead_kind == "bash" else None
+                                future = executor.submit(self._run_block, ahead_kind, ahead_payload,
+                                                         live.put if live else None, read_only=True)
+                                started[ahead] = (future, live)
+                    if position in started:
+                        future, live = started.pop(position)
+                        streamed = live is not None
+                        outcome = live.follow(future, self._print_output) if live else future.result()
+                    else:
+                        # Commands that run on their own show their output live
+                        streamed = kind == "bash"
+                        outcome = self._run_block(kind, payload, on_output=self._print_output if streamed else None)
+                
+                if kind == "bash":
+                    results.append(self._report_bash_result(payload, outcome, streamed))
+                else:
+                    results.append(self._report_tool_result(payload, outcome))
+        finally:
+            if executor:
+                executor.shutdown()
         
         return results
     
+    def _report_bash_result(self, command: str, result: Dict[str, Any], streamed: bool) -> Dict[str, Any]:
+        """Print the outcome of a bash command"""
+        self.last_bash_result = result
+        
+        if result["status"] == "success":
+            print(f"{Colors.GREEN}Command executed successfully{Colors.ENDC}")
+            if result.get("stdout") and not streamed:
+                print(f"\n{Colors.CYAN}Output:{Colors.ENDC}\n{result['stdout']}")
+        else:
+            print(f"{Colors.RED}Command execution failed:{Colors.ENDC} {result.get('error', 'Unknown error')}")
+            if result.get("stderr") and not streamed:
+                print(f"\n{Colors.RED}Error output:{Colors.ENDC}\n{result['stderr']}")
+        
+        return {
+            "type": "bash",
+            "command": command,
+            "result": result
+        }
+    
+    def _report_tool_result(self, tool_call: Dict[str, Any], outcome: Tuple[Dict[str, Any], Dict[str, Any]]) -> Dict[str, Any]:
+        """Print the outcome of a tool call"""
+        params, result = outcome
+        self.last_tool_result = result
+        
+        if tool_call["tool"] == "python_run" and params.get("code") != tool_call["params"].get("code"):
+            print(f"{Colors.YELLOW}Fixed potential syntax issues in Python code{Colors.ENDC}")
+        
+        if result["status"] == "success":
+            print(f"{Colors.GREEN}Tool executed successfully{Colors.ENDC}")
+            self._display_tool_result_preview(result)
+        else:
+            print(f"{Colors.RED}Tool execution failed:{Colors.ENDC} {result.get('error', 'Unknown error')}")
+            self.logger.error(f"Tool execution failed: {result.get('error', 'Unknown error')}")
+        
+        return {
+            "type": "tool",
+            "tool": tool_call["tool"],
+            "params": params,
+            "result": result
+        }
+    
     def _preprocess_python_code(self, code: str) -> str:
         """Preprocess Python code to fix common LLM generation issues"""
         # Fix common syntax issues that models might introduce
@@ -127,9 +222,9 @@ class ResponseProcessor:
         fixed_code = re.sub(r'for \* in', 'for _ in', fixed_code)  # Fix asterisk in for loop
         fixed_code = re.sub(r'([a-zA-Z0-9_]+)\*([a-zA-Z0-9_]+)', r'\1_\2', fixed_code)  # Fix variable names with asterisks
         
-        # Check if code was modified
+        # Check if code was modified; the notice is printed with the tool's
+        # result, since this may run on a pipeline worker while the reply streams
         if fixed_code != code:
-            print(f"{Colors.YELLOW}Fixed potential syntax issues in Python code{Colors.ENDC}")
             self.logger.info("Fixed potential syntax issues in Python code")
         
         return fixed_code
@@ -256,6 +351,12 @@ class ResponseProcessor:
         followup += "Please continue based on these results. What would you like to do next?\n"
         return followup
     
+    def _output_block(self, source: str, content: str, language: str = "") -> str:
+        """Fence a tool output, or refer to / diff against an earlier copy of it"""
+        if self.blocks:
+            return self.blocks.render(source, content, language)
+        return f"```{language}\n{content}\n```\n"
+    
     def _format_bash_result(self, result: Dict[str, Any]) -> str:
         """Format a bash command result"""
         cmd_result = result["result"]
@@ -264,7 +365,7 @@ class ResponseProcessor:
         if cmd_result["status"] == "success":
             output += "Command executed successfully.\n\n"
             if cmd_result.get("stdout"):
-                output += f"**Output:**\n```\n{cmd_result['stdout']}\n```\n\n"
+                output += f"**Output:**\n{self._output_block('bash:' + result['command'], cmd_result['stdout'])}\n"
             else:
                 output += "Command produced no output.\n\n"
         else:
@@ -294,6 +395,8 @@ class ResponseProcessor:
                 output += self._format_sys_info_result(tool_result)
             elif tool_name == "python_run":
                 output += self._format_python_run_result(tool_result)
+            elif tool_name == "output_read":
+                output += self._format_output_read_result(tool_result)
             else:
                 # Generic formatting for other tools
                 output += self._format_generic_tool_result(tool_result)
@@ -318,7 +421,9 @@ class ResponseProcessor:
         }
         language = ext_to_lang.get(extension.lower(), "")
         
-        return f"**File content ({result.get('path')}):**\n```{language}\n{result['content']}\n```\n\n"
+        # Relative paths are relative to the tools' working directory, not ours
+        source = "file:" + os.path.realpath(os.path.join(self.tools.working_dir, file_path))
+        return f"**File content ({result.get('path')}):**\n{self._output_block(source, result['content'], language)}\n"
     
     def _format_file_list_result(self, result: Dict[str, Any]) -> str:
         """Format a file_list tool result"""
@@ -383,7 +488,8 @@ class ResponseProcessor:
             output += "Execution successful.\n\n"
             
             if result.get("stdout"):
-                output += f"**Output:**\n```\n{result['stdout']}\n```\n\n"
+                source = "python:" + str(result.get("script_path"))
+                output += f"**Output:**\n{self._output_block(source, result['stdout'])}\n"
             else:
                 output += "Script executed without producing any output.\n\n"
         else:
@@ -414,6 +520,23 @@ class ResponseProcessor:
         
         return output
     
+    def _format_output_read_result(self, result: Dict[str, Any]) -> str:
+        """Format an output_read tool result"""
+        first = result.get("first_line", 1)
+        if result.get("grep"):
+            output = f"**Lines of {result.get('handle')} matching `{result['grep']}`, from line {first}:**\n"
+        else:
+            output = f"**{result.get('handle')}, lines {first}-{first + result.get('lines', 0) - 1}:**\n"
+        
+        if result.get("content"):
+            output += f"```\n{result['content']}\n```\n"
+        else:
+            output += "No lines found.\n"
+        
+        if result.get("more"):
+            output += f"More lines follow; continue with offset {result.get('next_offset')}.\n"
+        return output + "\n"
+    
     def _format_generic_tool_result(self, result: Dict[str, Any]) -> str:
         """Format a generic tool result"""
         result_copy = result.copy()
@@ -0,0 +1,289 @@
+"""
+Embedding-based retrieval of pruned conversation turns for OllamaCode.
+
+Messages pruned or compacted out of the history are split into chunks and
+embedded with Ollama's /api/embed endpoint. The normalized vectors are kept
+in one NumPy array, so a search is a single matrix-vector product. Before
+each request the latest user message is embedded and the most similar old
+chunks that fit a token budget are put back into the prompt, just before
+that message. Embeddings are cached on disk by content hash, so archiving
+a chunk that was seen before costs no embedding call.
+"""
+
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from .transport import OllamaAPIError
+
+# Longest chunk a message is split into, in characters
+CHUNK_CHARS = 2000
+
+# Seconds to wait before embedding again after /api/embed failed
+RETRY_DELAY = 60
+
+RETRIEVED_HEADER = "Relevant parts of the earlier conversation that are no longer in the context:\n\n"
+
+
+def split_chunks(text: str, size: int = CHUNK_CHARS) -> List[str]:
+    """Split a text into chunks of at most size characters on paragraph boundaries"""
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:size])
+            paragraph = paragraph[size:]
+        if current and len(current) + len(paragraph) + 2 > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+class EmbeddingCache:
+    """On-disk cache of embedding vectors keyed by a hash of model and text"""
+
+    def __init__(self, path: str, logger: Optional[logging.Logger] = None):
+        self.path = os.path.expanduser(path)
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Get the cached vectors for a list of keys"""
+        found = {}
+        with self._lock:
+            # SQLite limits the number of parameters per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.astype(np.float32).tobytes()) for key, vector in items]
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RetrievalIndex:
+    """Vector index of turns that were pruned from the conversation
+
+    Configuration:
+        retrieval_embed_model: Ollama embedding model
+        retrieval_dimensions: Length the vectors are truncated to (0 keeps them whole)
+        retrieval_top_k: Most chunks to retrieve per request
+        retrieval_budget: Most tokens of retrieved chunks per request
+        retrieval_min_score: Lowest cosine similarity a chunk needs to be retrieved
+        retrieval_batch_size: Texts per /api/embed call
+        retrieval_cache_path: SQLite file of cached embeddings
+    """
+
+    def __init__(self, client, config: Dict[str, Any], logger: Optional[logging.Logger] = None):
+        self.client = client
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self.model = config.get("retrieval_embed_model", "nomic-embed-text")
+        self.dimensions = int(config.get("retrieval_dimensions", 256))
+        self.top_k = int(config.get("retrieval_top_k", 4))
+        self.budget = int(config.get("retrieval_budget", 1024))
+        self.min_score = float(config.get("retrieval_min_score", 0.5))
+        self.batch_size = int(config.get("retrieval_batch_size", 64))
+        self.cache = EmbeddingCache(
+            config.get("retrieval_cache_path", "~/.config/ollamacode/embeddings.db"), self.logger
+        )
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # Rows are unit vectors; grown by doubling
+        self._chunks: List[Tuple[str, str, float]] = []  # (role, text, created) per row
+        self._pending: List[Tuple[str, str, float]] = []
+        self._retry_at = 0.0
+
+        self.retrieved = 0
+        self.last_search_ms: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def archive(self, message):
+        """Queue a message that left the conversation; it's embedded before the next search"""
+        if message.role == "system":
+            return
+        with self._lock:
+            for chunk in split_chunks(message.content):
+                self._pending.append((message.role, chunk, message.created))
+
+    def reset(self):
+        """Forget every archived chunk, e.g. when the conversation is cleared"""
+        with self._lock:
+            self._vectors = None
+            self._chunks = []
+            self._pending = []
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Get normalized embeddings for texts, from the cache where possible
+
+        Raises:
+            OllamaAPIError: If Ollama responds with an error status
+            requests.RequestException: If Ollama can't be reached
+        """
+        keys = [hashlib.sha256(f"{self.model}:{self.dimensions}\0{text}".encode("utf-8", "surrogatepass")).hexdigest()
+                for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [index for index, key in enumerate(keys) if key not in vectors]
+
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            embedded = self._request([texts[index] for index in batch])
+            new = []
+            for index, vector in zip(batch, embedded):
+                vector = np.asarray(vector, dtype=np.float32)
+                if self.dimensions:
+                    vector = vector[:self.dimensions]
+                vector /= max(float(np.linalg.norm(vector)), 1e-12)
+                vectors[keys[index]] = vector
+                new.append((keys[index], vector))
+            self.cache.put_many(new)
+
+        return np.stack([vectors[key] for key in keys])
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        data = {"model": self.model, "input": texts}
+        if self.dimensions:
+            data["dimensions"] = self.dimensions
+        endpoints = self.client.endpoints
+        endpoint = endpoints.select(self.model)
+        with endpoints.lease(endpoint):
+            response = self.client.transport.post(self.client.api_url("/api/embed", endpoint), json=data)
+        if response.status_code != 200:
+            raise OllamaAPIError(f"/api/embed returned HTTP {response.status_code}: {response.text[:200]}")
+        embeddings = response.json().get("embeddings", [])
+        if len(embeddings) != len(texts):
+            raise OllamaAPIError(f"/api/embed returned {len(embeddings)} embeddings for {len(texts)} texts")
+        return embeddings
+
+    def _add(self, vectors: np.ndarray, chunks: List[Tuple[str, str, float]]):
+        count = len(self._chunks)
+        if self._vectors is None:
+            self._vectors = np.empty((max(1024, len(chunks)), vectors.shape[1]), dtype=np.float32)
+        elif vectors.shape[1] != self._vectors.shape[1]:
+            raise ValueError(f"Embedding size changed from {self._vectors.shape[1]} to {vectors.shape[1]}")
+        if count + len(chunks) > len(self._vectors):
+            grown = np.empty((max(2 * len(self._vectors), count + len(chunks)), self._vectors.shape[1]),
+                             dtype=np.float32)
+            grown[:count] = self._vectors[:count]
+            self._vectors = grown
+        self._vectors[count:count + len(chunks)] = vectors
+        self._chunks.extend(chunks)
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        """Find the k indexed chunks most similar to a normalized query vector
+
+        Returns:
+            (score, row) pairs, best first
+        """
+        count = len(self._chunks)
+        if not count:
+            return []
+        scores = self._vectors[:count] @ query
+        if count > k:
+            rows = np.argpartition(scores, -k)[-k:]
+        else:
+            rows = np.arange(count)
+        rows = rows[np.argsort(-scores[rows])]
+        return [(float(scores[row]), int(row)) for row in rows]
+
+    def augment(self, messages: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], int]:
+        """Put the old chunks most relevant to the latest user message back into a prompt
+
+        The chunks go into one message right before the latest user message,
+        so the start of the prompt stays the same as in the previous request.
+
+        Returns:
+            Tuple of (messages, tokens added)
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending and not self._chunks:
+            return messages, 0
+
+        last_user = next((index for index in range(len(messages) - 1, -1, -1)
+                          if messages[index]["role"] == "user"), None)
+        if last_user is None or time.monotonic() < self._retry_at:
+            with self._lock:
+                self._pending = pending + self._pending
+            return messages, 0
+
+        # The new chunks and the query share one batch of embedding calls
+        query_text = messages[last_user]["content"][-CHUNK_CHARS:]
+        try:
+            vectors = self.embed([text for _, text, _ in pending] + [query_text])
+            if pending:
+                self._add(vectors[:-1], pending)
+        except (requests.RequestException, OllamaAPIError, ValueError) as e:
+            self.logger.warning(f"Embedding for retrieval failed, retrying in {RETRY_DELAY}s: {e}")
+            self._retry_at = time.monotonic() + RETRY_DELAY
+            with self._lock:
+                self._pending = pending + self._pending
+            return messages, 0
+
+        start = time.perf_counter()
+        hits = self.search(vectors[-1], self.top_k)
+        self.last_search_ms = (time.perf_counter() - start) * 1000
+
+        selected = []
+        tokens = 0
+        for score, row in hits:
+            if score < self.min_score:
+                break
+            chunk_tokens = self.client.estimate_tokens(self._chunks[row][1])
+            if tokens + chunk_tokens > self.budget:
+                continue
+            selected.append(row)
+            tokens += chunk_tokens
+        if not selected:
+            return messages, 0
+
+        parts = []
+        for row in sorted(selected, key=lambda row: self._chunks[row][2]):
+            role, text, created = self._chunks[row]
+            parts.append(f"[{role}, {datetime.fromtimestamp(created).strftime('%H:%M')}]\n{text}")
+        content = RETRIEVED_HEADER + "\n\n".join(parts)
+
+        self.retrieved += len(selected)
+        self.logger.info(f"Retrieved {len(selected)} old chunks (~{tokens} tokens, "
+                         f"search {self.last_search_ms:.2f} ms over {len(self._chunks)} chunks)")
+        augmented = messages[:last_user] + [{"role": "user", "content": content}] + messages[last_user:]
+        return augmented, self.client.estimate_tokens(content)
+
+    def close(self):
+        self.cache.close()
@@ -16,6 +16,7 @@ class DiceRollTool(ToolPlugin):
     
     name = "dice_roll"
     description = "Simulate rolling dice with different sides and counts"
+    read_only = True
     
     @classmethod
     @property
@@ -69,6 +70,7 @@ class TextAnalysisTool(ToolPlugin):
     
     name = "text_analyze"
     description = "Analyze text for statistics like word count, character count, etc."
+    read_only = True
     
     @classmethod
     @property
@@ -0,0 +1,202 @@
+"""
+Dependency-aware execution of bash and tool blocks for OllamaCode.
+
+Blocks that only read (file_read, ls, git status, ...) don't depend on each
+other, so they run in parallel on a bounded thread pool. A block that may
+have side effects acts as a barrier: it waits for every block before it, and
+every block after it waits for it, so each block sees the same state as if
+the blocks had run one at a time in the order of the response.
+
+Output of bash commands running in the background is queued in a
+LiveOutput, and shown by the main thread once it gets to the command, so
+output of parallel commands never interleaves.
+
+Bash commands are classified conservatively: a command is read-only only if
+every command in it is a known read-only program, and it has no
+redirections, substitutions, background jobs or variable assignments.
+"""
+
+import re
+import queue
+import shlex
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future, wait as wait_for
+from typing import Any, Callable, List, Optional
+
+from .tool_plugins import tool_registry
+
+# Built-in tools that don't change anything
+READ_ONLY_TOOLS = frozenset({"file_read", "file_list", "web_get", "sys_info", "output_read"})
+
+# Programs that only read, as long as their output isn't redirected
+READ_ONLY_COMMANDS = frozenset({
+    "ls", "cat", "head", "tail", "grep", "egrep", "fgrep", "rg", "find", "wc", "pwd", "stat", "file",
+    "du", "df", "which", "whoami", "uname", "echo", "tree", "sort", "cut", "diff", "cmp",
+    "md5sum", "sha1sum", "sha256sum", "basename", "dirname", "realpath", "readlink", "true", "test",
+    "nproc", "free", "uptime", "id",
+})
+# Left out because some of their forms write: uniq (uniq IN OUT), date (-s),
+# hostname (hostname NAME) and printf (-v VAR)
+
+# git subcommands that only read the repository
+READ_ONLY_GIT = frozenset({"status", "log", "diff", "show", "ls-files", "rev-parse", "blame", "describe"})
+
+# Options that make an otherwise read-only program write or run something
+WRITING_OPTIONS = {
+    "find": {"-delete", "-exec", "-execdir", "-ok", "-okdir", "-fprint", "-fprint0", "-fprintf", "-fls"},
+    "sort": {"-o", "--output", "--compress-program"},
+    "tree": {"-o"},
+    "rg": {"--pre"},
+    "file": {"-C", "--compile"},
+    "git": {"--output", "--ext-diff", "--textconv"},
+}
+
+# Programs that take any unambiguous prefix of a long option (getopt_long)
+ABBREVIATED_OPTIONS = frozenset({"sort", "file"})
+
+# Characters of background output held until the main thread shows them;
+# more is left out of the live view (the result still has it)
+MAX_PENDING_OUTPUT = 1000000
+
+# Redirections, substitutions, background jobs and subshells
+SHELL_SIDE_EFFECTS = re.compile(r"[<>`()]|\$\(|(?<![&|])&(?!&)")
+COMMAND_SEPARATORS = re.compile(r"&&|\|\||[;|\n]")
+
+
+def is_read_only_command(command: str) -> bool:
+    """Check whether a bash command can't have side effects"""
+    if not command.strip() or SHELL_SIDE_EFFECTS.search(command):
+        return False
+    for segment in COMMAND_SEPARATORS.split(command):
+        try:
+            words = shlex.split(segment)
+        except ValueError:
+            return False
+        if not words:
+            continue
+        program = words[0]
+        if program == "git":
+            if len(words) < 2 or words[1] not in READ_ONLY_GIT:
+                return False
+        elif program not in READ_ONLY_COMMANDS:
+            # Includes cd, export and VAR=value, which change the shell's state
+            return False
+        writing = WRITING_OPTIONS.get(program)
+        if writing and any(_is_writing_option(word, writing, program in ABBREVIATED_OPTIONS)
+                           for word in words[1:]):
+            return False
+    return True
+
+
+def _is_writing_option(word: str, writing, abbreviated: bool = False) -> bool:
+    """Check whether a word is one of the writing options, also as --option=value, --opt or in -abc"""
+    name = word.split("=", 1)[0]
+    if word in writing or name in writing:
+        return True
+    # Abbreviated long options (--compress=gzip for --compress-program)
+    if abbreviated and name.startswith("--") and len(name) > 2:
+        return any(option.startswith(name) for option in writing)
+    # Short options can be combined, or take their value attached (-ofile)
+    if word.startswith("-") and not word.startswith("--"):
+        return any(len(option) == 2 and option[1] in word[1:] for option in writing)
+    return False
+
+
+def is_read_only_tool(tool_name: str) -> bool:
+    """Check whether a tool can't have side effects"""
+    plugin = tool_registry.get_tool(tool_name)
+    if plugin:
+        return getattr(plugin, "read_only", False)
+    return tool_name in READ_ONLY_TOOLS
+
+
+class DependencyExecutor:
+    """Runs tasks on a bounded thread pool, keeping tasks with side effects in order
+
+    Args:
+        max_workers: Most tasks run at once; 1 runs everything in order
+    """
+
+    def __init__(self, max_workers: int = 4, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ollamacode-exec")
+        self._lock = threading.Lock()
+        self._barrier: Optional[Future] = None  # The last task with side effects
+        self._readers: List[Future] = []  # Read-only tasks submitted since then
+
+    def submit(self, fn: Callable, *args, read_only: bool = False, **kwargs) -> Future:
+        """Start a task once the tasks it depends on have finished
+
+        A read-only task depends on the last task with side effects; any
+        other task depends on everything submitted before it.
+        """
+        with self._lock:
+            depends = [self._barrier] if self._barrier else []
+            if not read_only:
+                depends += self._readers
+            # The pool starts tasks in submission order, so every dependency
+            # is already running by the time a task waits for it
+            future = self._pool.submit(self._run, depends, fn, args, kwargs)
+            if read_only:
+                self._readers.append(future)
+            else:
+                self._barrier = future
+                self._readers = []
+        return future
+
+    @staticmethod
+    def _run(depends: List[Future], fn: Callable, args, kwargs) -> Any:
+        if depends:
+            wait_for(depends)
+        return fn(*args, **kwargs)
+
+    def shutdown(self, wait: bool = False):
+        """Stop the pool, cancelling tasks that haven't started yet"""
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+class LiveOutput:
+    """Output of a command running on a worker, shown live once the main thread follows it
+
+    put is the command's output callback; it only queues the output, so it
+    is safe to call from any thread.
+    """
+
+    def __init__(self):
+        self._chunks: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._skipped = 0
+
+    def put(self, stream: str, text: str):
+        with self._lock:
+            if self._skipped or self._pending + len(text) > MAX_PENDING_OUTPUT:
+                self._skipped += len(text)
+                return
+            self._pending += len(text)
+        self._chunks.put((stream, text))
+
+    def follow(self, future: Future, on_output: Callable[[str, str], None]) -> Any:
+        """Pass the output to on_output as it arrives until the command finishes
+
+        Returns:
+            The command's result
+        """
+        while True:
+            # Output is queued before the future completes, so once it's
+            # done an empty queue means everything has been shown
+            done = future.done()
+            try:
+                stream, text = self._chunks.get(block=not done, timeout=0.05)
+            except queue.Empty:
+                with self._lock:
+                    skipped, self._skipped = self._skipped, 0
+                if skipped:
+                    on_output("stdout", f"\n... [{skipped} characters not shown] ...\n")
+                if done:
+                    return future.result()
+                continue
+            with self._lock:
+                self._pending -= len(text)
+            on_output(stream, text)
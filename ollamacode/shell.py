@@ -0,0 +1,292 @@
+"""
+Persistent bash session for OllamaCode.
+
+A single long-lived bash process runs every command of a workspace, so
+`cd`, exported variables and activated virtualenvs carry over from one bash
+block to the next, and commands don't pay shell startup. Each command is
+passed through a quoted heredoc and eval'd, then followed by sentinel lines
+with a random token on stdout and stderr; the exit code rides on the stdout
+sentinel. A shell that exits (e.g. on `exit`) is restarted for the next
+command, and one that hangs past the timeout is killed and restarted.
+Resource limits are set on the shell and inherited by every command, so
+cpu_seconds and memory_mb apply to each process a command starts, and to the
+shell itself for builtins (a shell that hits them is restarted). Commands'
+CPU time is taken from the shell's own and its children's times in /proc,
+where available; their peak memory isn't known.
+"""
+
+import os
+import re
+import time
+import uuid
+import codecs
+import shutil
+import selectors
+import subprocess
+import threading
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from .capture import OutputCapture
+from .process import (ProcessResult, OutputCallback, READ_SIZE, TERMINATE_GRACE, popen_isolation,
+                      limited_command, kill_process_group)
+
+
+class ShellSession:
+    """A long-lived bash process that runs commands one at a time"""
+
+    def __init__(self, cwd: str, shell: Optional[str] = None, limits: Optional[Dict[str, Any]] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.cwd = cwd
+        self.shell = shell or shutil.which("bash") or "/bin/bash"
+        self.limits = limits
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+
+    @staticmethod
+    def available() -> bool:
+        """Check whether bash can be used for a persistent session"""
+        return os.name == "posix" and shutil.which("bash") is not None
+
+    def _start(self):
+        if self._process is not None:
+            self.restarts += 1
+            self.logger.info(f"Restarting shell session in {self.cwd}")
+            self._kill()
+            for pipe in (self._process.stdin, self._process.stdout, self._process.stderr):
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+        self._process = subprocess.Popen(
+            limited_command([self.shell, "--noprofile", "--norc"], False, self.limits),
+            cwd=self.cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # Own process group, so a hung command and its children can be
+            # killed along with the shell
+            **popen_isolation()
+        )
+
+    def run(self, command: str, timeout: Optional[float] = None, on_output: Optional[OutputCallback] = None,
+            max_output: Optional[int] = None, spill_dir: Optional[str] = None, label: str = "output") -> ProcessResult:
+        """Run a command in the session
+
+        Args:
+            command: The bash command
+            timeout: Seconds before the shell is killed and restarted
+            on_output: Called with ("stdout" or "stderr", text) as output arrives
+            max_output: Characters of each stream kept in memory (None keeps all)
+            spill_dir: Directory longer output is written to in full
+            label: Prefix of spill file names
+
+        Returns:
+            ProcessResult; returncode is None if the command timed out
+        """
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            start = time.monotonic()
+            token = uuid.uuid4().hex
+            marker = f"__OLLAMACODE_{token}__"
+
+            # The quoted heredoc passes the command through verbatim, and eval
+            # keeps a syntax error in it from desynchronizing the session.
+            # The command gets /dev/null as stdin so it can't read the script.
+            script = (
+                f"IFS= read -r -d '' __oc_cmd <<'{marker}'\n"
+                f"{command}\n"
+                f"{marker}\n"
+                f"eval \"$__oc_cmd\" </dev/null\n"
+                f"printf '\\n{marker} %d\\n' \"$?\"\n"
+                f"printf '\\n{marker}\\n' >&2\n"
+            )
+            try:
+                self._process.stdin.write(script.encode("utf-8", "surrogateescape"))
+                self._process.stdin.flush()
+            except (BrokenPipeError, OSError):
+                self._start()
+                self._process.stdin.write(script.encode("utf-8", "surrogateescape"))
+                self._process.stdin.flush()
+            times = _session_times(self._process.pid)
+
+            captures = {name: OutputCapture(max_output, spill_dir, f"{label}-{name}", self.logger)
+                        for name in ("stdout", "stderr")}
+            reader = _FramedReader(marker, on_output, captures)
+            try:
+                finished = self._read(reader, start + timeout if timeout else None)
+            except BaseException:
+                # Ctrl+C or a failing callback leaves the shell mid-command
+                self._kill()
+                reader.finish()
+                raise
+
+            if not finished:
+                self.logger.warning(f"Command timed out after {timeout} seconds, restarting the shell: {command}")
+                self._kill()
+                returncode = None
+            elif reader.returncode is None:
+                # The shell itself exited, e.g. on `exit`
+                returncode = self._process.wait()
+                self.logger.info(f"Shell session exited with code {returncode}")
+            else:
+                returncode = reader.returncode
+
+            stdout, stderr = reader.finish()
+            rusage = None
+            if finished and reader.returncode is not None and times:
+                after = _session_times(self._process.pid)
+                if after:
+                    rusage = {"user_time": round(after[0] - times[0], 3),
+                              "sys_time": round(after[1] - times[1], 3)}
+            return ProcessResult(
+                returncode=returncode,
+                stdout=stdout,
+                stderr=stderr,
+                timed_out=not finished,
+                duration=time.monotonic() - start,
+                rusage=rusage,
+                handles={name: capture.handle for name, capture in captures.items() if capture.handle}
+            )
+
+    def _read(self, reader: "_FramedReader", deadline: Optional[float]) -> bool:
+        """Read until both sentinels arrive or the shell exits
+
+        Returns:
+            False if the deadline passed first
+        """
+        selector = selectors.DefaultSelector()
+        streams = {self._process.stdout.fileno(): "stdout", self._process.stderr.fileno(): "stderr"}
+        for fd, name in streams.items():
+            selector.register(fd, selectors.EVENT_READ, name)
+        try:
+            while streams and not reader.done:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                events = selector.select(timeout)
+                if not events:
+                    return False
+                for key, _ in events:
+                    data = os.read(key.fd, READ_SIZE)
+                    if data:
+                        if reader.feed(key.data, data):
+                            selector.unregister(key.fd)
+                            del streams[key.fd]
+                    else:
+                        selector.unregister(key.fd)
+                        del streams[key.fd]
+            return True
+        finally:
+            selector.close()
+
+    def _kill(self):
+        process = self._process
+        if process is None or process.poll() is not None:
+            return
+        kill_process_group(process)
+
+    def close(self):
+        """Stop the shell"""
+        with self._lock:
+            if self._process is None:
+                return
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self._process.wait(TERMINATE_GRACE)
+            except subprocess.TimeoutExpired:
+                self._kill()
+            self._process.stdout.close()
+            self._process.stderr.close()
+            self._process = None
+
+
+def _session_times(pid: int) -> Optional[Tuple[float, float]]:
+    """Get the user and system CPU seconds of a shell and the children it has waited for
+
+    Returns:
+        None where /proc isn't available
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(b")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    # utime, stime, cutime and cstime are fields 14 to 17
+    user = (int(fields[11]) + int(fields[13])) / ticks
+    system = (int(fields[12]) + int(fields[14])) / ticks
+    return user, system
+
+
+class _FramedReader:
+    """Splits a command's output from the sentinels that end it
+
+    Output is passed on as it arrives, holding back just enough bytes that
+    a sentinel split across reads is never shown.
+    """
+
+    def __init__(self, marker: str, on_output: Optional[OutputCallback], captures: Dict[str, OutputCapture]):
+        self.sentinel = f"\n{marker}".encode()
+        self.exit_pattern = re.compile(re.escape(self.sentinel) + rb" (\d+)\n")
+        self.on_output = on_output
+        self.buffers: Dict[str, bytearray] = {"stdout": bytearray(), "stderr": bytearray()}
+        self.ended = {"stdout": False, "stderr": False}
+        self.decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in self.buffers}
+        self.output = captures
+        self.returncode: Optional[int] = None
+
+    @property
+    def done(self) -> bool:
+        return self.ended["stdout"] and self.ended["stderr"]
+
+    def feed(self, name: str, data: bytes) -> bool:
+        """Add output from a stream
+
+        Returns:
+            True once the stream's sentinel has arrived
+        """
+        buffer = self.buffers[name]
+        buffer += data
+
+        end = buffer.find(self.sentinel)
+        if end >= 0:
+            if name == "stdout":
+                match = self.exit_pattern.match(buffer, end)
+                if not match:
+                    return False  # The exit code hasn't fully arrived yet
+                self.returncode = int(match.group(1))
+            self._emit(name, bytes(buffer[:end]), final=True)
+            buffer.clear()
+            self.ended[name] = True
+            return True
+
+        # Everything but a partial sentinel at the end can be shown; the
+        # sentinel's only newline is its first byte
+        safe = len(buffer)
+        start = buffer.rfind(b"\n", max(0, len(buffer) - len(self.sentinel) + 1))
+        if start >= 0 and self.sentinel.startswith(bytes(buffer[start:])):
+            safe = start
+        if safe > 0:
+            self._emit(name, bytes(buffer[:safe]))
+            del buffer[:safe]
+        return False
+
+    def _emit(self, name: str, data: bytes, final: bool = False):
+        text = self.decoders[name].decode(data, final)
+        if text:
+            self.output[name].write(text)
+            if self.on_output:
+                self.on_output(name, text)
+
+    def finish(self):
+        """Get the collected stdout and stderr, flushing what was held back"""
+        for name, buffer in self.buffers.items():
+            if not self.ended[name]:
+                self._emit(name, bytes(buffer), final=True)
+        return self.output["stdout"].finish(), self.output["stderr"].finish()
@@ -0,0 +1,142 @@
+"""
+Incremental handling of streamed responses for OllamaCode.
+
+The fence detector spots complete ```bash and ```tool blocks while the
+response is still being generated, so that the pipelined executor can run
+them in the background before generation finishes.
+"""
+
+import logging
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, List, Tuple, Optional
+
+from .utils import BASH_BLOCK_PATTERN, TOOL_BLOCK_PATTERN, parse_tool_call
+from .scheduler import DependencyExecutor, LiveOutput
+
+
+class FenceDetector:
+    """Detects completed bash and tool blocks in a stream of text chunks
+
+    Blocks are found with the same patterns used by extract_bash_commands and
+    extract_tool_calls, scanning forward from the end of the last complete
+    match. A match can only be found once its closing fence has arrived and
+    it cannot change as more text is appended, so the blocks reported here
+    are exactly the ones the extractors find in the final response.
+    """
+
+    def __init__(self, detect_bash: bool = True, detect_tools: bool = True):
+        self.text = ""
+        self._patterns = []
+        if detect_bash:
+            self._patterns.append(["bash", BASH_BLOCK_PATTERN, 0])
+        if detect_tools:
+            self._patterns.append(["tool", TOOL_BLOCK_PATTERN, 0])
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any, int]]:
+        """Add a chunk of streamed text
+
+        Returns:
+            List of (kind, payload, end_offset) for each block completed by this
+            chunk, ordered by position. The payload is the command string for
+            bash blocks and the parsed tool call for tool blocks.
+        """
+        self.text += chunk
+        # A block can only be completed by a chunk containing part of a fence
+        if "`" not in chunk:
+            return []
+
+        completed = []
+        for entry in self._patterns:
+            kind, pattern, pos = entry
+            while True:
+                match = pattern.search(self.text, pos)
+                if not match:
+                    break
+                pos = match.end()
+                if kind == "bash":
+                    completed.append((kind, match.group(1).strip(), pos))
+                else:
+                    tool_call = parse_tool_call(match.group(1))
+                    # Invalid tool blocks are skipped, just like extract_tool_calls does
+                    if tool_call is not None:
+                        completed.append((kind, tool_call, pos))
+            entry[2] = pos
+
+        completed.sort(key=lambda block: block[2])
+        return completed
+
+
+class PipelinedExecutor:
+    """Runs bash and tool blocks in the background while a response streams
+
+    Read-only blocks run in parallel; blocks that may have side effects run
+    in the order they appear in the response (see DependencyExecutor). The
+    ResponseProcessor picks up the results once the stream has finished
+    instead of running the blocks itself; bash output is queued until then
+    and shown live from there on.
+    """
+
+    def __init__(self, processor, detect_bash: bool = True, detect_tools: bool = True,
+                 logger: Optional[logging.Logger] = None):
+        self.processor = processor
+        self.logger = logger or logging.getLogger(__name__)
+        self.detector = FenceDetector(detect_bash, detect_tools)
+        self._executor = DependencyExecutor(processor.max_workers, self.logger)
+        self._futures: Dict[str, List[Tuple[Any, Future, Optional[LiveOutput]]]] = {"bash": [], "tool": []}
+
+    def feed(self, chunk: str, first_only: bool = False) -> List[Tuple[str, Any, int]]:
+        """Feed streamed text and start executing any completed blocks
+
+        Args:
+            chunk: The streamed text
+            first_only: Only start the first completed block, for when the
+                stream is about to be cut off after it
+
+        Returns:
+            The blocks started for this chunk
+        """
+        completed = self.detector.feed(chunk)
+        if first_only:
+            completed = completed[:1]
+        for kind, payload, _ in completed:
+            self.logger.info(f"Starting {kind} block while response is streaming")
+            read_only = self.processor.is_read_only(kind, payload)
+            live = None
+            if kind == "bash":
+                live = LiveOutput()
+                future = self._executor.submit(self.processor.run_bash_command, payload, live.put,
+                                               read_only=read_only)
+            else:
+                future = self._executor.submit(self.processor.run_tool_call, payload, read_only=read_only)
+            self._futures[kind].append((payload, future, live))
+        return completed
+
+    def started(self, kind: str, index: int) -> bool:
+        """Check whether the index-th block of a kind was started"""
+        return index < len(self._futures.get(kind, []))
+
+    def take(self, kind: str, index: int, payload: Any,
+             on_output: Optional[Callable[[str, str], None]] = None) -> Optional[Any]:
+        """Get the result for the index-th block of a kind, waiting if it's still running
+
+        Args:
+            on_output: Called with a bash block's output so far, and then
+                as it arrives until the block finishes
+
+        Returns None if no matching block was started, in which case the
+        caller should execute the block itself.
+        """
+        futures = self._futures.get(kind, [])
+        if index >= len(futures):
+            return None
+        started_payload, future, live = futures[index]
+        if started_payload != payload:
+            self.logger.warning(f"Pipelined {kind} block does not match the final response, re-running it")
+            return None
+        if live and on_output:
+            return live.follow(future, on_output)
+        return future.result()
+
+    def shutdown(self):
+        """Stop the worker, cancelling blocks that haven't started yet"""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,233 @@
+"""
+Per-request inference telemetry for OllamaCode.
+
+Combines the timings Ollama reports in the final chunk of a streamed reply
+with client-side latency measurements, and keeps a rolling window of recent
+requests for percentile summaries.
+"""
+
+import time
+import threading
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+
+# Fields of Ollama's final chunk that are durations in nanoseconds
+OLLAMA_DURATION_FIELDS = ["total_duration", "load_duration", "prompt_eval_duration", "eval_duration"]
+OLLAMA_COUNT_FIELDS = ["prompt_eval_count", "eval_count"]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Get the pct-th percentile of values using linear interpolation"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class RequestStats:
+    """Telemetry for a single /api/chat request
+
+    Durations are stored in milliseconds.
+    """
+
+    def __init__(self, model: str, endpoint: str = "", started_at: Optional[float] = None):
+        self.model = model
+        self.endpoint = endpoint
+        self.timestamp = time.time()
+        # A hedged request is timed from when the user's request started
+        self._start = started_at if started_at is not None else time.monotonic()
+        self._last_token_at: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.inter_token: List[float] = []
+        self.tokens = 0
+        self.wall_time: Optional[float] = None
+        self.stopped_early = False
+        self.hedged = False
+        self.cache: Optional[str] = None  # "hit" or "miss" when the response cache applies
+        self.num_ctx: Optional[int] = None  # Context size requested in the options
+        
+        # How much of the previous prompt this one starts with, in messages
+        self.prompt_messages: Optional[int] = None
+        self.prefix_messages: Optional[int] = None
+        self.prefix_kept: Optional[bool] = None  # Previous prompt fully reused (None on the first turn)
+
+        # Values reported by Ollama in the final chunk
+        self.total_duration: Optional[float] = None
+        self.load_duration: Optional[float] = None
+        self.prompt_eval_duration: Optional[float] = None
+        self.eval_duration: Optional[float] = None
+        self.prompt_eval_count: Optional[int] = None
+        self.eval_count: Optional[int] = None
+
+    def on_token(self):
+        """Record the arrival of a streamed token"""
+        now = time.monotonic()
+        if self._last_token_at is None:
+            self.ttft = (now - self._start) * 1000
+        else:
+            self.inter_token.append((now - self._last_token_at) * 1000)
+        self._last_token_at = now
+        self.tokens += 1
+
+    def on_done(self, chunk: Dict[str, Any]):
+        """Record the timings from Ollama's final chunk"""
+        for field in OLLAMA_DURATION_FIELDS:
+            if chunk.get(field) is not None:
+                setattr(self, field, chunk[field] / 1e6)
+        for field in OLLAMA_COUNT_FIELDS:
+            if chunk.get(field) is not None:
+                setattr(self, field, int(chunk[field]))
+
+    def finish(self):
+        """Mark the end of the request"""
+        self.wall_time = (time.monotonic() - self._start) * 1000
+
+    @property
+    def inter_token_latency(self) -> Optional[float]:
+        """Mean time between streamed tokens in milliseconds"""
+        if not self.inter_token:
+            return None
+        return sum(self.inter_token) / len(self.inter_token)
+
+    @property
+    def eval_rate(self) -> Optional[float]:
+        """Generation speed in tokens per second"""
+        if not self.eval_count or not self.eval_duration:
+            return None
+        return self.eval_count / (self.eval_duration / 1000)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "ttft": self.ttft,
+            "inter_token_latency": self.inter_token_latency,
+            "tokens": self.tokens,
+            "wall_time": self.wall_time,
+            "stopped_early": self.stopped_early,
+            "hedged": self.hedged,
+            "cache": self.cache,
+            "total_duration": self.total_duration,
+            "load_duration": self.load_duration,
+            "prompt_eval_count": self.prompt_eval_count,
+            "prompt_eval_duration": self.prompt_eval_duration,
+            "prompt_messages": self.prompt_messages,
+            "prefix_messages": self.prefix_messages,
+            "prefix_kept": self.prefix_kept,
+            "eval_count": self.eval_count,
+            "eval_duration": self.eval_duration,
+            "eval_rate": self.eval_rate
+        }
+
+    def summary(self) -> str:
+        """One-line summary for logging"""
+        def ms(value):
+            return f"{value:.0f}ms" if value is not None else "-"
+
+        parts = [
+            f"model={self.model}",
+            f"ttft={ms(self.ttft)}",
+            f"itl={ms(self.inter_token_latency)}",
+            f"load={ms(self.load_duration)}",
+            f"prompt_eval={self.prompt_eval_count if self.prompt_eval_count is not None else '-'} tok/{ms(self.prompt_eval_duration)}",
+            f"eval={self.eval_count if self.eval_count is not None else '-'} tok/{ms(self.eval_duration)}",
+            f"total={ms(self.total_duration)}",
+            f"wall={ms(self.wall_time)}"
+        ]
+        if self.num_ctx is not None:
+            parts.append(f"num_ctx={self.num_ctx}")
+        if self.prompt_messages is not None:
+            parts.append(f"prefix={self.prefix_messages}/{self.prompt_messages} msgs"
+                         f"{' (rebuilt)' if self.prefix_kept is False else ''}")
+        if self.eval_rate is not None:
+            parts.append(f"rate={self.eval_rate:.1f} tok/s")
+        if self.stopped_early:
+            parts.append("stopped_early")
+        if self.hedged:
+            parts.append("hedged")
+        if self.cache:
+            parts.append(f"cache={self.cache}")
+        return ", ".join(parts)
+
+
+class TelemetryRecorder:
+    """Rolling window of request telemetry with percentile summaries"""
+
+    # Metrics shown by /stats, as (field, label, unit)
+    METRICS = [
+        ("ttft", "Time to first token", "ms"),
+        ("inter_token_latency", "Inter-token latency", "ms"),
+        ("load_duration", "Model load", "ms"),
+        ("prompt_eval_count", "Prompt tokens", "tok"),
+        ("prompt_eval_duration", "Prompt eval", "ms"),
+        ("eval_count", "Generated tokens", "tok"),
+        ("eval_duration", "Generation", "ms"),
+        ("eval_rate", "Generation rate", "tok/s"),
+        ("total_duration", "Total (server)", "ms"),
+        ("wall_time", "Total (client)", "ms"),
+    ]
+
+    def __init__(self, window: int = 100, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.requests: deque = deque(maxlen=window)
+        self.total_requests = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record(self, stats: RequestStats):
+        """Add a finished request to the window and log it
+
+        Replies served from the response cache are only counted, so they
+        don't skew the latency percentiles.
+        """
+        with self._lock:
+            if stats.cache == "hit":
+                self.cache_hits += 1
+            else:
+                if stats.cache == "miss":
+                    self.cache_misses += 1
+                self.requests.append(stats)
+                self.total_requests += 1
+        self.logger.info(f"Ollama request: {stats.summary()}")
+
+    def values(self, field: str, endpoint: Optional[str] = None) -> List[float]:
+        """Get the recorded (non-missing) values of a field
+
+        Args:
+            field: RequestStats attribute to collect
+            endpoint: Only include requests served by this endpoint URL
+        """
+        with self._lock:
+            records = list(self.requests)
+        values = []
+        for stats in records:
+            if endpoint is not None and stats.endpoint != endpoint:
+                continue
+            value = getattr(stats, field)
+            if value is not None:
+                values.append(value)
+        return values
+
+    def percentiles(self, field: str, pcts=(50, 90, 99),
+                    endpoint: Optional[str] = None) -> Dict[int, Optional[float]]:
+        """Get percentiles of a field over the window"""
+        values = self.values(field, endpoint)
+        return {pct: percentile(values, pct) for pct in pcts}
+
+    def average(self, field: str) -> Optional[float]:
+        """Get the mean of a field over the window"""
+        values = self.values(field)
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    @property
+    def last(self) -> Optional[RequestStats]:
+        with self._lock:
+            return self.requests[-1] if self.requests else None
@@ -0,0 +1,212 @@
+"""
+Self-calibrating token accounting for OllamaCode.
+
+Estimates token counts from character counts using a separate
+characters-per-token ratio for prose, code and JSON. The ratios are learned
+per model from the prompt_eval_count Ollama reports for each request, and
+persisted between runs.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+
+# Content classes and their starting characters-per-token ratios
+DEFAULT_RATIOS = {
+    "prose": 4.0,
+    "code": 3.5,
+    "json": 3.0,
+}
+
+# Tokens the chat template adds around each message
+MESSAGE_OVERHEAD = 4
+
+# Relative change of a ratio, since the counts were last re-estimated, at
+# which cached message counts are re-estimated
+RESCALE_THRESHOLD = 0.05
+
+# Least seconds between writes of the ratios file
+SAVE_INTERVAL = 30.0
+
+FENCE_PATTERN = re.compile(r"```([\w+-]*)\n([\s\S]*?)```")
+JSON_FENCES = {"json", "tool"}
+
+
+def classify(text: str) -> Dict[str, int]:
+    """Split the characters of a text into prose, code and JSON
+
+    Fenced blocks count as code (or JSON for json/tool fences); text outside
+    fences is prose, unless the whole text looks like a JSON document.
+    """
+    counts = {content_class: 0 for content_class in DEFAULT_RATIOS}
+    stripped = text.strip()
+    if stripped[:1] in ("{", "[") and stripped[-1:] in ("}", "]"):
+        counts["json"] = len(text)
+        return counts
+
+    fenced = 0
+    for match in FENCE_PATTERN.finditer(text):
+        content_class = "json" if match.group(1).lower() in JSON_FENCES else "code"
+        counts[content_class] += len(match.group(2))
+        fenced += len(match.group(2))
+    counts["prose"] = len(text) - fenced
+    return counts
+
+
+class TokenAccountant:
+    """Per-model token estimates calibrated against Ollama's prompt_eval_count
+
+    Each observation compares the estimate for a prompt with the number of
+    tokens Ollama evaluated and moves the ratio of each content class toward
+    the observed one, in proportion to that class's share of the prompt.
+    The ratios file is written at most every SAVE_INTERVAL seconds, and on
+    flush().
+    """
+
+    def __init__(self, path: Optional[str] = None, smoothing: float = 0.2,
+                 logger: Optional[logging.Logger] = None):
+        self.path = os.path.expanduser(path) if path else None
+        self.smoothing = smoothing
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self._last_prompts: Dict[str, List[str]] = {}
+        # Ratios the cached message counts were estimated with, per model
+        self._applied: Dict[str, Dict[str, float]] = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.models = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            self.logger.warning(f"Could not load token ratios from {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        self._dirty = False
+        self._last_save = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.models, f, indent=2)
+            os.replace(temp_path, self.path)
+        except IOError as e:
+            self.logger.warning(f"Could not save token ratios to {self.path}: {e}")
+
+    def flush(self):
+        """Write the ratios file if there are unsaved changes"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def ratios(self, model: str) -> Dict[str, float]:
+        """Get the characters-per-token ratios for a model"""
+        learned = self.models.get(model, {})
+        return {content_class: learned.get(content_class, default)
+                for content_class, default in DEFAULT_RATIOS.items()}
+
+    def estimate(self, text: str, model: str) -> int:
+        """Estimate the tokens in a text for a model"""
+        ratios = self.ratios(model)
+        return int(sum(chars / ratios[content_class]
+                       for content_class, chars in classify(text).items()))
+
+    def estimate_prompt(self, messages: List[Dict[str, str]], model: str) -> int:
+        """Estimate the prompt tokens Ollama evaluates for a list of messages"""
+        return sum(self.estimate(message["content"], model) + MESSAGE_OVERHEAD for message in messages)
+
+    def observe(self, messages: List[Dict[str, str]], model: str, prompt_eval_count: int) -> bool:
+        """Calibrate the ratios from the prompt tokens Ollama reported for a request
+
+        Ollama only counts the tokens it had to evaluate, so when the start
+        of the prompt was still in its cache the count covers just the new
+        messages: those after the previous prompt and the reply to it.
+        Observations that match neither that suffix nor the whole prompt are
+        skipped.
+
+        Returns:
+            True if a ratio moved more than RESCALE_THRESHOLD since the last
+            time this returned True, so estimates made before are stale
+        """
+        with self._lock:
+            previous = self._last_prompts.get(model, [])
+            self._last_prompts[model] = [message["content"] for message in messages]
+
+            # A prompt that extends the previous one was most likely evaluated
+            # from the cache, so try the new messages first
+            cached = 0
+            while (cached < len(previous) and cached < len(messages) and
+                   messages[cached]["content"] == previous[cached]):
+                cached += 1
+            candidates = [messages]
+            if previous and cached == len(previous):
+                if cached < len(messages) and messages[cached]["role"] == "assistant":
+                    cached += 1
+                if cached < len(messages):
+                    candidates.insert(0, messages[cached:])
+
+            factor = None
+            for candidate in candidates:
+                factor = self._observed_factor(candidate, model, prompt_eval_count)
+                if factor is not None:
+                    messages = candidate
+                    break
+            if factor is None:
+                self.logger.debug(f"Skipping token calibration for {model} ({prompt_eval_count} prompt tokens)")
+                return False
+
+            counts = self._count(messages)
+            total_chars = sum(counts.values())
+            ratios = self.ratios(model)
+            applied = self._applied.setdefault(model, ratios)
+            learned = self.models.setdefault(model, {})
+            for content_class, chars in counts.items():
+                if not chars:
+                    continue
+                weight = self.smoothing * chars / total_chars
+                learned[content_class] = ratios[content_class] * (1 - weight) + (ratios[content_class] / factor) * weight
+            learned["samples"] = learned.get("samples", 0) + 1
+            self.logger.debug(f"Token ratios for {model}: {self.ratios(model)} (estimate was off by {factor:.2f}x)")
+            self._dirty = True
+            if time.monotonic() - self._last_save >= SAVE_INTERVAL:
+                self._save()
+
+            current = self.ratios(model)
+            if all(abs(current[content_class] / applied[content_class] - 1) <= RESCALE_THRESHOLD
+                   for content_class in current):
+                return False
+            self._applied[model] = current
+        return True
+
+    @staticmethod
+    def _count(messages: List[Dict[str, str]]) -> Dict[str, int]:
+        counts = {content_class: 0 for content_class in DEFAULT_RATIOS}
+        for message in messages:
+            for content_class, chars in classify(message["content"]).items():
+                counts[content_class] += chars
+        return counts
+
+    def _observed_factor(self, messages: List[Dict[str, str]], model: str,
+                         prompt_eval_count: int) -> Optional[float]:
+        """Get observed/estimated tokens, or None if the observation is unusable"""
+        counts = self._count(messages)
+        content_tokens = prompt_eval_count - MESSAGE_OVERHEAD * len(messages)
+        if sum(counts.values()) < 200 or content_tokens <= 0:
+            return None
+        ratios = self.ratios(model)
+        estimated = sum(chars / ratios[content_class] for content_class, chars in counts.items())
+        factor = content_tokens / estimated
+        if factor < 0.5 or factor > 3.0:
+            return None
+        return factor
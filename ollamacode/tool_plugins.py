@@ -18,6 +18,7 @@ class ToolPlugin(ABC):
     
     name = "base_tool"  # Override in subclasses
     description = "Base tool plugin"  # Override in subclasses
+    read_only = False  # True if the tool has no side effects and may run in parallel
     
     @classmethod
     @property
@@ -80,6 +81,7 @@ class FileReadTool(ToolPlugin):
     
     name = "file_read"
     description = "Read a file's contents"
+    read_only = True
     
     @classmethod
     @property
@@ -1,6 +1,5 @@
 import os
 import json
-import subprocess
 import urllib.request
 import urllib.parse
 import base64
@@ -13,6 +12,8 @@ from pathlib import Path
 
 from .utils import find_executable, Colors
 from .security import SecurityManager
+from .process import run_process, command_limits
+from .capture import spill_directory, read_output
 from .tool_plugins import ToolPlugin, tool_registry
 
 class ToolsFramework:
@@ -65,6 +66,7 @@ class ToolsFramework:
             "web_get": self.web_get,
             "sys_info": self.sys_info,
             "python_run": self.python_run,
+            "output_read": self.output_read,
             # Add more tools here
         }
         
@@ -282,6 +284,24 @@ class ToolsFramework:
         except Exception as e:
             return {"status": "error", "error": str(e)}
             
+    def output_read(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Page through the full output of a command whose output was truncated"""
+        if "handle" not in params:
+            return {"status": "error", "error": "Missing required parameter: handle"}
+        
+        try:
+            return read_output(
+                self.working_dir,
+                str(params["handle"]),
+                offset=int(params.get("offset", 0)),
+                length=int(params.get("length", 200)),
+                grep=params.get("grep")
+            )
+        except (ValueError, TypeError) as e:
+            return {"status": "error", "error": f"Invalid parameter: {str(e)}"}
+        except OSError as e:
+            return {"status": "error", "error": f"Error reading output: {str(e)}"}
+    
     def python_run(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a Python script"""
         # Check if we have a path or code
@@ -345,21 +365,22 @@ class ToolsFramework:
                         "text": e.text if hasattr(e, 'text') else None
                     }
             
-            # Execute the Python script
-            process = subprocess.Popen(
+            # Execute the Python script in its own process group, so a
+            # timeout also stops anything it started. Output beyond the cap
+            # is spilled to the workspace for the output_read tool
+            limits = command_limits(self.config, "python_run")
+            process = run_process(
                 [python_exec, str(script_path)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=str(self.working_dir)
+                cwd=str(self.working_dir),
+                timeout=float(limits["timeout"]),
+                limits=limits,
+                max_output=int(limits["max_output"]),
+                spill_dir=spill_directory(self.working_dir) if self.config.get("output_spill", True) else None,
+                label="python"
             )
-            
-            # Set a timeout for execution
-            try:
-                stdout, stderr = process.communicate(timeout=15)
-            except subprocess.TimeoutExpired:
-                process.kill()
-                return {"status": "error", "error": "Python script execution timed out after 15 seconds."}
+            if process.timed_out:
+                return {"status": "error", "error": f"Python script execution timed out after {limits['timeout']:g} seconds."}
+            stdout, stderr = process.stdout, process.stderr
             
             # Clean up if we used a temporary file
             if temp_file:
@@ -369,20 +390,25 @@ class ToolsFramework:
                     pass
             
             if process.returncode == 0:
-                return {
+                result = {
                     "status": "success",
                     "returncode": process.returncode,
                     "stdout": stdout,
                     "script_path": str(script_path)
                 }
             else:
-                return {
+                result = {
                     "status": "error",
                     "returncode": process.returncode,
                     "stderr": stderr,
                     "stdout": stdout,
                     "script_path": str(script_path)
                 }
+            if process.rusage:
+                result["rusage"] = process.rusage
+            if process.handles:
+                result["output_handles"] = process.handles
+            return result
                 
         except Exception as e:
             return {"status": "error", "error": f"Error executing Python script: {str(e)}"}
\ No newline at end of file
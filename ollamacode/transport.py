@@ -0,0 +1,84 @@
+"""
+Pooled HTTP transport for talking to the Ollama API.
+"""
+
+import logging
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .endpoints import EndpointPool
+
+
+class OllamaAPIError(Exception):
+    """Raised when the Ollama API responds with an error status"""
+
+
+class OllamaTransport:
+    """Shared HTTP transport that keeps pooled keep-alive connections to Ollama
+
+    A single requests.Session is reused for every call so that the TCP
+    connection set up for one request is reused by the next one instead of
+    being torn down after each call.
+    """
+
+    def __init__(self, config: Dict[str, Any], logger: Optional[logging.Logger] = None):
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+
+        # (connect, read) timeout tuple used for every request
+        self.timeout = (
+            float(config.get("http_connect_timeout", 5.0)),
+            float(config.get("http_read_timeout", 300.0))
+        )
+
+        self.session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        """Create a session with a pooled adapter and retry policy"""
+        max_retries = int(self.config.get("http_max_retries", 2))
+        pool_size = int(self.config.get("http_pool_size", 4))
+
+        # Keep a connection pool for every configured Ollama host
+        host_count = len(EndpointPool.parse_urls(self.config.get("ollama_endpoint", "")))
+
+        # Connection failures are always safe to retry since nothing reached
+        # the server. Read errors and 5xx statuses are only retried for
+        # idempotent methods, so a chat generation is never submitted twice.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=float(self.config.get("http_backoff_factor", 0.3)),
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False
+        )
+
+        adapter = HTTPAdapter(
+            pool_connections=max(pool_size, host_count),
+            pool_maxsize=pool_size,
+            max_retries=retry
+        )
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Send a GET request over the pooled session"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def post(self, url: str, json: Optional[Dict[str, Any]] = None, stream: bool = False, **kwargs) -> requests.Response:
+        """Send a POST request over the pooled session"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, json=json, stream=stream, **kwargs)
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
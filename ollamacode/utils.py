@@ -8,6 +8,8 @@ import tempfile
 import subprocess
 from typing import Dict, Any, List, Optional, Tuple, Union
 
+from .process import run_process
+
 # ANSI color codes for terminal output
 class Colors:
     HEADER = '\033[95m'
@@ -71,42 +73,47 @@ def execute_code(file_path: str, language: str) -> Tuple[bool, str]:
         return False, f"Execution not supported for language '{language}' or required executable not found."
     
     try:
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=10  # Add timeout to prevent infinite loops
-        )
+        # Own process group, so the timeout also stops anything it started
+        result = run_process(cmd, timeout=10)  # Add timeout to prevent infinite loops
         
+        if result.timed_out:
+            return False, "Execution timed out after 10 seconds."
         if result.returncode == 0:
             return True, result.stdout
         else:
             return False, f"Execution error (code {result.returncode}):\n{result.stderr}"
     
-    except subprocess.TimeoutExpired:
-        return False, "Execution timed out after 10 seconds."
     except Exception as e:
         return False, f"Error executing code: {str(e)}"
 
+# Patterns for the fenced blocks the model uses to request actions
+BASH_BLOCK_PATTERN = re.compile(r"```(?:bash|shell|sh)\n([\s\S]*?)```")
+TOOL_BLOCK_PATTERN = re.compile(r"```tool\n([\s\S]*?)```")
+
 def extract_bash_commands(text: str) -> List[str]:
     """Extract bash commands from markdown code blocks"""
-    bash_blocks = re.findall(r"```(?:bash|shell|sh)\n([\s\S]*?)```", text)
+    bash_blocks = BASH_BLOCK_PATTERN.findall(text)
     return [block.strip() for block in bash_blocks]
 
+def parse_tool_call(block: str) -> Optional[Dict[str, Any]]:
+    """Parse the body of a tool block, returning None if it isn't a valid tool call"""
+    import json
+    try:
+        tool_data = json.loads(block.strip())
+    except json.JSONDecodeError:
+        return None
+    if isinstance(tool_data, dict) and "tool" in tool_data and "params" in tool_data:
+        return tool_data
+    return None
+
 def extract_tool_calls(text: str) -> List[Dict[str, Any]]:
     """Extract tool calls from markdown tool blocks"""
-    import json
-    tool_blocks = re.findall(r"```tool\n([\s\S]*?)```", text)
     tool_calls = []
     
-    for block in tool_blocks:
-        try:
-            tool_data = json.loads(block.strip())
-            if "tool" in tool_data and "params" in tool_data:
-                tool_calls.append(tool_data)
-        except json.JSONDecodeError:
-            continue
+    for block in TOOL_BLOCK_PATTERN.findall(text):
+        tool_data = parse_tool_call(block)
+        if tool_data is not None:
+            tool_calls.append(tool_data)
             
     return tool_calls
 
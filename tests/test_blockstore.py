@@ -0,0 +1,85 @@
+"""
+Tests for references to deduplicated tool outputs as the history is pruned.
+"""
+
+from types import SimpleNamespace
+
+from ollamacode.blockstore import BlockStore
+from ollamacode.conversation import ConversationHistory
+from ollamacode.response_processor import ResponseProcessor
+
+OUTPUT = "".join(f"line {i} of output\n" for i in range(100))
+CHANGED = OUTPUT.replace("line 50 ", "LINE 50 ")
+
+
+def count(text):
+    return len(text) // 4
+
+
+def make_history(max_tokens=10 ** 6):
+    history = ConversationHistory(max_tokens=max_tokens, system_prompt="sys", token_counter=count, prune_policy="prefix")
+    blocks = BlockStore(count)
+    history.blockstore = blocks
+    return history, blocks
+
+
+def add_output(history, blocks, output, heading="Result"):
+    return history.add_message("user", f"{heading}:\n" + blocks.render("bash:ls", output))
+
+
+def oldest(history):
+    return next(seq for seq, message in history._messages.items() if message.role != "system")
+
+
+def test_reference_expanded_when_original_is_pruned():
+    history, blocks = make_history()
+    add_output(history, blocks, OUTPUT)
+    reference = add_output(history, blocks, OUTPUT)
+    assert "identical to block:" in reference.content
+
+    history._remove(oldest(history))
+    assert OUTPUT in reference.content
+    assert history.current_token_count == sum(message.token_estimate for message in history.messages)
+
+
+def test_diff_expanded_when_base_is_pruned():
+    history, blocks = make_history()
+    add_output(history, blocks, OUTPUT)
+    diff = add_output(history, blocks, CHANGED)
+    reference = add_output(history, blocks, CHANGED)
+    assert "changes to block:" in diff.content
+
+    history._remove(oldest(history))
+    assert CHANGED in diff.content
+    # The reference now points at the expanded copy, which is still there
+    assert "identical to block:" in reference.content
+
+
+def test_only_referring_messages_are_indexed():
+    history, blocks = make_history()
+    add_output(history, blocks, OUTPUT)
+    add_output(history, blocks, OUTPUT)
+    history.add_message("user", "unrelated")
+    assert list(history._block_refs.values()) == [{2}]
+
+
+def test_pruning_stays_within_budget_after_expansion():
+    history, blocks = make_history()
+    history.prune_policy = "importance"
+    add_output(history, blocks, OUTPUT)
+    # Ranked above the original, so the original is pruned first, and both
+    # are expanded to a full output
+    add_output(history, blocks, CHANGED, heading="Important result")
+    add_output(history, blocks, OUTPUT, heading="Important result")
+    history.max_tokens = history.current_token_count
+    history.add_message("user", "Important: next step")
+    assert history.current_token_count <= history.max_tokens
+
+
+def test_file_reads_keyed_by_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir("/")
+    history, blocks = make_history()
+    processor = ResponseProcessor({}, None, SimpleNamespace(working_dir=tmp_path), blocks=blocks)
+    history.add_message("user", processor._format_file_read_result({"path": "notes.txt", "content": OUTPUT}))
+    second = processor._format_file_read_result({"path": str(tmp_path / "notes.txt"), "content": CHANGED})
+    assert "changes to block:" in second
@@ -0,0 +1,98 @@
+"""
+Tests for bounded output capture, spill files and reading them with output_read.
+"""
+
+import os
+
+import pytest
+
+from ollamacode.capture import OutputCapture, read_output, spill_directory
+
+LINES = [f"line {i}" for i in range(2500)]
+OUTPUT = "".join(line + "\n" for line in LINES)
+
+
+def capture(text, limit, spill_dir=None, chunk=37):
+    output = OutputCapture(limit, spill_dir, label="test")
+    for start in range(0, len(text), chunk):
+        output.write(text[start:start + chunk])
+    return output, output.finish()
+
+
+def test_short_output_is_kept_whole(tmp_path):
+    output, text = capture("hello\nworld\n", 100, spill_directory(tmp_path))
+    assert text == "hello\nworld\n"
+    assert not output.truncated and output.handle is None
+    assert not os.path.exists(spill_directory(tmp_path))
+    assert capture(OUTPUT, None)[1] == OUTPUT
+
+
+def test_head_and_tail_are_kept():
+    output, text = capture(OUTPUT, 1001)
+    assert output.truncated and output.total == len(OUTPUT)
+    assert output.handle is None
+    assert text.startswith(OUTPUT[:500])
+    assert text.endswith(OUTPUT[-501:])
+    assert f"[{len(OUTPUT) - 1001} characters omitted]" in text
+
+
+def test_long_output_is_spilled(tmp_path):
+    output, text = capture(OUTPUT, 1000, spill_directory(tmp_path))
+    assert output.handle and output.handle in text
+    assert text.startswith(OUTPUT[:500]) and text.endswith(OUTPUT[-500:])
+    with open(os.path.join(spill_directory(tmp_path), output.handle), encoding="utf-8") as f:
+        assert f.read() == OUTPUT
+    assert f"{len(LINES)} lines" in text
+
+
+@pytest.fixture
+def handle(tmp_path):
+    return capture(OUTPUT, 1000, spill_directory(tmp_path))[0].handle
+
+
+def test_read_pages(tmp_path, handle):
+    result = read_output(tmp_path, handle, length=200)
+    assert result["status"] == "success"
+    assert result["content"].split("\n") == LINES[:200]
+    assert result["first_line"] == 1 and result["lines"] == 200
+    assert result["more"] and result["next_offset"] == 200
+
+    result = read_output(tmp_path, handle, offset=result["next_offset"], length=200)
+    assert result["content"].split("\n") == LINES[200:400]
+
+    result = read_output(tmp_path, handle, offset=2450, length=200)
+    assert result["content"].split("\n") == LINES[2450:]
+    assert not result["more"] and "next_offset" not in result
+
+    assert read_output(tmp_path, handle, offset=5000)["lines"] == 0
+
+
+@pytest.mark.parametrize("offset", [999, 1000, 1001, 1999, 2000, 2001])
+def test_read_past_index_checkpoints(tmp_path, handle, offset):
+    result = read_output(tmp_path, handle, offset=offset, length=5)
+    assert result["content"].split("\n") == LINES[offset:offset + 5]
+
+    # The same lines are found by scanning when the index is gone
+    os.unlink(os.path.join(spill_directory(tmp_path), handle + ".idx"))
+    assert read_output(tmp_path, handle, offset=offset, length=5)["content"] == result["content"]
+
+
+def test_grep(tmp_path, handle):
+    result = read_output(tmp_path, handle, grep=r"^line 99\d$")
+    assert result["content"].split("\n") == [f"{i + 1}: line {i}" for i in range(990, 1000)]
+    assert result["grep"] == r"^line 99\d$"
+
+    result = read_output(tmp_path, handle, grep=r"^line 1\d\d$", length=50)
+    assert result["lines"] == 50 and result["more"]
+    result = read_output(tmp_path, handle, grep=r"^line 1\d\d$", offset=result["next_offset"])
+    assert result["content"].split("\n")[0] == "151: line 150"
+    assert result["lines"] == 50 and not result["more"]
+
+    # Lookarounds are checked line by line; invalid patterns match literally
+    assert read_output(tmp_path, handle, grep=r"(?<=line )2499")["content"] == "2500: line 2499"
+    assert read_output(tmp_path, handle, grep="line 7[")["lines"] == 0
+
+
+def test_invalid_handles(tmp_path, handle):
+    assert read_output(tmp_path, "../" + handle)["status"] == "error"
+    assert read_output(tmp_path, "missing.log")["status"] == "error"
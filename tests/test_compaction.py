@@ -0,0 +1,72 @@
+"""
+Tests for how the compactor's prepared summary survives changes to the history.
+"""
+
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+from ollamacode.compaction import Compactor
+from ollamacode.conversation import ConversationHistory
+
+
+def make_history():
+    history = ConversationHistory(max_tokens=200, system_prompt="sys", token_counter=lambda text: len(text) // 4)
+    history.compactor = Compactor(None, {"model": "test", "compaction_soft_limit": 100})
+    return history
+
+
+def test_clear_drops_prepared_summary():
+    history = make_history()
+    for i in range(4):
+        history.add_message("user", f"old {i}")
+    history.compactor._prepared = ([1, 2, 3, 4], "Summary of the old conversation")
+
+    history.clear()
+    for i in range(12):
+        history.add_message("user", f"new {i} " + "x" * 60)
+
+    contents = [message.content for message in history.messages]
+    assert not any(content.startswith("Summary") for content in contents)
+    assert contents[1].startswith("new 0")
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {"message": {"content": "Summary"}}
+
+
+class FakeClient:
+    """Just enough of OllamaClient for Compactor._summarize"""
+
+    def __init__(self, on_post=None):
+        self.on_post = on_post
+        self.options = SimpleNamespace(num_ctx=lambda model, tokens: 4096)
+        self.endpoints = SimpleNamespace(select=lambda model: "http://test", lease=lambda endpoint: nullcontext())
+        self.transport = SimpleNamespace(post=self.post)
+
+    def estimate_tokens(self, text):
+        return len(text) // 4
+
+    def api_url(self, path, endpoint):
+        return endpoint + path
+
+    def post(self, url, json):
+        if self.on_post:
+            self.on_post()
+        return FakeResponse()
+
+
+def test_summary_is_prepared():
+    compactor = Compactor(FakeClient(), {"model": "test"})
+    compactor._summarize([1, 2], [("user", "a"), ("assistant", "b")], compactor._generation)
+    assert compactor._prepared == ([1, 2], "Summary")
+
+
+def test_reset_discards_summary_in_progress():
+    # The history is cleared while the summary is being written
+    compactor = Compactor(None, {"model": "test"})
+    compactor.client = FakeClient(on_post=compactor.reset)
+    compactor._summarize([1, 2], [("user", "a"), ("assistant", "b")], compactor._generation)
+    assert compactor._prepared is None
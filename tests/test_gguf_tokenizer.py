@@ -0,0 +1,102 @@
+"""
+Tests for the BPE and SentencePiece token counting in gguf_tokenizer.py.
+"""
+
+import random
+
+import pytest
+
+from ollamacode.gguf_tokenizer import BYTE_ENCODER, GGUFTokenizer, _merge, regex
+
+needs_regex = pytest.mark.skipif(regex is None, reason="byte-level BPE needs the regex module")
+
+BYTE_DECODER = {char: byte for byte, char in BYTE_ENCODER.items()}
+
+# Merges for "hello", " world" and "hi"; "Ġ" is the byte-level form of a space
+MERGES = ["h e", "l l", "he ll", "hell o", "Ġ w", "o r", "Ġw or", "Ġwor l", "Ġworl d", "h i"]
+BPE_METADATA = {
+    "tokenizer.ggml.model": "gpt2",
+    "tokenizer.ggml.pre": "gpt2",
+    "tokenizer.ggml.tokens": sorted({"".join(merge.split()) for merge in MERGES}),
+    "tokenizer.ggml.merges": MERGES,
+}
+
+SPM_TOKENS = ["▁", "h", "e", "l", "o", "he", "ll", "hell", "hello", "▁hello", "▁w", "or", "ld"]
+SPM_METADATA = {
+    "tokenizer.ggml.model": "llama",
+    "tokenizer.ggml.tokens": SPM_TOKENS,
+    "tokenizer.ggml.scores": [-float(index) for index in range(len(SPM_TOKENS))],
+}
+
+
+def naive_merge(symbols, priority):
+    """Reference for _merge: rescan every pair after each merge"""
+    symbols = list(symbols)
+    while True:
+        pairs = [(priority(symbols[i], symbols[i + 1]), i) for i in range(len(symbols) - 1)]
+        pairs = [pair for pair in pairs if pair[0] is not None]
+        if not pairs:
+            return symbols
+        _, i = min(pairs)
+        symbols[i:i + 2] = [symbols[i] + symbols[i + 1]]
+
+
+def decode(symbols):
+    return bytes(BYTE_DECODER[char] for symbol in symbols for char in symbol).decode("utf-8")
+
+
+def test_merge_applies_lowest_rank_first():
+    ranks = {("a", "a"): 0, ("aa", "b"): 1, ("a", "b"): 2}
+    assert _merge(list("aaab"), lambda left, right: ranks.get((left, right))) == ["aa", "ab"]
+    assert _merge(list("aab"), lambda left, right: ranks.get((left, right))) == ["aab"]
+    assert _merge([], lambda left, right: 0) == []
+
+
+def test_merge_matches_naive_merge():
+    ranks = {("a", "b"): 0, ("b", "a"): 1, ("ab", "a"): 2, ("a", "a"): 3, ("aba", "b"): 4, ("b", "b"): 5}
+    priority = lambda left, right: ranks.get((left, right))  # noqa: E731
+    rng = random.Random(0)
+    for _ in range(500):
+        word = [rng.choice("ab") for _ in range(rng.randint(1, 20))]
+        assert _merge(list(word), priority) == naive_merge(word, priority)
+
+
+@needs_regex
+def test_bpe_count():
+    tokenizer = GGUFTokenizer(BPE_METADATA)
+    assert tokenizer._pre_tokenize("hello world") == ["hello", " world"]
+    assert tokenizer.count("hello world") == 2
+    assert tokenizer.count("hi world") == 2
+    # Unmerged bytes count one token each
+    assert tokenizer.count("hex") == 2
+    assert tokenizer.count("") == 0
+
+
+@needs_regex
+@pytest.mark.parametrize("text", ["hello world", "héllo wörld\n\n  hi!", "naïve 日本語 🙂 code()\t42"])
+def test_bpe_round_trip(text):
+    tokenizer = GGUFTokenizer(BPE_METADATA)
+    words = tokenizer._pre_tokenize(text)
+    assert "".join(words) == text
+    symbols = []
+    for word in words:
+        symbols += _merge([BYTE_ENCODER[byte] for byte in word.encode("utf-8")],
+                          lambda left, right: tokenizer.ranks.get((left, right)))
+    assert decode(symbols) == text
+    assert tokenizer.count(text) == len(symbols)
+
+
+def test_spm_count():
+    tokenizer = GGUFTokenizer(SPM_METADATA)
+    assert tokenizer.count("hello") == 1
+    assert tokenizer.count("hello world") == 4  # ▁hello ▁w or ld
+    # Characters missing from the vocabulary fall back to their bytes
+    assert tokenizer.count("é") == 3  # ▁ plus two bytes
+
+
+@needs_regex
+def test_unsupported_tokenizers():
+    with pytest.raises(ValueError):
+        GGUFTokenizer(dict(BPE_METADATA, **{"tokenizer.ggml.pre": "unknown"}))
+    with pytest.raises(ValueError):
+        GGUFTokenizer({"tokenizer.ggml.model": "bert"})
@@ -0,0 +1,107 @@
+"""
+Tests for recovering, indexing, protecting and pruning session journals.
+"""
+
+import os
+import stat
+import time
+
+from ollamacode.journal import SessionJournal, OFFSET_SIZE
+
+
+def write_journal(path, count=3):
+    journal = SessionJournal(str(path), fsync="never")
+    for i in range(count):
+        journal.append_message("user", f"message {i}", float(i), 1.0)
+    journal.close()
+
+
+def contents(journal):
+    return [journal.read(index)["content"] for index in range(len(journal))]
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    path = tmp_path / "session.jsonl"
+    write_journal(path)
+    with open(path, "ab") as f:
+        f.write(b'{"type":"message","role":"user","content":"torn')
+
+    journal = SessionJournal(str(path), fsync="never")
+    assert contents(journal) == ["message 0", "message 1", "message 2"]
+    journal.append_message("user", "after", 3.0, 1.0)
+    assert journal.read(3)["content"] == "after"
+    assert path.read_bytes().endswith(b'"after","ts":3.0,"importance":1.0}\n')
+    journal.close()
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    path = tmp_path / "session.jsonl"
+    write_journal(path)
+    os.unlink(str(path) + ".idx")
+
+    journal = SessionJournal(str(path), fsync="never")
+    assert contents(journal) == ["message 0", "message 1", "message 2"]
+    journal.close()
+
+
+def test_corrupt_index_is_rebuilt(tmp_path):
+    path = tmp_path / "session.jsonl"
+    index = tmp_path / "session.jsonl.idx"
+    write_journal(path)
+    with open(index, "ab") as f:
+        f.write(b"\0\0\0")
+    journal = SessionJournal(str(path), fsync="never")
+    assert contents(journal) == ["message 0", "message 1", "message 2"]
+    journal.close()
+
+    # An index that misses the last entry, as after a crash between the two writes
+    index.write_bytes(index.read_bytes()[:-OFFSET_SIZE])
+    journal = SessionJournal(str(path), fsync="never")
+    assert len(journal) == 3
+    assert journal.read(2)["content"] == "message 2"
+    journal.close()
+
+
+def test_journal_is_private(tmp_path):
+    path = tmp_path / "sessions" / "session.jsonl"
+    write_journal(path)
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) & 0o077 == 0
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(str(path) + ".idx").st_mode) == 0o600
+
+    # Files created before are restricted when opened again
+    os.chmod(path, 0o644)
+    SessionJournal(str(path), fsync="never").close()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def make_journals(directory, count):
+    """Create journals with one day between their modification times, newest first"""
+    now = time.time()
+    paths = []
+    for i in range(count):
+        path = directory / f"session{i}.jsonl"
+        write_journal(path, count=1)
+        os.utime(path, (now - i * 86400 - 60, now - i * 86400 - 60))
+        paths.append(path)
+    return paths
+
+
+def test_prune_keeps_newest(tmp_path):
+    paths = make_journals(tmp_path, 4)
+    assert SessionJournal.prune(str(tmp_path), keep=2) == 2
+    assert [path.exists() for path in paths] == [True, True, False, False]
+    assert not os.path.exists(str(paths[3]) + ".idx")
+
+
+def test_prune_by_age(tmp_path):
+    paths = make_journals(tmp_path, 4)
+    assert SessionJournal.prune(str(tmp_path), max_age_days=1.5) == 2
+    assert [path.exists() for path in paths] == [True, True, False, False]
+
+
+def test_prune_never_deletes_excluded(tmp_path):
+    paths = make_journals(tmp_path, 3)
+    assert SessionJournal.prune(str(tmp_path), keep=1, exclude=str(paths[2])) == 1
+    assert [path.exists() for path in paths] == [True, False, True]
+    assert SessionJournal.prune(str(tmp_path)) == 0
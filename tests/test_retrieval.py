@@ -0,0 +1,47 @@
+"""
+Tests for keeping the retrieval index in step with the conversation history.
+"""
+
+import numpy as np
+
+from ollamacode.conversation import ConversationHistory
+from ollamacode.retrieval import RetrievalIndex
+
+
+def make_history(tmp_path):
+    history = ConversationHistory(max_tokens=10 ** 6, system_prompt="sys", token_counter=lambda text: len(text) // 4)
+    history.retriever = RetrievalIndex(None, {"retrieval_cache_path": str(tmp_path / "embeddings.db")})
+    return history
+
+
+def archive_old_turns(history):
+    history.add_message("user", "old question")
+    history.add_message("assistant", "old answer")
+    for seq in [seq for seq, message in history._messages.items() if message.role != "system"]:
+        history._evict(seq)
+    retriever = history.retriever
+    # One chunk embedded, one still pending
+    with retriever._lock:
+        role, text, created = retriever._pending.pop(0)
+    retriever._add(np.ones((1, 4), dtype=np.float32) / 2, [(role, text, created)])
+    assert len(retriever) == 1 and retriever._pending
+
+
+def test_clear_resets_index(tmp_path):
+    history = make_history(tmp_path)
+    archive_old_turns(history)
+    history.clear()
+    assert len(history.retriever) == 0
+    assert history.retriever._pending == []
+    assert history.retriever.search(np.ones(4, dtype=np.float32) / 2, 4) == []
+
+
+def test_load_resets_index(tmp_path):
+    history = make_history(tmp_path)
+    path = str(tmp_path / "history.json")
+    history.add_message("user", "saved question")
+    history.save_to_file(path)
+    archive_old_turns(history)
+    history.load_from_file(path)
+    assert len(history.retriever) == 0
+    assert history.retriever._pending == []
@@ -0,0 +1,59 @@
+"""
+Tests for the read-only classification of bash commands in scheduler.py.
+"""
+
+import pytest
+
+from ollamacode.scheduler import is_read_only_command
+
+
+@pytest.mark.parametrize("command", [
+    "ls -la",
+    "cat a.txt | grep foo | wc -l",
+    "git status && git diff HEAD~1",
+    "git log --oneline -5",
+    "sort -n data.txt",
+    "find . -name '*.py'",
+    "tree -L 2",
+    "rg --type py TODO",
+    "git diff --text",
+])
+def test_read_only(command):
+    assert is_read_only_command(command)
+
+
+@pytest.mark.parametrize("command", [
+    # Programs with forms that write
+    "uniq in.txt out.txt",
+    "date -s '2020-01-01'",
+    "hostname newname",
+    "printf -v var '%s' x",
+    # Writing options of otherwise read-only programs
+    "git diff --output=patch.diff",
+    "git log --output patch.txt",
+    "git show --output=out HEAD",
+    "git diff --ext-diff",
+    "git log -p --ext-diff",
+    "git show --textconv HEAD",
+    "sort -o out.txt in.txt",
+    "sort -ro out.txt in.txt",
+    "sort -oout.txt in.txt",
+    "sort --output=out.txt in.txt",
+    "sort --out=out.txt in.txt",
+    "sort --compress-program=gzip in.txt",
+    "sort --compress-program gzip in.txt",
+    "sort --compress=gzip in.txt",
+    "find . -delete",
+    "tree -o tree.txt",
+    "rg --pre ./script.sh foo",
+    "file -C -m magic",
+    # Shell features with side effects
+    "ls > out.txt",
+    "echo $(rm x)",
+    "sleep 1 &",
+    "cd /tmp",
+    "A=1 ls",
+    "git commit -m x",
+])
+def test_not_read_only(command):
+    assert not is_read_only_command(command)
@@ -0,0 +1,53 @@
+"""
+Tests that the streaming fence detector finds the same blocks as the extractors.
+"""
+
+import pytest
+
+from ollamacode.streaming import FenceDetector
+from ollamacode.utils import BASH_BLOCK_PATTERN, TOOL_BLOCK_PATTERN, parse_tool_call
+
+FIXTURES = [
+    "No blocks here, just `inline` code.",
+    "Listing:\n```bash\nls -la\n```\nDone.",
+    "```sh\necho one\n```\n```shell\necho two\n```",
+    "Read it:\n```tool\n{\"tool\": \"file_read\", \"params\": {\"path\": \"a.txt\"}}\n```\nthen\n```bash\ncat a.txt\n```",
+    "```tool\nnot json\n```\n```tool\n{\"tool\": \"x\"}\n```\n```tool\n{\"tool\": \"x\", \"params\": {}}\n```",
+    "```python\nprint('not run')\n```\n```bash\n\n  pwd  \n\n```",
+    "```bash\necho unfinished",
+    "``` bash\nnot a block\n``````bash\necho adjacent\n``````bash\necho again\n```",
+]
+
+
+def expected(text):
+    blocks = [("bash", match.group(1).strip(), match.end()) for match in BASH_BLOCK_PATTERN.finditer(text)]
+    for match in TOOL_BLOCK_PATTERN.finditer(text):
+        tool_call = parse_tool_call(match.group(1))
+        if tool_call is not None:
+            blocks.append(("tool", tool_call, match.end()))
+    return sorted(blocks, key=lambda block: block[2])
+
+
+def detect(chunks):
+    detector = FenceDetector()
+    blocks = []
+    for chunk in chunks:
+        blocks.extend(detector.feed(chunk))
+    return blocks
+
+
+@pytest.mark.parametrize("text", FIXTURES)
+def test_split_at_every_position(text):
+    for split in range(len(text) + 1):
+        assert detect([text[:split], text[split:]]) == expected(text), f"split at {split}"
+
+
+@pytest.mark.parametrize("text", FIXTURES)
+def test_one_character_at_a_time(text):
+    assert detect(list(text)) == expected(text)
+
+
+def test_disabled_kinds_are_not_detected():
+    text = FIXTURES[3]
+    assert [kind for kind, _, _ in FenceDetector(detect_tools=False).feed(text)] == ["bash"]
+    assert [kind for kind, _, _ in FenceDetector(detect_bash=False).feed(text)] == ["tool"]